@@ -1,20 +1,54 @@
 import sqlite3
-from datetime import datetime
+import time
+import functools
+import logging
+
+import query_metrics
+import query_registry
+
+logger = logging.getLogger('queries')
+
 
 # Decorator to log SQL queries
-def log_queries(func):
+def log_queries(func=None, *, metrics=None):
     """
-    A decorator that logs the SQL query being executed.
+    A decorator that logs the SQL query being executed and times it.
+
+    The wrapped call is measured with `time.perf_counter_ns` and
+    recorded in the latency histogram of the query's fingerprint; calls
+    over the slow-query threshold go to the slow-query log (see
+    query_metrics.py). The query itself is logged at DEBUG level.
+
+    Can be used bare, `@log_queries`, or with arguments,
+    `@log_queries(metrics=QueryMetrics(slow_ms=10))`.
+
+    Args:
+        func (function): The function to be wrapped. It takes the query
+        as its first argument or as `query`.
+        metrics (query_metrics.QueryMetrics): Where timings are
+        recorded, the shared `query_metrics.metrics` when None.
     """
-    def wrapper(*args, **kwargs):
-        # Extract the query to log it
-        starttime = datetime.now()
-        query = args[0] if args else kwargs.get('query')
-        print(f"SQL query Executing: {query}")
-        endtime = datetime.now()
-        # Call the original function with the given arguments
-        return func(*args, **kwargs)
-    return wrapper
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Extract the query to log it
+            query = args[0] if args else kwargs.get('query')
+            logger.debug("SQL query Executing: %s", query)
+            start = time.perf_counter_ns()
+            try:
+                # Call the original function with the given arguments
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                recorder = query_metrics.metrics if metrics is None \
+                    else metrics
+                recorder.record(query, elapsed)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
 
 @log_queries
 def fetch_all_users(query):
@@ -30,16 +64,21 @@ def fetch_all_users(query):
     # Connect to the SQLite database
     conn = sqlite3.connect('users.db')
     cursor = conn.cursor()
-    # Execute the provided SQL query
-    cursor.execute(query)
+    # Execute the provided SQL query, its literals bound as parameters
+    cursor.execute(*query_registry.prepare(query))
     # Fetch all results from the query
     results = cursor.fetchall()
     # Close the database connection
     conn.close()
     return results
 
-# Fetch users while logging the query
-# This will execute the query to select all users and log the SQL query
-users = fetch_all_users(query="SELECT * FROM users")
 
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+
+    # Fetch users while logging the query
+    # This will execute the query to select all users and log the SQL query
+    users = fetch_all_users(query="SELECT * FROM users")
 
+    # Latency percentiles per query fingerprint
+    print(query_metrics.metrics.summary())
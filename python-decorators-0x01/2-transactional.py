@@ -1,6 +1,8 @@
 import sqlite3
 import functools
 
+import cache
+
 
 def with_db_connection(func):
     """
@@ -35,6 +37,9 @@ def transactional(func):
     A decorator that wraps a function to ensure that
     the database transaction is handled automatically.
 
+    Once the transaction is committed, cached query results that read
+    any of the tables it wrote are dropped from the shared query cache.
+
     Args:
         func (function): The function to be wrapped.
 
@@ -43,11 +48,14 @@ def transactional(func):
     """
     def wrapper(conn, *args, **kwargs):
         try:
-            # Call the original function with the connection
-            result = func(conn, *args, **kwargs)
+            # Call the original function with the connection,
+            # recording the tables it writes to
+            with cache.tables_touched(conn, cache.WRITE_ACTIONS) as tables:
+                result = func(conn, *args, **kwargs)
 
             # Commit the transaction if the function completes successfully
             conn.commit()
+            cache.query_cache.invalidate_tables(tables)
             return result
         except sqlite3.Error as e:
             # Rollback the transaction if an error occurs
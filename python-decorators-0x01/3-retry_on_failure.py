@@ -1,6 +1,12 @@
 import time
+import random
 import sqlite3
+import asyncio
+import inspect
 import functools
+import threading
+
+from circuit_breaker import circuit_breaker, db_breaker
 
 
 def with_db_connection(func):
@@ -41,45 +47,181 @@ def with_db_connection(func):
     return wrapper
 
 
-def retry_on_failure(retries=3, delay=1):
+# Error codes of pymysql/MySQLdb errors worth retrying: can't connect,
+# server gone away, lost connection, lock wait timeout, deadlock
+TRANSIENT_MYSQL_CODES = frozenset({2003, 2006, 2013, 1205, 1213})
+TRANSIENT_SQLITE_MESSAGES = ('database is locked', 'database table is locked',
+                             'database is busy')
+
+
+def is_transient(error):
+    """
+    Tell whether an error is likely to go away if the call is retried.
+
+    Locked or busy SQLite databases, dropped connections and timeouts
+    are transient; bad SQL, constraint violations and other errors
+    would fail the same way again and are not.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return any(text in message for text in TRANSIENT_SQLITE_MESSAGES)
+    args = getattr(error, 'args', ())
+    return bool(args) and args[0] in TRANSIENT_MYSQL_CODES \
+        and type(error).__name__ == 'OperationalError'
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the calls that succeed.
+
+    Every success deposits `ratio` of a token and every retry spends a
+    whole one, so while the database keeps failing the retries dry up
+    instead of multiplying the load on it. `min_per_second` tokens are
+    added over time so an idle service can still retry.
     """
-    A decorator that retries the wrapped function if it raises an exception.
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=10):
+        """
+        Args:
+            ratio (float): Tokens deposited per successful call.
+            min_per_second (float): Tokens added per second regardless.
+            max_tokens (float): Most tokens that can be saved up.
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens):
+        now = time.monotonic()
+        tokens += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self.tokens = min(self.max_tokens, self.tokens + tokens)
+
+    def deposit(self):
+        """Record a successful call."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Spend a token on a retry, returning False if none is left."""
+        with self._lock:
+            self._refill(0)
+            if self.tokens < 1:
+                self.exhausted += 1
+                return False
+            self.tokens -= 1
+            return True
+
+
+# Budget shared by every function retried against the database
+retry_budget = RetryBudget()
+
+
+def backoff(attempt, delay, max_delay):
+    """
+    Return the seconds to wait before retry number `attempt` (from 1).
+
+    Full jitter: a uniform draw between 0 and the exponential backoff,
+    so callers that failed together do not all retry together.
+    """
+    return random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+
+
+def retry_on_failure(retries=3, delay=1, max_delay=30, deadline=None,
+                     retry_on=is_transient, budget=retry_budget):
+    """
+    A decorator that retries the wrapped function if it raises a
+    transient error.
 
     Args:
-        retries (int): The number of times to retry
-        the function (default is 3).
-        delay (int): The delay in seconds between
-        retries (default is 1 second).
+        retries (int): The number of times the function is attempted
+        in total (default is 3).
+        delay (float): The base delay in seconds, doubled after every
+        failed attempt (default is 1 second).
+        max_delay (float): The longest delay between two attempts.
+        deadline (float): Seconds after the first attempt after which
+        no retry is started, None for no limit.
+        retry_on (callable): Called with the exception, returns whether
+        it is worth retrying (default `is_transient`).
+        budget (RetryBudget): Shared limit on retries, None for no limit.
 
     Returns:
         function: A wrapped function that retries execution on failure.
 
     Behavior:
-        - If the decorated function raises an exception, the retry mechanism
-          will execute it again up to the specified number of retries.
-        - A delay is applied between each retry attempt.
-        - If all retry attempts fail, the exception is re-raised.
+        - A transient error is retried up to the specified number of
+          attempts, after a random delay of up to `delay * 2 ** n`.
+        - Other errors, an exhausted retry budget or a passed deadline
+          re-raise the exception at once.
+        - Coroutine functions are awaited, and wait with
+          `asyncio.sleep` instead of blocking the thread.
     """
+    def next_delay(attempts, error, started):
+        """Seconds to wait before the next attempt, or None to give up."""
+        print(f"Attempt {attempts} failed: {error}")
+        if attempts >= retries or not retry_on(error):
+            return None
+        wait = backoff(attempts, delay, max_delay)
+        if deadline is not None:
+            remaining = started + deadline - time.monotonic()
+            if remaining <= wait:
+                return None
+        if budget is not None and not budget.withdraw():
+            return None
+        print(f"Retrying in {wait:.2f} seconds...")
+        return wait
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                attempts = 0  # Track the number of attempts
+                started = time.monotonic()
+                while True:
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        attempts += 1
+                        wait = next_delay(attempts, e, started)
+                        if wait is None:
+                            raise
+                        await asyncio.sleep(wait)
+                    else:
+                        if budget is not None:
+                            budget.deposit()
+                        return result
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            attempts = 0  # Track the number of retry attempts
-            while attempts < retries:
+            attempts = 0  # Track the number of attempts
+            started = time.monotonic()
+            while True:
                 try:
                     # Attempt to execute the function
-                    return func(*args, **kwargs)
+                    result = func(*args, **kwargs)
                 except Exception as e:
                     attempts += 1  # Increment the attempt counter
-                    print(f"Attempt {attempts} failed: {e}")
-                    if attempts == retries:
-                        # Raise the exception if maximum retries are reached
-                        raise e
-                    print(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)  # Wait before retrying
+                    wait = next_delay(attempts, e, started)
+                    if wait is None:
+                        # Raise the exception if it should not be retried
+                        raise
+                    time.sleep(wait)  # Wait before retrying
+                else:
+                    if budget is not None:
+                        budget.deposit()
+                    return result
         return wrapper
     return decorator
 
 
+@circuit_breaker(db_breaker)
 @with_db_connection
 @retry_on_failure(retries=3, delay=1)
 def fetch_users_with_retry(conn):
@@ -1,6 +1,11 @@
 import time
 import sqlite3
 import functools
+import inspect
+from contextlib import contextmanager
+
+import cache
+import query_registry
 
 
 def with_db_connection(func):
@@ -43,49 +48,152 @@ def with_db_connection(func):
     return wrapper
 
 
-# A global dictionary to store cached query results
-query_cache = {}
+# Shared, bounded cache of query results (see cache.py); writes made
+# through `transactional` invalidate the entries of the tables they touch
+query_cache = cache.query_cache
+
+
+def database_file(conn):
+    """Return the file `conn` has open, None if it cannot be reopened."""
+    if not isinstance(conn, sqlite3.Connection):
+        return None
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path or None
+    return None
 
 
-def cache_query(func):
+def cache_query(func=None, *, ttl=None, stale_ttl=None, result_cache=None):
     """
     A decorator that caches the results of a function based on a query.
 
-    If the query is found in the cache, the cached result is returned
-    instead of executing the function.
-    Otherwise, the function is executed, and the result is stored in the cache.
+    The cache key is the query together with its bound `params` and any
+    other arguments, so the same query with different parameters gets
+    its own entry. If the key is found in the cache, the cached result
+    is returned instead of executing the function. Otherwise, the
+    function is executed, and the result is stored in the cache, tagged
+    with the tables the query read.
+
+    Concurrent calls that miss the same key execute the function once;
+    the others wait for its result. Once an entry expires it is still
+    returned for `stale_ttl` seconds to every caller, while the
+    function runs again on a background thread with a connection of
+    its own to the same database file. Coroutine functions are
+    supported, waiting callers then await the result instead of
+    blocking; their connection belongs to the caller, so the first
+    caller after expiry refreshes the entry itself.
+
+    Can be used bare, `@cache_query`, or with arguments,
+    `@cache_query(ttl=60, stale_ttl=10)`.
 
     Args:
-        func (function): The function to be wrapped and cached.
+        func (function): The function to be wrapped and cached. It takes
+        the connection first and the query as `query`.
+        ttl (float): Lifetime of the cached results in seconds, the
+        cache's default when None.
+        stale_ttl (float): Seconds an expired result may still be served
+        while it is refreshed, the cache's default when None.
+        result_cache (cache.QueryCache): The cache to use, the shared
+        `query_cache` when None.
 
     Returns:
         function: A wrapped function with caching functionality.
     """
-    def wrapper(*args, **kwargs):
-        # Extract the query from the keyword arguments
-        query = kwargs.get('query')
-
-        # Check if the query is already cached
-        if query in query_cache:
-            print(f"Cache hit for query: {query}")
-            return query_cache[query]
-
-        # If not cached, execute the function and cache the result
-        result = func(*args, **kwargs)
-        query_cache[query] = result
+    def decorator(func):
+        signature = inspect.signature(func)
+        first = next(iter(signature.parameters))
+        # Tables read by each query, found on its first execution
+        read_tables = {}
+
+        def make_key(conn, args, kwargs):
+            arguments = signature.bind(conn, *args, **kwargs).arguments
+            del arguments[first]
+            query = arguments.pop('query')
+            return query, cache.make_key(
+                query, arguments.pop('params', ()), **arguments)
+
+        @contextmanager
+        def tracking(conn, text):
+            # The authorizer only runs on a query's first execution,
+            # and only plain sqlite3 connections have one
+            if text in read_tables or \
+                    not isinstance(conn, sqlite3.Connection):
+                yield
+                return
+            with cache.tables_touched(conn) as tables:
+                yield
+            read_tables[text] = frozenset(tables)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(conn, *args, **kwargs):
+                query, key = make_key(conn, args, kwargs)
+                store = query_cache if result_cache is None else result_cache
+                loaded = False
+
+                async def load():
+                    nonlocal loaded
+                    with tracking(conn, key[0]):
+                        result = await func(conn, *args, **kwargs)
+                    loaded = True
+                    return result, read_tables.get(key[0], ())
+
+                result = await store.aget_or_load(key, load, ttl, stale_ttl,
+                                                  refresh=False)
+                if loaded:
+                    print(f"Query cached: {query}")
+                else:
+                    print(f"Cache hit for query: {query}")
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(conn, *args, **kwargs):
+            query, key = make_key(conn, args, kwargs)
+            store = query_cache if result_cache is None else result_cache
+            loaded = False
+
+            def load():
+                nonlocal loaded
+                # If not cached, execute the function and cache the result
+                with tracking(conn, key[0]):
+                    result = func(conn, *args, **kwargs)
+                loaded = True
+                return result, read_tables.get(key[0], ())
+
+            def refresh():
+                # `conn` is closed once the caller is done with it
+                fresh = sqlite3.connect(path)
+                try:
+                    with tracking(fresh, key[0]):
+                        result = func(fresh, *args, **kwargs)
+                finally:
+                    fresh.close()
+                return result, read_tables.get(key[0], ())
+
+            path = database_file(conn)
+            result = store.get_or_load(key, load, ttl, stale_ttl,
+                                       refresh=refresh if path else False)
+            if loaded:
+                # Log that the query has been cached
+                print(f"Query cached: {query}")
+            else:
+                print(f"Cache hit for query: {query}")
+            return result
 
-        # Log that the query has been cached
-        print(f"Query cached: {query}")
-        return result
+        return wrapper
 
-    return wrapper
+    if func is not None:
+        return decorator(func)
+    return decorator
 
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(*query_registry.prepare(query, params))
     return cursor.fetchall()
 
 
@@ -94,3 +202,6 @@ users = fetch_users_with_cache(query="SELECT * FROM users")
 
 # Second call will use the cached result
 users_again = fetch_users_with_cache(query="SELECT * FROM users")
+
+# Hit, miss and eviction counters of the shared cache
+print(query_cache.stats())
@@ -0,0 +1,126 @@
+"""
+Benchmark: per-call commits vs. group commit for email updates.
+
+Usage: python3 bench_group_commit.py [--rows 1000] [--threads 8]
+           [--updates 200] [--batch 100] [--delay-ms 0] [--profile default]
+
+Runs against a scratch copy of the users schema in a temporary
+directory, never users.db, with the same connection profile (see
+sqlite_profile.py) in every mode. Every thread updates random users'
+emails:
+
+- per_call:  its own connection, one commit per update, as
+             `update_user_email` does under `transactional`
+- group:     `GroupCommitWriter.submit(...).result()`, each caller still
+             waiting for its own update to be committed
+- pipelined: all of a thread's updates submitted before waiting
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import sqlite_profile
+from group_commit import GroupCommitWriter
+
+UPDATE = "UPDATE users SET email = ? WHERE id = ?"
+
+
+def create_database(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL
+        )""")
+    conn.executemany(
+        "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+        ((f'user{i}', f'user{i}@example.com', 'secret')
+         for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def _updates(rows, count, seed):
+    rng = random.Random(seed)
+    return [(f'new{rng.random()}@example.com', rng.randint(1, rows))
+            for _ in range(count)]
+
+
+def per_call(path, profile, updates):
+    conn = sqlite_profile.connect(path, profile, timeout=60)
+    for params in updates:
+        conn.execute(UPDATE, params)
+        conn.commit()
+    conn.close()
+
+
+def group(writer, updates):
+    for params in updates:
+        writer.submit(UPDATE, params).result()
+
+
+def pipelined(writer, updates):
+    for future in [writer.submit(UPDATE, params) for params in updates]:
+        future.result()
+
+
+def run(mode, path, args):
+    work = [_updates(args.rows, args.updates, seed)
+            for seed in range(args.threads)]
+    writer = None
+    if mode == 'per_call':
+        threads = [threading.Thread(target=per_call,
+                                    args=(path, args.profile, updates))
+                   for updates in work]
+    else:
+        writer = GroupCommitWriter(path, max_batch=args.batch,
+                                   max_delay_ms=args.delay_ms,
+                                   profile=args.profile)
+        target = group if mode == 'group' else pipelined
+        threads = [threading.Thread(target=target, args=(writer, updates))
+                   for updates in work]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = args.threads * args.updates
+    line = f"{mode:<10} {total:>7} updates {elapsed:>8.3f}s " \
+           f"{total / elapsed:>10.0f} updates/s"
+    if writer is not None:
+        writer.close()
+        line += f"  ({writer.batches} commits)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=200,
+                        help="updates per thread")
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--delay-ms', type=float, default=0)
+    parser.add_argument('--profile', default='default',
+                        choices=sorted(sqlite_profile.PROFILES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('per_call', 'group', 'pipelined'):
+            path = os.path.join(directory, f'{mode}.db')
+            create_database(path, args.rows)
+            run(mode, path, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: read/write throughput and concurrency per SQLite profile.
+
+Usage: python3 bench_sqlite_profile.py [--rows 10000] [--seconds 2]
+           [--readers 4] [--profiles default,wal,durable]
+
+Runs against a scratch copy of the users schema in a temporary
+directory, never users.db. For every profile in sqlite_profile.PROFILES:
+
+- reads:   point lookups by id per second, one connection
+- writes:  single-row updates per second, one commit each
+- mixed:   one writer committing updates while `--readers` threads run
+           lookups, each on its own connection; reports both rates and
+           how often a reader or the writer hit "database is locked"
+
+Every connection waits at most 0.1 s on a lock, whatever the profile's
+busy_timeout, so the locked counts are comparable across profiles.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import sqlite_profile
+from bench_group_commit import UPDATE, create_database
+
+SELECT = "SELECT * FROM users WHERE id = ?"
+
+
+def _loop(seconds, step):
+    """Call step() until `seconds` pass, returning (done, locked)."""
+    done = locked = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            step()
+            done += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    return done, locked
+
+
+def _reader(path, profile, rows, seconds, results):
+    conn = sqlite_profile.connect(path, profile, timeout=0.1)
+    rng = random.Random()
+    results.append(_loop(seconds, lambda: conn.execute(
+        SELECT, (rng.randint(1, rows),)).fetchone()))
+    conn.close()
+
+
+def _writer(path, profile, rows, seconds, results):
+    conn = sqlite_profile.connect(path, profile, timeout=0.1)
+    rng = random.Random()
+
+    def step():
+        try:
+            conn.execute(UPDATE, (f'{rng.random()}@example.com',
+                                  rng.randint(1, rows)))
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            raise
+
+    results.append(_loop(seconds, step))
+    conn.close()
+
+
+def bench(path, profile, args):
+    reads = []
+    _reader(path, profile, args.rows, args.seconds, reads)
+    writes = []
+    _writer(path, profile, args.rows, args.seconds, writes)
+
+    mixed_reads, mixed_writes = [], []
+    threads = [threading.Thread(target=_reader, args=(
+        path, profile, args.rows, args.seconds, mixed_reads))
+        for _ in range(args.readers)]
+    threads.append(threading.Thread(target=_writer, args=(
+        path, profile, args.rows, args.seconds, mixed_writes)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    seconds = args.seconds
+    print(f"{profile:<8} reads {reads[0][0] / seconds:>9.0f}/s  "
+          f"writes {writes[0][0] / seconds:>7.0f}/s  "
+          f"mixed reads {sum(r[0] for r in mixed_reads) / seconds:>9.0f}/s "
+          f"writes {mixed_writes[0][0] / seconds:>7.0f}/s  "
+          f"locked {sum(r[1] for r in mixed_reads) + mixed_writes[0][1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=2)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--profiles', default=','.join(
+        sqlite_profile.PROFILES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in args.profiles.split(','):
+            path = os.path.join(directory, f'{profile}.db')
+            create_database(path, args.rows)
+            bench(path, profile, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+Bounded query result cache shared by `cache_query` and `transactional`.
+
+`QueryCache` keeps results in least-recently-used order and evicts the
+oldest once it holds more than `max_entries` results or `max_bytes` of
+them. Entries can expire after a TTL, and every entry remembers the
+tables its query read, so a write to a table drops exactly the results
+that depend on it:
+
+    query_cache.set(key, rows, tables={'users'})
+    query_cache.invalidate_tables({'users'})
+
+The tables a query reads or writes are found with an SQLite authorizer
+(`tables_touched`), which sees the statements as SQLite compiles them,
+so no SQL parsing is involved.
+
+`get_or_load` (and `aget_or_load` for coroutines) add single-flight
+loading: when many callers miss the same key at once, one of them runs
+the query and the others wait for its result. With a `stale_ttl`, an
+expired entry is still served for that long while a single background
+refresh replaces it, so no caller of a hot query waits for it.
+
+Where the entries live is up to a backend (see cache_backends.py): an
+in-process LRU dict by default, or a file shared by several processes.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import cache_backends
+import query_registry
+from cache_backends import Entry, MemoryBackend
+
+READ_ACTIONS = frozenset({sqlite3.SQLITE_READ})
+WRITE_ACTIONS = frozenset({sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE,
+                           sqlite3.SQLITE_DELETE, sqlite3.SQLITE_DROP_TABLE})
+
+_MISSING = object()
+
+
+def make_key(query, params=(), **extra):
+    """
+    Build a cache key from a query and its bound parameters.
+
+    The query is normalized with `query_registry.prepare`, so calls that
+    differ only in formatting, or in whether a value is inline or bound,
+    share an entry. `extra` holds any other arguments that change the
+    result.
+    """
+    query, params = query_registry.prepare(query, params)
+    if isinstance(params, dict):
+        params = tuple(sorted(params.items()))
+    return query, tuple(params), tuple(sorted(extra.items()))
+
+
+@contextmanager
+def tables_touched(conn, actions=READ_ACTIONS):
+    """
+    Collect the tables statements run inside the block read or write.
+
+    Installing an authorizer makes SQLite re-prepare the connection's
+    cached statements, so this is meant for the first run of a query
+    or for writes, not for every read.
+
+    Args:
+        conn (sqlite3.Connection): The connection the statements run on.
+        actions (frozenset): Authorizer action codes to record, e.g.
+            READ_ACTIONS or WRITE_ACTIONS.
+
+    Yields:
+        set: Lower-cased table names, filled in as statements run.
+    """
+    tables = set()
+
+    def authorizer(action, arg1, arg2, dbname, source):
+        if action in actions and arg1:
+            tables.add(arg1.lower())
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        yield tables
+    finally:
+        conn.set_authorizer(None)
+
+
+class QueryCache:
+    """
+    A thread-safe cache of query results with TTLs and table tags.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None,
+                 stale_ttl=0, backend=None):
+        """
+        Create an empty cache.
+
+        Args:
+            max_entries (int): Maximum number of cached results.
+            max_bytes (int): Maximum total `result_size` of the cached
+                results, None for no limit.
+            ttl (float): Default lifetime of an entry in seconds, None
+                to keep entries until they are evicted or invalidated.
+            stale_ttl (float): Default number of seconds an expired
+                entry may still be served by `get_or_load` while it is
+                being refreshed.
+            backend (cache_backends.CacheBackend): Where entries are
+                stored. A `MemoryBackend` holding `max_entries` and
+                `max_bytes` when None; other backends have their own
+                limits.
+        """
+        if backend is None:
+            backend = MemoryBackend(max_entries, max_bytes)
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # Futures of the loads in progress, by key
+        self._flights = {}
+        # Background refresh tasks, referenced until they finish
+        self._tasks = set()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        # Bumped by every invalidation, see `set(since=...)`
+        self.generation = 0
+
+    def __len__(self):
+        return self.backend.stats()['entries']
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count=True):
+        """
+        Return the cached result for `key`, or `default`.
+
+        Args:
+            key: A key from `make_key`.
+            default: Returned when the key is missing or expired.
+            count (bool): Whether to count the lookup as a hit or miss.
+        """
+        with self._lock:
+            entry, fresh = self._lookup(key)
+            if not fresh:
+                if count:
+                    self.misses += 1
+                return default
+            if count:
+                self.hits += 1
+            return entry.value
+
+    def _lookup(self, key):
+        """
+        Find an entry, dropping it once it is past its stale window.
+
+        Returns:
+            tuple: (entry or None, whether it is fresh).
+        """
+        entry = self.backend.get(key)
+        if entry is None or entry.expires is None:
+            return entry, entry is not None
+        now = time.time()
+        if entry.stale_until <= now:
+            self.backend.delete(key)
+            self.expirations += 1
+            return None, False
+        return entry, entry.expires > now
+
+    def set(self, key, value, ttl=None, tables=(), since=None,
+            stale_ttl=None):
+        """
+        Cache a result, evicting the least recently used as needed.
+
+        Args:
+            key: A key from `make_key`.
+            value: The result to cache.
+            ttl (float): Lifetime in seconds, the cache default if None.
+            tables (iterable): Tables the result was read from.
+            since (int): The `generation` read before the result was
+                computed. If anything was invalidated in the meantime
+                the result may predate a write and is not cached.
+            stale_ttl (float): Seconds the entry may be served stale
+                after it expires, the cache default if None.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        expires = stale_until = None
+        if ttl is not None:
+            expires = time.time() + ttl
+            stale_until = expires + (stale_ttl or 0)
+        entry = Entry(value, expires, stale_until, tables)
+        with self._lock:
+            if since is not None and since != self.generation:
+                return
+            self.backend.set(key, entry)
+
+    def _claim(self, key, background=True):
+        """
+        Decide how a `get_or_load` call for `key` gets its result.
+
+        Returns:
+            tuple: ('hit', value), ('stale', value), ('wait', future),
+            ('load', (future, generation)) for the one caller that has
+            to load the result and resolve the future, or ('refresh',
+            (value, future, generation)) for the one caller that
+            returns a stale value and starts the background refresh.
+        """
+        with self._lock:
+            entry, fresh = self._lookup(key)
+            if fresh:
+                self.hits += 1
+                return 'hit', entry.value
+            future = self._flights.get(key)
+            if future is not None:
+                if entry is not None:
+                    self.stale_hits += 1
+                    return 'stale', entry.value
+                self.coalesced += 1
+                return 'wait', future
+            future = self._flights[key] = Future()
+            if entry is not None and background:
+                self.stale_hits += 1
+                return 'refresh', (entry.value, future, self.generation)
+            self.misses += 1
+            return 'load', (future, self.generation)
+
+    def _settle(self, key, future, generation, outcome, error, ttl,
+                stale_ttl):
+        """Store a loaded result and hand it to the waiting callers."""
+        try:
+            if error is None:
+                value, tables = outcome
+                self.set(key, value, ttl=ttl, tables=tables,
+                         since=generation, stale_ttl=stale_ttl)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            if error is None:
+                future.set_result(outcome[0])
+            else:
+                future.set_exception(error)
+
+    def _load(self, key, load, future, generation, ttl, stale_ttl):
+        outcome = error = None
+        try:
+            outcome = load()
+        except BaseException as e:
+            error = e
+        self._settle(key, future, generation, outcome, error, ttl,
+                     stale_ttl)
+
+    async def _aload(self, key, load, future, generation, ttl, stale_ttl):
+        outcome = error = None
+        try:
+            outcome = await load()
+        except BaseException as e:
+            error = e
+        self._settle(key, future, generation, outcome, error, ttl,
+                     stale_ttl)
+
+    def get_or_load(self, key, load, ttl=None, stale_ttl=None,
+                    refresh=None):
+        """
+        Return the cached result for `key`, loading it at most once.
+
+        Concurrent callers that miss the same key share one call of
+        `load`: the first runs it and the others block until it is
+        done, then get its result (or its exception). An expired entry
+        still inside its stale window is returned right away to every
+        caller, and the first of them starts a refresh on a background
+        thread; a failed refresh leaves the stale entry for the next
+        caller to try again.
+
+        Args:
+            key: A key from `make_key`.
+            load (callable): Called without arguments, returns a
+                (result, tables read) pair.
+            ttl (float): Lifetime in seconds, the cache default if None.
+            stale_ttl (float): Stale window, the cache default if None.
+            refresh (callable): Loader run on the background thread,
+                `load` if None. False refreshes a stale entry in the
+                calling thread, for a `load` that only works there.
+
+        Returns:
+            The cached or freshly loaded result.
+        """
+        state, value = self._claim(key, background=refresh is not False)
+        if state in ('hit', 'stale'):
+            return value
+        if state == 'wait':
+            return value.result()
+        if state == 'refresh':
+            stale, future, generation = value
+            threading.Thread(
+                target=self._load, name='query-cache-refresh', daemon=True,
+                args=(key, refresh or load, future, generation, ttl,
+                      stale_ttl)).start()
+            return stale
+
+        future, generation = value
+        self._load(key, load, future, generation, ttl, stale_ttl)
+        return future.result()
+
+    async def aget_or_load(self, key, load, ttl=None, stale_ttl=None,
+                           refresh=None):
+        """
+        Coroutine version of `get_or_load`.
+
+        `load` and `refresh` are coroutine functions, and a stale
+        entry is refreshed by a task on the running event loop.
+        Waiting callers await the shared result without blocking the
+        event loop, and may come from other threads or event loops
+        than the loading one.
+        """
+        state, value = self._claim(key, background=refresh is not False)
+        if state in ('hit', 'stale'):
+            return value
+        if state == 'wait':
+            return await asyncio.wrap_future(value)
+        if state == 'refresh':
+            stale, future, generation = value
+            task = asyncio.get_running_loop().create_task(self._aload(
+                key, refresh or load, future, generation, ttl, stale_ttl))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return stale
+
+        future, generation = value
+        await self._aload(key, load, future, generation, ttl, stale_ttl)
+        return future.result()
+
+    def invalidate(self, key):
+        """Drop one entry, returning whether it was cached."""
+        with self._lock:
+            self.generation += 1
+            if not self.backend.delete(key):
+                return False
+            self.invalidations += 1
+            return True
+
+    def invalidate_tables(self, tables):
+        """
+        Drop every entry that read one of `tables`.
+
+        Returns:
+            int: The number of entries dropped.
+        """
+        with self._lock:
+            self.generation += 1
+            dropped = self.backend.invalidate_tables(
+                {table.lower() for table in tables})
+            self.invalidations += dropped
+            return dropped
+
+    def clear(self):
+        """Drop every entry, keeping the counters."""
+        with self._lock:
+            self.generation += 1
+            self.backend.clear()
+
+    def stats(self):
+        """
+        Return the cache counters, e.g. for a metrics endpoint.
+
+        Returns:
+            dict: hits, misses, stale_hits (expired entries served while
+            refreshed in the background), coalesced (callers that
+            waited for another's load), expirations, invalidations, and
+            the backend's evictions, rejected (results too large or not
+            serializable for it), entries and bytes. The counters are this
+            process's; entries and bytes cover a shared backend.
+        """
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses,
+                     'stale_hits': self.stale_hits,
+                     'coalesced': self.coalesced,
+                     'expirations': self.expirations,
+                     'invalidations': self.invalidations}
+        stats.update(self.backend.stats())
+        return stats
+
+
+# Cache shared by cache_query and transactional, in process memory unless
+# QUERY_CACHE_BACKEND names a shared one, see `cache_backends.open_backend`
+query_cache = QueryCache(max_entries=256, max_bytes=16 * 1024 * 1024,
+                         ttl=300, stale_ttl=30,
+                         backend=cache_backends.open_backend(
+                             os.getenv('QUERY_CACHE_BACKEND')))
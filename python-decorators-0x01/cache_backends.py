@@ -0,0 +1,623 @@
+"""
+Storage backends for `cache.QueryCache`.
+
+A backend stores `Entry` objects by key and enforces its own capacity.
+The cache itself handles TTLs, single-flight loading and counters, so a
+backend only has to implement `get`, `set`, `delete`,
+`invalidate_tables`, `clear` and `stats`.
+
+- `MemoryBackend`: an in-process LRU dict, the default.
+- `MmapBackend`: a fixed-size, set-associative table in a memory-mapped
+  file, shared by every process on the host that opens the same path.
+- `SQLiteBackend`: a table in an SQLite file, shared by processes and
+  kept across restarts.
+
+The shared backends store results serialized with `dumps`: rows of
+str/int/float/bytes/None, which is all sqlite3 returns, go through
+`marshal`, which round-trips them faster than pickle at about the same
+size and without running any code on load. There is deliberately no
+pickle fallback, since the files are shared between processes: a
+result marshal cannot write is not cached. Both backends create their
+files readable by the owner only. Every backend counts the results it
+refused, too large or not serializable, as `rejected` in `stats()`.
+Times are wall-clock (`time.time()`) so they mean the same in every
+process.
+
+    cache = QueryCache(backend=SQLiteBackend('query_cache.db'))
+"""
+
+import fcntl
+import hashlib
+import marshal
+import math
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_MARSHAL = b'M'
+
+
+def dumps(value):
+    """
+    Serialize a result with marshal.
+
+    Raises:
+        ValueError: If the result holds a type marshal cannot write.
+    """
+    return _MARSHAL + marshal.dumps(value)
+
+
+def loads(data):
+    """Deserialize a result written by `dumps`."""
+    if data[:1] != _MARSHAL:
+        raise ValueError("Not a result written by dumps")
+    return marshal.loads(data[1:])
+
+
+def key_digest(key):
+    """
+    Hash a cache key to 16 bytes, the same in every process.
+
+    marshal version 2 writes no back-references, so equal keys always
+    give equal bytes.
+    """
+    try:
+        data = marshal.dumps(key, 2)
+    except ValueError:
+        data = pickle.dumps(key, 4)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def result_size(value):
+    """Approximate memory used by a result: a list of row tuples."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, tuple):
+                size += sum(sys.getsizeof(item) for item in row)
+    return size
+
+
+class Entry:
+    """
+    A cached result.
+
+    `expires` and `stale_until` are `time.time()` values, None for an
+    entry that never expires. `tables` are the tables it was read from.
+    """
+
+    __slots__ = ('value', 'expires', 'stale_until', 'tables')
+
+    def __init__(self, value, expires=None, stale_until=None, tables=()):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.tables = frozenset(tables)
+
+
+class CacheBackend:
+    """Interface implemented by every backend."""
+
+    def get(self, key):
+        """Return the `Entry` for `key`, marking it recently used, or None."""
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        """
+        Store an entry, evicting others as needed. An entry the backend
+        cannot hold is dropped and counted as rejected.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Drop one entry, returning whether it was stored."""
+        raise NotImplementedError
+
+    def invalidate_tables(self, tables):
+        """Drop the entries read from any of `tables`, returning how many."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every entry."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return a dict with at least entries, bytes, evictions, rejected."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release files or connections held by the backend."""
+
+
+class MemoryBackend(CacheBackend):
+    """
+    LRU dict of entries, private to the process.
+
+    Values are kept as they are, not serialized; their size is
+    estimated with `result_size`.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        """
+        Args:
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Maximum total `result_size` of the values,
+                None for no limit.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._by_table = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.rejected = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = result_size(entry.value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._bytes += size
+            for table in entry.tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None
+                    and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= self._sizes.pop(key)
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def invalidate_tables(self, tables):
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._by_table.get(table, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'evictions': self.evictions, 'rejected': self.rejected}
+
+
+class MmapBackend(CacheBackend):
+    """
+    Set-associative cache table in a memory-mapped file.
+
+    The file holds `slots` fixed-size slots grouped in sets of `ways`.
+    A key hashes to one set, and a new entry replaces the least
+    recently used slot of its set, so lookups and evictions only ever
+    touch `ways` slots. Every process that maps the same file sees the
+    same entries; an `flock` on the file serializes access between
+    processes, a lock between threads.
+
+    Results larger than a slot, less its 46-byte header and the table
+    names, are not cached and count as rejected. The default 128 KiB
+    slots hold a few thousand rows of `users`; the file is sparse, so
+    only the slots written take up memory or disk.
+    """
+
+    MAGIC = b'QCMMAP01'
+    # magic, slots, slot size, ways
+    HEADER = struct.Struct('<8sIII')
+    HEADER_SIZE = 64
+    # key digest, expires, stale until, last used, value and tables length
+    SLOT = struct.Struct('<16sdddIH')
+    USED_OFFSET = 32
+    EMPTY = bytes(16)
+
+    def __init__(self, path, slots=512, slot_size=128 * 1024, ways=8):
+        """
+        Open the table at `path`, creating it if needed.
+
+        A file created with a different geometry is reset.
+
+        Args:
+            path (str): File shared by the processes.
+            slots (int): Number of slots, a multiple of `ways`.
+            slot_size (int): Bytes per slot, entry header included.
+            ways (int): Slots per set.
+        """
+        if slots < ways or slots % ways:
+            raise ValueError("slots must be a positive multiple of ways")
+        if slot_size <= self.SLOT.size:
+            raise ValueError(f"slot_size must exceed {self.SLOT.size}")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ways = ways
+        self.sets = slots // ways
+        self.evictions = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        length = self.HEADER_SIZE + slots * slot_size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            expected = self.HEADER.pack(self.MAGIC, slots, slot_size, ways)
+            if header != expected or os.fstat(self._fd).st_size != length:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, length)
+                os.pwrite(self._fd, expected, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, length)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index):
+        return self.HEADER_SIZE + index * self.slot_size
+
+    def _set_slots(self, digest):
+        first = int.from_bytes(digest[:8], 'little') % self.sets * self.ways
+        return range(first, first + self.ways)
+
+    def _read(self, index):
+        return self.SLOT.unpack_from(self._map, self._offset(index))
+
+    @staticmethod
+    def _time(value):
+        return None if math.isinf(value) else value
+
+    def get(self, key):
+        digest = key_digest(key)
+        with self._locked():
+            for index in self._set_slots(digest):
+                slot_digest, expires, stale_until, _, length, tables_length \
+                    = self._read(index)
+                if slot_digest != digest:
+                    continue
+                start = self._offset(index) + self.SLOT.size
+                tables = bytes(self._map[start:start + tables_length])
+                data = bytes(self._map[start + tables_length:
+                                       start + tables_length + length])
+                # Update the last used time only
+                struct.pack_into('<d', self._map,
+                                 self._offset(index) + self.USED_OFFSET,
+                                 time.time())
+                break
+            else:
+                return None
+        return Entry(loads(data), self._time(expires),
+                     self._time(stale_until),
+                     tables.decode().split(',') if tables else ())
+
+    def set(self, key, entry):
+        digest = key_digest(key)
+        tables = ','.join(sorted(entry.tables)).encode()
+        try:
+            data = dumps(entry.value)
+        except ValueError:
+            data = None
+        if data is None or (self.SLOT.size + len(tables) + len(data)
+                            > self.slot_size):
+            with self._lock:
+                self.rejected += 1
+            return
+        header = self.SLOT.pack(
+            digest,
+            math.inf if entry.expires is None else entry.expires,
+            math.inf if entry.stale_until is None else entry.stale_until,
+            time.time(), len(data), len(tables))
+        with self._locked():
+            # The key's own slot wins over an empty one, so a key is never
+            # stored twice in its set, and an empty one over eviction
+            matches, empty = [], None
+            lru, oldest = None, math.inf
+            for index in self._set_slots(digest):
+                slot_digest, _, _, used, _, _ = self._read(index)
+                if slot_digest == digest:
+                    matches.append(index)
+                elif slot_digest == self.EMPTY:
+                    if empty is None:
+                        empty = index
+                elif used < oldest:
+                    lru, oldest = index, used
+            if matches:
+                victim = matches[0]
+                for index in matches[1:]:
+                    self._clear_slot(index)
+            elif empty is not None:
+                victim = empty
+            else:
+                victim = lru
+                self.evictions += 1
+            start = self._offset(victim)
+            self._map[start:start + len(header)] = header
+            start += len(header)
+            self._map[start:start + len(tables)] = tables
+            start += len(tables)
+            self._map[start:start + len(data)] = data
+
+    def _clear_slot(self, index):
+        start = self._offset(index)
+        self._map[start:start + 16] = self.EMPTY
+
+    def delete(self, key):
+        digest = key_digest(key)
+        deleted = False
+        with self._locked():
+            for index in self._set_slots(digest):
+                if self._read(index)[0] == digest:
+                    self._clear_slot(index)
+                    deleted = True
+        return deleted
+
+    def invalidate_tables(self, tables):
+        tables = set(tables)
+        dropped = 0
+        with self._locked():
+            for index in range(self.slots):
+                slot_digest, _, _, _, _, tables_length = self._read(index)
+                if slot_digest == self.EMPTY or not tables_length:
+                    continue
+                start = self._offset(index) + self.SLOT.size
+                names = bytes(self._map[start:start + tables_length])
+                if tables.intersection(names.decode().split(',')):
+                    self._clear_slot(index)
+                    dropped += 1
+        return dropped
+
+    def clear(self):
+        with self._locked():
+            for index in range(self.slots):
+                self._clear_slot(index)
+
+    def stats(self):
+        entries = size = 0
+        with self._locked():
+            for index in range(self.slots):
+                slot_digest, _, _, _, length, _ = self._read(index)
+                if slot_digest != self.EMPTY:
+                    entries += 1
+                    size += length
+        return {'entries': entries, 'bytes': size,
+                'evictions': self.evictions, 'rejected': self.rejected}
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache table in an SQLite database file.
+
+    Entries survive restarts and are shared by every process using the
+    same file (in WAL mode, so readers do not block on a writer). The
+    last-used time of an entry is refreshed at most once per
+    `touch_interval` seconds, which keeps most hits read-only.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key BLOB PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires REAL,
+            stale_until REAL,
+            used REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS cache_entries_used
+            ON cache_entries (used);
+        CREATE TABLE IF NOT EXISTS cache_tables (
+            name TEXT NOT NULL,
+            key BLOB NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS cache_tables_key ON cache_tables (key);
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=None,
+                 touch_interval=1.0):
+        """
+        Open the cache database at `path`, creating it if needed.
+
+        Args:
+            path (str): SQLite database file.
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Maximum total size of the serialized
+                values, None for no limit.
+            touch_interval (float): Minimum seconds between two updates
+                of an entry's last-used time.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.evictions = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        # Owner-only, as MmapBackend's file; SQLite gives its -wal and
+        # -shm files the same permissions
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._conn = sqlite3.connect(path, timeout=5,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def get(self, key):
+        digest = key_digest(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires, stale_until, used "
+                "FROM cache_entries WHERE key = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[3] >= self.touch_interval:
+                self._conn.execute(
+                    "UPDATE cache_entries SET used = ? WHERE key = ?",
+                    (now, digest))
+        return Entry(loads(row[0]), row[1], row[2])
+
+    def set(self, key, entry):
+        digest = key_digest(key)
+        try:
+            data = dumps(entry.value)
+        except ValueError:
+            data = None
+        if data is None or (self.max_bytes is not None
+                            and len(data) > self.max_bytes):
+            with self._lock:
+                self.rejected += 1
+            return
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (digest, data, entry.expires, entry.stale_until,
+                     time.time()))
+                conn.execute("DELETE FROM cache_tables WHERE key = ?",
+                             (digest,))
+                conn.executemany("INSERT INTO cache_tables VALUES (?, ?)",
+                                 [(table, digest) for table in entry.tables])
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, conn):
+        count, size = conn.execute(
+            "SELECT COUNT(*), TOTAL(LENGTH(value)) "
+            "FROM cache_entries").fetchone()
+        while count > self.max_entries or (
+                self.max_bytes is not None and size > self.max_bytes):
+            key, length = conn.execute(
+                "SELECT key, LENGTH(value) FROM cache_entries "
+                "ORDER BY used LIMIT 1").fetchone()
+            self._delete(conn, key)
+            count -= 1
+            size -= length
+            self.evictions += 1
+
+    @staticmethod
+    def _delete(conn, digest):
+        conn.execute("DELETE FROM cache_tables WHERE key = ?", (digest,))
+        return conn.execute("DELETE FROM cache_entries WHERE key = ?",
+                            (digest,)).rowcount
+
+    def delete(self, key):
+        with self._lock:
+            return self._delete(self._conn, key_digest(key)) > 0
+
+    def invalidate_tables(self, tables):
+        tables = list(tables)
+        if not tables:
+            return 0
+        marks = ', '.join('?' * len(tables))
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                dropped = conn.execute(
+                    "DELETE FROM cache_entries WHERE key IN (SELECT key "
+                    f"FROM cache_tables WHERE name IN ({marks}))",
+                    tables).rowcount
+                conn.execute("DELETE FROM cache_tables WHERE key NOT IN "
+                             "(SELECT key FROM cache_entries)")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+            self._conn.execute("DELETE FROM cache_tables")
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), TOTAL(LENGTH(value)) "
+                "FROM cache_entries").fetchone()
+        return {'entries': count, 'bytes': int(size),
+                'evictions': self.evictions, 'rejected': self.rejected}
+
+    def close(self):
+        self._conn.close()
+
+
+BACKENDS = {'memory': MemoryBackend, 'mmap': MmapBackend,
+            'sqlite': SQLiteBackend}
+
+
+def open_backend(spec):
+    """
+    Open a backend from a 'kind:path' string, e.g. 'mmap:/dev/shm/qc'
+    or 'sqlite:query_cache.db'.
+
+    Returns:
+        CacheBackend: The backend, or None for an empty spec or
+        'memory', meaning the cache's default.
+    """
+    if not spec or spec == 'memory':
+        return None
+    kind, _, path = spec.partition(':')
+    if kind not in BACKENDS or kind == 'memory' or not path:
+        raise ValueError(f"Unknown cache backend: {spec!r}")
+    return BACKENDS[kind](path)
@@ -0,0 +1,231 @@
+"""
+Circuit breaker for database calls.
+
+While the database is healthy the breaker is closed and calls go
+through. After `failure_threshold` consecutive failures it opens, and
+for `recovery_timeout` seconds every call fails at once with
+`CircuitOpenError` instead of waiting for a connect timeout. Then it
+turns half-open: a few trial calls are let through, and the breaker
+closes again if they succeed or reopens if one fails.
+
+Put it outside `with_db_connection`, so no connection is even opened
+while it is open, and outside `retry_on_failure`, so one call counts
+once however many attempts it made:
+
+    @circuit_breaker(db_breaker)
+    @with_db_connection
+    @retry_on_failure(retries=3, delay=1)
+    def fetch_users(conn):
+        ...
+
+`CircuitOpenError` is not a transient error, so a retry decorator placed
+outside the breaker does not retry it either.
+"""
+
+import functools
+import inspect
+import sqlite3
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling through an open circuit breaker."""
+
+    def __init__(self, breaker, retry_in):
+        super().__init__(f"Circuit {breaker.name!r} is open, "
+                         f"retry in {retry_in:.1f} seconds")
+        self.breaker = breaker
+        self.retry_in = retry_in
+
+
+def is_outage(error):
+    """
+    Tell whether an error means the database itself is unhealthy.
+
+    Operational and interface errors, connection errors and timeouts
+    count; bad SQL, constraint violations and application errors do
+    not, they would trip the breaker on a healthy database.
+    """
+    if isinstance(error, (sqlite3.OperationalError, sqlite3.InterfaceError,
+                          ConnectionError, TimeoutError)):
+        return True
+    # pymysql and MySQLdb name their errors the same way
+    return type(error).__name__ in ('OperationalError', 'InterfaceError')
+
+
+class CircuitBreaker:
+    """A thread-safe closed/open/half-open circuit breaker."""
+
+    def __init__(self, name='database', failure_threshold=5,
+                 recovery_timeout=30, half_open_calls=1,
+                 failure_on=is_outage):
+        """
+        Args:
+            name (str): Shown in errors and monitoring.
+            failure_threshold (int): Consecutive failures that open it.
+            recovery_timeout (float): Seconds it stays open before the
+                first trial call.
+            half_open_calls (int): Trial calls let through at once while
+                half-open.
+            failure_on (callable): Called with an exception, returns
+                whether it counts as a failure. Other exceptions still
+                propagate, but count as a success: the database answered.
+        """
+        if failure_threshold < 1 or half_open_calls < 1:
+            raise ValueError("failure_threshold and half_open_calls "
+                             "must be at least 1")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.failure_on = failure_on
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+        self.failures = 0  # consecutive, reset by a success
+        self.trips = 0
+        self.recoveries = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        """CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            if self._state == OPEN and self._retry_in() <= 0:
+                return HALF_OPEN
+            return self._state
+
+    def _retry_in(self):
+        return self._opened_at + self.recovery_timeout - time.monotonic()
+
+    def before_call(self):
+        """
+        Let a call through or reject it.
+
+        Raises:
+            CircuitOpenError: While open, or half-open with every trial
+                slot taken.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                retry_in = self._retry_in()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self, retry_in)
+                self._state = HALF_OPEN
+                self._trials = 0
+            if self._state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self, 0)
+                self._trials += 1
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self.recoveries += 1
+
+    def on_failure(self, error):
+        """Record an exception raised by a call let through."""
+        if not self.failure_on(error):
+            self.on_success()
+            return
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or (
+                    self._state == CLOSED
+                    and self.failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self.trips += 1
+
+    def release(self):
+        """Give back the trial slot of a call that was interrupted."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def reset(self):
+        """Close the breaker by hand."""
+        with self._lock:
+            self._state = CLOSED
+            self.failures = 0
+
+    def stats(self):
+        """
+        Return the breaker's state and counters for monitoring.
+
+        Returns:
+            dict: name, state, failures (consecutive), trips,
+            recoveries and rejected calls.
+        """
+        state = self.state
+        with self._lock:
+            return {'name': self.name, 'state': state,
+                    'failures': self.failures, 'trips': self.trips,
+                    'recoveries': self.recoveries,
+                    'rejected': self.rejected}
+
+    def __call__(self, func):
+        """Use the breaker itself as a decorator."""
+        return circuit_breaker(self)(func)
+
+
+def circuit_breaker(breaker=None):
+    """
+    A decorator that guards the wrapped function with a circuit breaker.
+
+    Args:
+        breaker (CircuitBreaker): The breaker to use, shared by every
+        function talking to the same database; the module's
+        `db_breaker` when None.
+
+    Returns:
+        function: A decorator for plain or coroutine functions.
+    """
+    def decorator(func):
+        guard = db_breaker if breaker is None else breaker
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                guard.before_call()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    guard.on_failure(e)
+                    raise
+                except BaseException:
+                    guard.release()
+                    raise
+                guard.on_success()
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            guard.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                guard.on_failure(e)
+                raise
+            except BaseException:
+                guard.release()
+                raise
+            guard.on_success()
+            return result
+        return wrapper
+    return decorator
+
+
+# Breaker shared by the functions using users.db
+db_breaker = CircuitBreaker('users.db')
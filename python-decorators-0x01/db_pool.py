@@ -0,0 +1,376 @@
+"""
+Pooled SQLite connections for the decorators in this directory.
+
+`with_db_connection` here is a drop-in replacement for the one in
+1-with_db_connection.py: it hands the wrapped function a connection as
+its first argument, commits on success and rolls back on a database
+error, but borrows the connection from a `ConnectionPool` instead of
+opening and closing one per call. A reused connection keeps its parsed
+schema and statement cache, so short queries no longer pay for
+`sqlite3.connect` every time. New connections get a PRAGMA profile
+(see sqlite_profile.py), WAL with synchronous=NORMAL by default, and a
+statement cache sized to the queries seen so far (see
+query_registry.py).
+
+    @with_db_connection
+    def get_user_by_id(conn, user_id):
+        ...
+
+    pool = ConnectionPool('users.db', max_size=8, mode='thread')
+
+    @with_db_connection(pool=pool)
+    def get_user_by_id(conn, user_id):
+        ...
+
+A decorated function called from inside another on the same thread
+shares the outer call's connection and transaction: only the outermost
+call commits, rolls back and gives the connection back.
+"""
+
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import query_registry
+import sqlite_profile
+
+# Database used by the default pool
+DATABASE = os.getenv('USERS_DB', 'users.db')
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of SQLite connections.
+
+    Two ways of sharing connections are supported:
+
+    - 'checkout': connections are borrowed with `acquire` and given back
+      with `release`, so any thread may use any idle connection. At most
+      `max_size` are open at once; further callers wait until one is
+      released or discarded.
+    - 'thread': every thread keeps one connection of its own for its
+      whole life, and `acquire` always returns that one. No locking is
+      needed after the first call, but each thread holds a connection
+      even while idle, so `max_size` caps the number of threads served.
+
+    Idle connections are checked with `SELECT 1` before being handed
+    out again, and replaced if the check fails.
+    """
+
+    MODES = ('checkout', 'thread')
+
+    def __init__(self, database=DATABASE, min_size=0, max_size=5,
+                 mode='checkout', health_check=True,
+                 profile=sqlite_profile.DEFAULT_PROFILE, **connect_kwargs):
+        """
+        Create a pool, opening `min_size` connections up front.
+
+        Args:
+            database (str): Path of the SQLite database file.
+            min_size (int): Connections opened eagerly ('checkout' only).
+            max_size (int): Maximum number of open connections.
+            mode (str): 'checkout' or 'thread', see the class docstring.
+            health_check (bool): Check idle connections before reuse.
+            profile (str or dict): PRAGMAs applied to every new
+                connection, see sqlite_profile.PROFILES.
+            **connect_kwargs: Passed to `sqlite3.connect`. Unless
+                given, `cached_statements` follows
+                `query_registry.registry.statement_cache_size()` at the
+                time each connection opens.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown pool mode: {mode!r}")
+        if max_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        if not 0 <= min_size <= max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.mode = mode
+        self.health_check = health_check
+        self.profile = sqlite_profile.pragmas(profile)
+        # Connections are shared between threads, one at a time
+        self.connect_kwargs = dict(connect_kwargs, check_same_thread=False)
+        self._idle = []  # most recently released last
+        self._lock = threading.Lock()
+        # Notified whenever a connection is released or a slot freed
+        self._available = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._threads = {}
+        # Connections opened and not yet discarded
+        self._live = set()
+        self._opened = 0
+        self._closed = False
+
+        if mode == 'checkout':
+            for _ in range(min_size):
+                self._reserve()
+                self._idle.append(self._open())
+
+    def _reserve(self):
+        """Claim a slot for a new connection, False if the pool is full."""
+        with self._lock:
+            if self._opened >= self.max_size:
+                return False
+            self._opened += 1
+            return True
+
+    def _open(self):
+        """Open a connection for a slot claimed with `_reserve`."""
+        kwargs = dict(self.connect_kwargs)
+        kwargs.setdefault('cached_statements',
+                          query_registry.registry.statement_cache_size())
+        try:
+            conn = sqlite_profile.connect(self.database, self.profile,
+                                          **kwargs)
+        except Exception:
+            with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._live.add(conn)
+        return conn
+
+    def _healthy(self, conn):
+        if not self.health_check:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection, opening one if the pool is not full.
+
+        Args:
+            timeout (float): Seconds to wait for a free connection,
+                None to wait forever. Ignored in 'thread' mode.
+
+        Returns:
+            sqlite3.Connection: A live connection.
+
+        Raises:
+            queue.Empty: If no connection became free within `timeout`.
+            RuntimeError: If the pool is closed, or in 'thread' mode if
+                `max_size` threads already hold a connection.
+        """
+        if self.mode == 'thread':
+            self._check_open()
+            return self._thread_connection()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._available:
+                self._check_open()
+                while not self._idle and self._opened >= self.max_size:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise queue.Empty
+                    self._available.wait(remaining)
+                    self._check_open()
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    conn = None
+                    self._opened += 1
+            if conn is None:
+                return self._open()
+            if self._healthy(conn):
+                return conn
+            self.discard(conn)
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("ConnectionPool is closed")
+
+    def _thread_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn not in self._live:
+            # Discarded from another thread, e.g. by `close` or a reap
+            conn = self._local.conn = None
+        if conn is not None:
+            if self._healthy(conn):
+                return conn
+            self.discard(conn)
+        if not self._reserve():
+            # Free the slots of threads that have exited, then try again
+            self._reap_threads()
+            if not self._reserve():
+                raise RuntimeError(f"All {self.max_size} connections are "
+                                   "held by other threads")
+        conn = self._open()
+        self._local.conn = conn
+        with self._lock:
+            # Thread idents are reused, an old entry is from a dead thread
+            stale = self._threads.pop(threading.get_ident(), None)
+            self._threads[threading.get_ident()] = conn
+        if stale is not None:
+            self.discard(stale)
+        return conn
+
+    def _reap_threads(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        with self._lock:
+            dead = [conn for ident, conn in self._threads.items()
+                    if ident not in alive]
+        for conn in dead:
+            self.discard(conn)
+
+    def release(self, conn):
+        """
+        Give a connection back to the pool for reuse.
+
+        A transaction left open by the borrower is rolled back, so the
+        next one starts from a clean state.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+            return
+        if self.mode == 'checkout':
+            with self._available:
+                if not self._closed:
+                    self._idle.append(conn)
+                    self._available.notify()
+                    return
+            self.discard(conn)
+
+    def discard(self, conn):
+        """
+        Close a connection and free its slot in the pool.
+
+        Discarding a connection again does nothing, so its slot is
+        never freed twice.
+        """
+        with self._available:
+            if conn not in self._live:
+                return
+            self._live.discard(conn)
+            self._opened -= 1
+            for ident, held in list(self._threads.items()):
+                if held is conn:
+                    del self._threads[ident]
+            self._available.notify()
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+        Borrow a connection for a unit of work, as `with_db_connection`.
+
+        The work is committed if the block succeeds and rolled back on a
+        database error. A session opened inside another on the same
+        thread reuses its connection and leaves committing, rolling back
+        and releasing to the outermost one, so a nested call never
+        commits or discards the outer call's partial transaction, nor
+        waits on the pool for a second connection.
+        """
+        if getattr(self._local, 'depth', 0):
+            self._local.depth += 1
+            try:
+                yield self._local.session
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire(timeout)
+        self._local.session, self._local.depth = conn, 1
+        try:
+            yield conn
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            self._local.session, self._local.depth = None, 0
+            self.release(conn)
+
+    def close(self):
+        """
+        Close every idle connection, and in 'thread' mode all of them.
+
+        Connections still borrowed are closed when released, and
+        `acquire` raises RuntimeError from now on.
+        """
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            held = list(self._threads.values())
+            self._available.notify_all()
+        for conn in idle + held:
+            self.discard(conn)
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def default_pool():
+    """Return the pool shared by decorators given no pool of their own."""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool(DATABASE)
+        return _default_pool
+
+
+def with_db_connection(func=None, *, pool=None, timeout=None):
+    """
+    A decorator that passes a pooled connection as the first argument:
+    - Borrowing a connection before executing the wrapped function
+    - Committing the transaction if the function succeeds
+    - Rolling back the transaction if a database error occurs
+    - Giving the connection back to the pool afterwards
+
+    Can be used bare, `@with_db_connection`, or with arguments,
+    `@with_db_connection(pool=pool)`. Nested calls share the outermost
+    call's connection and transaction, see `ConnectionPool.session`.
+
+    Args:
+        func (function): The function that requires a
+        database connection as the first argument.
+        pool (ConnectionPool): The pool to borrow from, the shared
+        `default_pool()` when None.
+        timeout (float): Seconds to wait for a free connection.
+
+    Returns:
+        function: A wrapped function that borrows a connection
+        for every call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            conn_pool = pool or default_pool()
+            with conn_pool.session(timeout) as conn:
+                return func(conn, *args, **kwargs)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,242 @@
+"""
+Group commit for small writes such as `update_user_email`.
+
+Committing each update on its own costs SQLite a journal sync per row.
+`GroupCommitWriter` queues writes from any number of threads and a
+single background thread applies them in batches: one transaction per
+`max_batch` writes, or per `max_delay_ms` after the first queued write,
+whichever comes first. With the default delay of 0 a batch is whatever
+queued up while the previous one was committing, which adds no latency
+to a lone write and grows the batches as the load grows. Each caller
+gets a `concurrent.futures.Future` that resolves once its write is
+committed.
+
+    with GroupCommitWriter('users.db') as writer:
+        future = writer.submit("UPDATE users SET email = ? WHERE id = ?",
+                               ('new@example.com', 1))
+        future.result()  # rowcount, once committed
+
+Every write runs inside its own savepoint, so a write that fails (a
+constraint violation, say) is rolled back and reported on its future
+alone while the rest of the batch still commits. As with
+`transactional`, cached query results that read the tables written are
+invalidated after each commit.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cache
+import sqlite_profile
+from db_pool import DATABASE
+
+_STOP = object()
+
+
+class _Write:
+    __slots__ = ('run', 'future')
+
+    def __init__(self, run):
+        self.run = run
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """Batches writes from many callers into few transactions."""
+
+    def __init__(self, database=DATABASE, max_batch=100, max_delay_ms=0,
+                 profile=sqlite_profile.DEFAULT_PROFILE, **connect_kwargs):
+        """
+        Open the writer's connection and start the writer thread.
+
+        Args:
+            database (str): Path of the SQLite database file.
+            max_batch (int): Most writes committed in one transaction.
+            max_delay_ms (float): Longest a write waits for others to
+                join its batch, 0 to take only those already queued.
+            profile (str or dict): PRAGMAs for the writer's connection,
+                see sqlite_profile.PROFILES.
+            **connect_kwargs: Passed to `sqlite3.connect`.
+
+        Raises:
+            sqlite3.Error: If the connection cannot be opened or the
+                profile applied.
+        """
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.profile = sqlite_profile.pragmas(profile)
+        self.connect_kwargs = connect_kwargs
+        self.batches = 0
+        self.writes = 0
+        # Opened here so that a bad path or PRAGMA fails the constructor;
+        # transactions are managed explicitly, with BEGIN and SAVEPOINT
+        self._conn = sqlite_profile.connect(
+            database, self.profile,
+            **dict(connect_kwargs, isolation_level=None,
+                   check_same_thread=False))
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='group-commit')
+        self._thread.start()
+
+    def _enqueue(self, run):
+        write = _Write(run)
+        # Checked and queued together, so nothing lands behind _STOP
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed")
+            self._queue.put(write)
+        return write.future
+
+    def submit(self, sql, params=()):
+        """
+        Queue one statement.
+
+        Returns:
+            Future: Resolves to the statement's rowcount once committed.
+        """
+        return self._enqueue(lambda conn: conn.execute(sql, params).rowcount)
+
+    def submit_many(self, sql, seq_of_params):
+        """
+        Queue a statement run for every parameter set, with `executemany`.
+
+        Returns:
+            Future: Resolves to the total rowcount once committed.
+        """
+        seq_of_params = list(seq_of_params)
+        return self._enqueue(
+            lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    def submit_call(self, func, *args, **kwargs):
+        """
+        Queue `func(conn, *args, **kwargs)`, for functions written for
+        `with_db_connection`. It must not commit or roll back itself.
+
+        Returns:
+            Future: Resolves to the function's return value once
+            committed.
+        """
+        return self._enqueue(lambda conn: func(conn, *args, **kwargs))
+
+    def flush(self):
+        """
+        Wait until every write queued so far is committed.
+
+        Raises:
+            RuntimeError: If called on the writer thread, from a queued
+                function or a future's callback, which would wait on
+                itself forever.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("flush() called from the writer thread")
+        self.submit_call(lambda conn: None).result()
+
+    def close(self):
+        """
+        Commit what is queued and stop the writer thread.
+
+        Called on the writer thread, it returns without waiting and the
+        thread stops once it has committed the current batch.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP)
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _next_batch(self):
+        """Block for a write, then gather others until the batch is due."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                write = self._queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if write is _STOP:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    def _run(self):
+        batch, error = [], None
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._commit(self._conn, batch)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Whatever ended the thread, refuse new writes and fail the
+            # queued ones rather than leave their futures pending
+            with self._lock:
+                self._closed = True
+            self._fail_pending(batch, error)
+            self._conn.close()
+
+    def _fail_pending(self, batch, error):
+        """Fail the writes of `batch` left unresolved and all queued."""
+        pending = list(batch)
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for write in pending:
+            if write is not _STOP and not write.future.done():
+                closed = RuntimeError("GroupCommitWriter is closed")
+                closed.__cause__ = error
+                write.future.set_exception(closed)
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            with cache.tables_touched(conn, cache.WRITE_ACTIONS) as tables:
+                conn.execute("BEGIN IMMEDIATE")
+                for write in batch:
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        result = write.run(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        write.future.set_exception(e)
+                    else:
+                        conn.execute("RELEASE write")
+                        results.append((write.future, result))
+                conn.execute("COMMIT")
+        except Exception as e:
+            for write in batch:
+                if not write.future.done():
+                    write.future.set_exception(e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return
+
+        cache.query_cache.invalidate_tables(tables)
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result in results:
+            future.set_result(result)
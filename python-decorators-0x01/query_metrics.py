@@ -0,0 +1,153 @@
+"""
+Query latency metrics for `log_queries`.
+
+Every call is timed with `time.perf_counter_ns`. Calls slower than the
+slow-query threshold are always written to the slow-query log; the
+others are recorded, for a sample of calls, in a latency histogram per
+query fingerprint (see query_registry.py), from which p50/p95/p99 are
+read:
+
+    metrics.summary()
+    {'SELECT * FROM users WHERE id = ?':
+        {'samples': 120, 'p50_ms': 0.021, 'p95_ms': 0.034, ...}}
+
+Recording costs a dict lookup and a few integer operations, so the
+histograms can stay on in production. Every call, sampled or not, is
+also counted in `query_registry.registry`. Settings come from the
+environment: SLOW_QUERY_MS (default 100), QUERY_SAMPLE_RATE (default 1)
+and SLOW_QUERY_LOG, a file the slow-query log is appended to.
+"""
+
+import logging
+import os
+import random
+import threading
+
+from query_registry import registry
+
+# Logger of queries slower than the threshold
+slow_log = logging.getLogger('slow_queries')
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations in nanoseconds.
+
+    Each power of two is split into 8 buckets, so a percentile is off by
+    at most 1/16 of its value, whatever the range of the durations, and
+    recording is a handful of integer operations.
+    """
+
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    @classmethod
+    def _index(cls, ns):
+        if ns < 2 * cls.SUB_BUCKETS:
+            return ns
+        shift = ns.bit_length() - 4
+        return shift * cls.SUB_BUCKETS + (ns >> shift)
+
+    @classmethod
+    def _midpoint(cls, index):
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        low = (index % cls.SUB_BUCKETS + cls.SUB_BUCKETS) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, ns):
+        index = self._index(ns)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, q):
+        """Return the q-th percentile (0-100) in nanoseconds, 0 if empty."""
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._midpoint(index), self.max_ns)
+        return self.max_ns
+
+
+class QueryMetrics:
+    """Per-fingerprint latency histograms plus a slow-query log."""
+
+    def __init__(self, slow_ms=100.0, sample_rate=1.0, log=slow_log):
+        """
+        Args:
+            slow_ms (float): Calls taking at least this many milliseconds
+                are written to `log`, whether sampled or not.
+            sample_rate (float): Fraction of the calls recorded in the
+                histograms, between 0 and 1.
+            log (logging.Logger): Where slow queries are written.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.slow_ns = int(slow_ms * 1e6)
+        self.sample_rate = sample_rate
+        self.log = log
+        self.histograms = {}
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def record(self, query, elapsed_ns):
+        """Record one call of `query` that took `elapsed_ns`."""
+        if elapsed_ns >= self.slow_ns:
+            with self._lock:
+                self.slow_queries += 1
+            self.log.warning("Slow query (%.3f ms): %s",
+                             elapsed_ns / 1e6, query)
+        key = registry.record(query if isinstance(query, str)
+                              else repr(query))
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(elapsed_ns)
+
+    def summary(self):
+        """
+        Return the latency of every fingerprint seen so far.
+
+        Returns:
+            dict: Fingerprint to samples, p50_ms, p95_ms, p99_ms, max_ms
+            and mean_ms.
+        """
+        with self._lock:
+            histograms = list(self.histograms.items())
+        return {
+            key: {'samples': h.count,
+                  'p50_ms': h.percentile(50) / 1e6,
+                  'p95_ms': h.percentile(95) / 1e6,
+                  'p99_ms': h.percentile(99) / 1e6,
+                  'max_ms': h.max_ns / 1e6,
+                  'mean_ms': h.total_ns / h.count / 1e6}
+            for key, h in histograms}
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.slow_queries = 0
+
+
+if os.getenv('SLOW_QUERY_LOG'):
+    slow_log.addHandler(logging.FileHandler(os.getenv('SLOW_QUERY_LOG')))
+
+# Metrics shared by the decorated functions
+metrics = QueryMetrics(slow_ms=float(os.getenv('SLOW_QUERY_MS', '100')),
+                       sample_rate=float(os.getenv('QUERY_SAMPLE_RATE', '1')))
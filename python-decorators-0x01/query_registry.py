@@ -0,0 +1,244 @@
+"""
+Query fingerprints and statement reuse for the decorator toolkit.
+
+Functions here take raw SQL, often with values written into the text:
+`SELECT * FROM users WHERE id = 1`. Two normal forms are derived from
+such a query:
+
+- `fingerprint(query)`: every literal replaced by `?` and `IN` lists
+  collapsed, used to group queries for metrics and the registry.
+- `prepare(query, params)`: literals in value positions (comparisons,
+  `IN (...)`, `VALUES (...)`, `LIKE`, `BETWEEN`, `LIMIT`/`OFFSET`)
+  lifted into bound parameters. The SQL text is then the same for every
+  value, so sqlite3's per-connection statement cache compiles it once,
+  and `cache_query` keys on it. Only SELECT, INSERT, UPDATE, DELETE
+  and REPLACE statements (or WITH ... in front of one) are rewritten;
+  PRAGMA, DDL and the rest take no parameters where their literals are,
+  so they run as written. Hex (`0x1F`) and blob (`X'1F'`) literals stay
+  inline too.
+
+SQLite still uses a partial index for a lifted literal: it compares the
+bound value with the index's WHERE clause and prepares the statement
+again when a value changes that.
+
+`registry` counts the calls per fingerprint; its hot set is what
+`statement_cache_size` sizes a connection's `cached_statements` to.
+
+    sql, params = prepare("SELECT * FROM users WHERE id = 1")
+    # ('SELECT * FROM users WHERE id = ?', (1,))
+"""
+
+import re
+import threading
+from functools import lru_cache
+
+_TOKENS = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<blob>[xX]'[0-9a-fA-F]*')
+  | (?P<hex>0[xX][0-9a-fA-F]+)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>\?\d*|[:@$]\w+)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<op><=|>=|<>|!=|==|\|\||.)
+""", re.VERBOSE | re.DOTALL)
+
+# Tokens after which a literal is a value that can be bound instead
+_VALUE_AFTER = {'=', '==', '<', '>', '<=', '>=', '<>', '!=',
+                'LIKE', 'GLOB', 'BETWEEN', 'LIMIT', 'OFFSET'}
+# Words opening a parenthesized list of values
+_LIST_WORDS = {'IN', 'VALUES'}
+# Statements whose literals may be lifted, by their first word
+_DML = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH'}
+_LITERALS = {'string', 'number', 'hex', 'blob'}
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+# Integers sqlite3 can bind; larger literals are read as REAL by SQLite
+_MAX_INT = 2 ** 63
+
+
+def _tokens(query):
+    for match in _TOKENS.finditer(query):
+        yield match.lastgroup, match.group()
+
+
+def _literal(kind, text):
+    """Python value of a literal, or None if it cannot be bound as is."""
+    if kind == 'string':
+        return text[1:-1].replace("''", "'")
+    if re.fullmatch(r'\d+', text):
+        value = int(text)
+        return value if value < _MAX_INT else None
+    return float(text)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(query):
+    """
+    Normalize a query so that calls differing only in literals match.
+
+    String and number literals become `?`, lists of them in `IN (...)`
+    collapse to a single `(?)`, and whitespace and comments collapse to
+    single spaces.
+    """
+    parts = []
+    for kind, text in _tokens(query):
+        if kind in ('space', 'comment'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        elif kind in _LITERALS:
+            parts.append('?')
+        else:
+            parts.append(text)
+    return _IN_LISTS.sub('(?)', ''.join(parts).strip())
+
+
+@lru_cache(maxsize=4096)
+def _plan(query):
+    """
+    Work out how `prepare` rewrites a query.
+
+    Returns:
+        tuple: (sql, sources, params), where sources gives, for every
+        `?` of the rewritten sql, either ('value', literal) or
+        ('param', n) for the n-th positional parameter of the original
+        query, and params is how many the original query takes. None if
+        the query is not a DML statement or uses numbered or named
+        parameters; those are left alone.
+    """
+    parts = []
+    sources = []
+    params = 0
+    previous = None
+    lists = []  # for each open parenthesis, whether it holds values
+    pending_list = False
+    between = False
+    for kind, text in _tokens(query):
+        if kind in ('space', 'comment'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+            continue
+        upper = text.upper() if kind == 'word' else text
+        if previous is None and upper not in _DML:
+            return None
+        if kind == 'param':
+            if text != '?':
+                return None
+            sources.append(('param', params))
+            params += 1
+            parts.append('?')
+        elif kind in ('string', 'number'):
+            in_list = bool(lists) and lists[-1] and previous in ('(', ',')
+            value = _literal(kind, text)
+            if value is not None and (previous in _VALUE_AFTER or in_list
+                                      or (between and previous == 'AND')):
+                sources.append(('value', value))
+                parts.append('?')
+            else:
+                parts.append(text)
+            if between and previous == 'AND':
+                between = False
+        else:
+            if upper == '(':
+                lists.append(pending_list)
+            elif upper == ')' and lists:
+                lists.pop()
+            pending_list = upper in _LIST_WORDS
+            if upper == 'BETWEEN':
+                between = True
+            parts.append(text)
+        previous = upper
+    return ''.join(parts).strip(), tuple(sources), params
+
+
+def prepare(query, params=()):
+    """
+    Lift literal values out of a query into bound parameters.
+
+    Args:
+        query (str): The SQL, with values inline, `?` placeholders or
+            both.
+        params (sequence): Values of the query's own `?` placeholders.
+
+    Returns:
+        tuple: (sql, params) to execute. Statements other than DML and
+        queries with named or numbered parameters come back unchanged.
+    """
+    plan = _plan(query)
+    if plan is None or isinstance(params, dict):
+        return query, params
+    sql, sources, count = plan
+    params = tuple(params)
+    if len(params) != count:
+        # Let sqlite3 report the mismatch against the original query
+        return query, params
+    return sql, tuple(value if source == 'value' else params[value]
+                      for source, value in sources)
+
+
+class QueryRegistry:
+    """Thread-safe call counts per query fingerprint."""
+
+    def __init__(self, max_queries=10000):
+        """
+        Args:
+            max_queries (int): Most fingerprints tracked; calls of new
+                ones past that are counted under `other`.
+        """
+        self.max_queries = max_queries
+        self.calls = {}
+        self.other = 0
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        """
+        Count a call of `query`.
+
+        Returns:
+            str: The query's fingerprint.
+        """
+        key = fingerprint(query)
+        with self._lock:
+            if key in self.calls:
+                self.calls[key] += 1
+            elif len(self.calls) < self.max_queries:
+                self.calls[key] = 1
+            else:
+                self.other += 1
+        return key
+
+    def hot(self, n=10):
+        """Return the `n` most called (fingerprint, calls) pairs."""
+        with self._lock:
+            calls = list(self.calls.items())
+        return sorted(calls, key=lambda item: item[1], reverse=True)[:n]
+
+    def statement_cache_size(self, coverage=0.99, minimum=128,
+                             maximum=2048):
+        """
+        Suggest a `cached_statements` size for new connections.
+
+        It is the number of fingerprints that make up `coverage` of the
+        calls seen so far, doubled for headroom, within the bounds.
+        sqlite3's own default of 128 is the minimum.
+        """
+        with self._lock:
+            counts = sorted(self.calls.values(), reverse=True)
+        total = sum(counts)
+        covered = hot = 0
+        for count in counts:
+            if covered >= coverage * total:
+                break
+            covered += count
+            hot += 1
+        return max(minimum, min(maximum, hot * 2))
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.other = 0
+
+
+# Registry shared by the decorators
+registry = QueryRegistry()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Tests for QueryCache's single-flight loading and stale serving"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import unittest
+
+from cache import QueryCache, make_key, tables_touched
+
+
+class TestQueryCache(unittest.TestCase):
+    """test QueryCache.get/set and expiry"""
+
+    def test_ttl_and_stale_window(self):
+        """an entry is fresh, then stale, then gone"""
+        cache = QueryCache(ttl=0.1, stale_ttl=0.1)
+        cache.set('k', 1)
+        self.assertEqual(cache.get('k'), 1)
+        time.sleep(0.15)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(len(cache), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_invalidate_tables(self):
+        """only entries read from the written tables are dropped"""
+        cache = QueryCache()
+        cache.set('a', 1, tables={'users'})
+        cache.set('b', 2, tables={'orders'})
+        self.assertEqual(cache.invalidate_tables(['USERS']), 1)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+
+    def test_since_generation(self):
+        """a result computed across an invalidation is not cached"""
+        cache = QueryCache()
+        since = cache.generation
+        cache.invalidate_tables(['users'])
+        cache.set('k', 1, since=since)
+        self.assertNotIn('k', cache)
+        cache.set('k', 1, since=cache.generation)
+        self.assertIn('k', cache)
+
+
+class TestGetOrLoad(unittest.TestCase):
+    """test QueryCache.get_or_load from threads"""
+
+    def start(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def wait_for(self, predicate):
+        deadline = time.monotonic() + 5
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.001)
+
+    def test_coalesced_misses(self):
+        """concurrent misses of one key run the load once"""
+        cache = QueryCache()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return 'rows', {'users'}
+
+        threads = self.start(
+            lambda: results.append(cache.get_or_load('k', load)), 8)
+        self.wait_for(lambda: cache.coalesced == 7)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['rows'] * 8)
+        self.assertEqual((cache.misses, cache.coalesced), (1, 7))
+        self.assertEqual(cache.get_or_load('k', load), 'rows')
+        self.assertEqual(cache.hits, 1)
+
+    def test_error_propagates_to_waiters(self):
+        """every waiter gets the loader's exception, nothing is cached"""
+        cache = QueryCache()
+        release = threading.Event()
+        errors = []
+
+        def load():
+            release.wait(5)
+            raise sqlite3.OperationalError("database is locked")
+
+        def call():
+            try:
+                cache.get_or_load('k', load)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+        threads = self.start(call, 4)
+        self.wait_for(lambda: cache.coalesced == 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(len({id(e) for e in errors}), 1)
+        self.assertNotIn('k', cache)
+        # The failed flight is over, the next call loads again
+        self.assertEqual(cache.get_or_load('k', lambda: (1, ())), 1)
+
+    def test_stale_served_during_refresh(self):
+        """no caller waits for the loader while a stale entry exists"""
+        cache = QueryCache(ttl=0.01, stale_ttl=10)
+        cache.set('k', 'old')
+        time.sleep(0.02)
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return 'new', ()
+
+        # The loader is blocked, so these only return if none runs it
+        for _ in range(3):
+            self.assertEqual(cache.get_or_load('k', load), 'old')
+        self.assertEqual((len(calls), cache.stale_hits), (1, 3))
+        release.set()
+        self.wait_for(lambda: cache.get('k', count=False) == 'new')
+        self.assertEqual(cache.get_or_load('k', load), 'new')
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_refresh_keeps_stale(self):
+        """a failed background refresh is tried again by the next caller"""
+        cache = QueryCache(ttl=0.01, stale_ttl=10)
+        cache.set('k', 'old')
+        time.sleep(0.02)
+
+        def load():
+            raise sqlite3.OperationalError("database is locked")
+
+        self.assertEqual(cache.get_or_load('k', load), 'old')
+        self.wait_for(lambda: not cache._flights)
+        self.assertEqual(cache.get_or_load('k', lambda: ('new', ())), 'old')
+        self.wait_for(lambda: cache.get('k', count=False) == 'new')
+
+    def test_refresh_in_caller(self):
+        """refresh=False makes the first caller after expiry load"""
+        cache = QueryCache(ttl=0.01, stale_ttl=10)
+        cache.set('k', 'old')
+        time.sleep(0.02)
+        self.assertEqual(
+            cache.get_or_load('k', lambda: ('new', ()), refresh=False),
+            'new')
+
+    def test_invalidated_during_load(self):
+        """a load overlapping a write is returned but not cached"""
+        cache = QueryCache()
+
+        def load():
+            cache.invalidate_tables(['users'])
+            return 'rows', {'users'}
+
+        self.assertEqual(cache.get_or_load('k', load), 'rows')
+        self.assertNotIn('k', cache)
+        self.assertEqual(cache.get_or_load('k', lambda: ('rows', ())),
+                         'rows')
+        self.assertIn('k', cache)
+
+
+class TestAgetOrLoad(unittest.TestCase):
+    """test QueryCache.aget_or_load"""
+
+    def test_coalesced_tasks(self):
+        """concurrent tasks share one load without blocking the loop"""
+        cache = QueryCache()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return 'rows', ()
+
+        async def main():
+            return await asyncio.gather(
+                *(cache.aget_or_load('k', load) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ['rows'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.coalesced, 4)
+
+    def test_stale_refreshed_by_task(self):
+        """a stale entry is returned while a task refreshes it"""
+        cache = QueryCache(ttl=0.01, stale_ttl=10)
+        cache.set('k', 'old')
+        time.sleep(0.02)
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return 'new', ()
+
+        async def main():
+            stale = [await cache.aget_or_load('k', load) for _ in range(3)]
+            release.set()
+            while cache.get('k', count=False) != 'new':
+                await asyncio.sleep(0.001)
+            return stale
+
+        self.assertEqual(asyncio.run(main()), ['old'] * 3)
+        self.assertEqual(cache.stale_hits, 3)
+
+    def test_error_and_thread_waiter(self):
+        """a thread waiting on an async load gets its exception"""
+        cache = QueryCache()
+        errors = []
+
+        def wait_in_thread():
+            try:
+                cache.get_or_load('k', lambda: ('unused', ()))
+            except KeyError as e:
+                errors.append(e)
+
+        async def load():
+            thread = threading.Thread(target=wait_in_thread)
+            thread.start()
+            while not cache.coalesced:
+                await asyncio.sleep(0.001)
+            loads.append(thread)
+            raise KeyError('boom')
+
+        loads = []
+        with self.assertRaises(KeyError):
+            asyncio.run(cache.aget_or_load('k', load))
+        loads[0].join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertNotIn('k', cache)
+
+
+class TestKeys(unittest.TestCase):
+    """test make_key and tables_touched"""
+
+    def test_make_key(self):
+        """formatting and inline values do not split the cache"""
+        self.assertEqual(make_key("SELECT * FROM users WHERE id = 1"),
+                         make_key("SELECT *  FROM users\nWHERE id = ?", (1,)))
+        self.assertNotEqual(make_key("SELECT * FROM users WHERE id = 1"),
+                            make_key("SELECT * FROM users WHERE id = 2"))
+        self.assertEqual(make_key("SELECT :a", {'a': 1}),
+                         make_key("SELECT :a", {'a': 1}))
+
+    def test_tables_touched(self):
+        """the tables a statement reads are collected"""
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("CREATE TABLE users (id); CREATE TABLE t (id);")
+        with tables_touched(conn) as tables:
+            conn.execute("SELECT users.id FROM users "
+                         "JOIN t ON t.id = users.id").fetchall()
+        self.assertEqual(tables, {'users', 't'})
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
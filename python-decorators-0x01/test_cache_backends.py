@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Tests for the cache backends"""
+
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+import unittest
+from decimal import Decimal
+
+import cache_backends
+from cache_backends import (Entry, MemoryBackend, MmapBackend,
+                            SQLiteBackend, dumps, loads, open_backend)
+
+
+def users(count):
+    """A result shaped like `SELECT * FROM users`"""
+    return [(i, f'user_{i}', f'user{i}.name@example.com', 'password123')
+            for i in range(count)]
+
+
+class BackendTests:
+    """Checks shared by every backend, mixed into a TestCase"""
+
+    def open(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = self.open()
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.directory)
+
+    def test_set_get_delete(self):
+        """an entry round-trips with its times"""
+        self.backend.set('k', Entry(users(3), 10.0, 20.0, {'users'}))
+        entry = self.backend.get('k')
+        self.assertEqual(entry.value, users(3))
+        self.assertEqual((entry.expires, entry.stale_until), (10.0, 20.0))
+        self.assertTrue(self.backend.delete('k'))
+        self.assertIsNone(self.backend.get('k'))
+        self.assertFalse(self.backend.delete('k'))
+
+    def test_invalidate_tables(self):
+        """entries read from a written table are dropped"""
+        self.backend.set('a', Entry(1, tables={'users'}))
+        self.backend.set('b', Entry(2, tables={'orders'}))
+        self.assertEqual(self.backend.invalidate_tables({'users'}), 1)
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.get('b').value, 2)
+
+    def test_thousand_rows_cached(self):
+        """a realistic result set fits with the default settings"""
+        self.backend.set('k', Entry(users(1000)))
+        self.assertEqual(self.backend.get('k').value, users(1000))
+        self.assertEqual(self.backend.stats()['rejected'], 0)
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    """test MemoryBackend"""
+
+    def open(self):
+        return MemoryBackend(max_entries=2, max_bytes=1000000)
+
+    def test_lru_and_rejected(self):
+        """least recently used entries go first, oversized are counted"""
+        self.backend.set('a', Entry(1))
+        self.backend.set('b', Entry(2))
+        self.backend.get('a')
+        self.backend.set('c', Entry(3))
+        self.assertIsNone(self.backend.get('b'))
+        self.backend.set('big', Entry(users(10000)))
+        self.assertIsNone(self.backend.get('big'))
+        stats = self.backend.stats()
+        self.assertEqual((stats['evictions'], stats['rejected']), (1, 1))
+
+
+class SharedBackendTests(BackendTests):
+    """Checks of the backends that serialize to a shared file"""
+
+    def test_unserializable_rejected(self):
+        """results marshal cannot write are counted, not pickled"""
+        self.backend.set('k', Entry([(Decimal('1.5'),)]))
+        self.assertIsNone(self.backend.get('k'))
+        self.assertEqual(self.backend.stats()['rejected'], 1)
+
+    def test_owner_only(self):
+        """the shared file is created readable by the owner only"""
+        mode = stat.S_IMODE(os.stat(self.backend.path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+
+class TestMmapBackend(SharedBackendTests, unittest.TestCase):
+    """test MmapBackend"""
+
+    def open(self):
+        return MmapBackend(os.path.join(self.directory, 'cache.mmap'))
+
+    def test_oversized_rejected(self):
+        """a result larger than a slot is counted as rejected"""
+        small = MmapBackend(os.path.join(self.directory, 'small.mmap'),
+                            slots=8, slot_size=1024, ways=2)
+        small.set('k', Entry(users(100)))
+        self.assertIsNone(small.get('k'))
+        self.assertEqual(small.stats()['rejected'], 1)
+        small.close()
+
+    def test_set_eviction(self):
+        """a full set evicts its least recently used slot"""
+        small = MmapBackend(os.path.join(self.directory, 'small.mmap'),
+                            slots=2, slot_size=1024, ways=2)
+        for key in 'abc':
+            small.set(key, Entry(key))
+        stats = small.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 1))
+        small.close()
+
+    def test_reset_key_after_freed_slot(self):
+        """re-setting a key never leaves a stale copy in its set"""
+        small = MmapBackend(os.path.join(self.directory, 'small.mmap'),
+                            slots=2, slot_size=1024, ways=2)
+        small.set('a', Entry('a'))
+        small.set('k', Entry('old'))
+        small.delete('a')
+        small.set('k', Entry('new'))
+        self.assertEqual(small.stats()['entries'], 1)
+        self.assertEqual(small.get('k').value, 'new')
+        self.assertTrue(small.delete('k'))
+        self.assertIsNone(small.get('k'))
+        small.close()
+
+
+class TestSQLiteBackend(SharedBackendTests, unittest.TestCase):
+    """test SQLiteBackend"""
+
+    def open(self):
+        return SQLiteBackend(os.path.join(self.directory, 'cache.db'),
+                             max_entries=2)
+
+    def test_eviction(self):
+        """entries past max_entries are evicted"""
+        for key in 'abc':
+            self.backend.set(key, Entry(key))
+        stats = self.backend.stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 1))
+
+
+class TestSerialization(unittest.TestCase):
+    """test dumps, loads and open_backend"""
+
+    def test_no_pickle(self):
+        """loads refuses anything but marshal data"""
+        self.assertEqual(loads(dumps(users(2))), users(2))
+        with self.assertRaises(ValueError):
+            dumps([Decimal(1)])
+        with self.assertRaises(ValueError):
+            loads(b'P' + pickle.dumps(users(2)))
+
+    def test_open_backend(self):
+        """specs name a backend and its path"""
+        self.assertIsNone(open_backend(''))
+        self.assertIsNone(open_backend('memory'))
+        for spec in ('mmap', 'redis:/tmp/x', 'memory:/tmp/x'):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                open_backend(spec)
+        directory = tempfile.mkdtemp()
+        try:
+            backend = open_backend(f'sqlite:{directory}/cache.db')
+            self.assertIsInstance(backend, cache_backends.SQLiteBackend)
+            backend.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
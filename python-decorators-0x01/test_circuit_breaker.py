@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Tests for the circuit breaker"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import unittest
+
+from circuit_breaker import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker,
+                             CircuitOpenError, circuit_breaker, is_outage)
+
+
+def locked():
+    raise sqlite3.OperationalError("database is locked")
+
+
+class TestIsOutage(unittest.TestCase):
+    """test is_outage"""
+
+    def test_classification(self):
+        """only errors of an unhealthy database count"""
+        outages = [sqlite3.OperationalError("unable to open database file"),
+                   sqlite3.InterfaceError("closed"), ConnectionError(),
+                   TimeoutError()]
+        healthy = [sqlite3.IntegrityError("UNIQUE constraint failed"),
+                   sqlite3.ProgrammingError("bad SQL"), ValueError()]
+        for error in outages:
+            with self.subTest(error=error):
+                self.assertTrue(is_outage(error))
+        for error in healthy:
+            with self.subTest(error=error):
+                self.assertFalse(is_outage(error))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """test CircuitBreaker and the circuit_breaker decorator"""
+
+    def trip(self, breaker, guarded):
+        for _ in range(breaker.failure_threshold):
+            with self.assertRaises(sqlite3.OperationalError):
+                guarded()
+
+    def test_opens_after_threshold(self):
+        """consecutive failures open it, then calls fail fast"""
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+        calls = []
+
+        @circuit_breaker(breaker)
+        def guarded():
+            calls.append(1)
+            locked()
+
+        self.trip(breaker, guarded)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError) as raised:
+            guarded()
+        self.assertGreater(raised.exception.retry_in, 0)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual((breaker.trips, breaker.rejected), (1, 1))
+
+    def test_success_resets_count(self):
+        """failures must be consecutive to open it"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        for _ in range(3):
+            with self.assertRaises(sqlite3.OperationalError):
+                breaker(locked)()
+            breaker(lambda: None)()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_non_outage_counts_as_success(self):
+        """application errors propagate without tripping it"""
+        breaker = CircuitBreaker(failure_threshold=1)
+
+        @breaker
+        def guarded():
+            raise sqlite3.IntegrityError("UNIQUE constraint failed")
+
+        for _ in range(3):
+            with self.assertRaises(sqlite3.IntegrityError):
+                guarded()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_recovery(self):
+        """after the timeout one trial call closes or reopens it"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+        with self.assertRaises(sqlite3.OperationalError):
+            breaker(locked)()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(sqlite3.OperationalError):
+            breaker(locked)()
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.06)
+        self.assertEqual(breaker(lambda: 'ok')(), 'ok')
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual((breaker.trips, breaker.recoveries), (2, 1))
+
+    def test_half_open_trial_slots(self):
+        """while half-open only `half_open_calls` calls go through"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01)
+        with self.assertRaises(sqlite3.OperationalError):
+            breaker(locked)()
+        time.sleep(0.02)
+        started = threading.Event()
+        release = threading.Event()
+
+        @breaker
+        def slow():
+            started.set()
+            release.wait(5)
+
+        trial = threading.Thread(target=slow)
+        trial.start()
+        self.assertTrue(started.wait(5))
+        with self.assertRaises(CircuitOpenError):
+            breaker(lambda: None)()
+        release.set()
+        trial.join()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_interrupted_trial_released(self):
+        """a trial call cancelled by a BaseException frees its slot"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01)
+        with self.assertRaises(sqlite3.OperationalError):
+            breaker(locked)()
+        time.sleep(0.02)
+
+        @breaker
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            interrupted()
+        self.assertEqual(breaker(lambda: 'ok')(), 'ok')
+
+    def test_async(self):
+        """coroutine functions are guarded the same way"""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=60)
+
+        @circuit_breaker(breaker)
+        async def guarded():
+            await asyncio.sleep(0)
+            locked()
+
+        with self.assertRaises(sqlite3.OperationalError):
+            asyncio.run(guarded())
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(guarded())
+
+    def test_reset_and_stats(self):
+        """reset closes it by hand, stats report the counters"""
+        breaker = CircuitBreaker('db', failure_threshold=1)
+        with self.assertRaises(sqlite3.OperationalError):
+            breaker(locked)()
+        breaker.reset()
+        self.assertEqual(breaker.stats(),
+                         {'name': 'db', 'state': CLOSED, 'failures': 0,
+                          'trips': 1, 'recoveries': 0, 'rejected': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Tests for ConnectionPool and the pooled with_db_connection"""
+
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from db_pool import ConnectionPool, with_db_connection
+
+
+class PoolTestCase(unittest.TestCase):
+    """A scratch database with an empty users table"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'users.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                     "name TEXT NOT NULL)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def names(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute("SELECT name FROM users ORDER BY id").fetchall()
+        conn.close()
+        return [name for name, in rows]
+
+
+class TestCheckout(PoolTestCase):
+    """test 'checkout' mode"""
+
+    def test_reuse(self):
+        """a released connection is handed out again"""
+        pool = ConnectionPool(self.path, max_size=2, profile='default')
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        pool.close()
+
+    def test_timeout(self):
+        """acquire gives up when the pool stays full"""
+        pool = ConnectionPool(self.path, max_size=1, profile='default')
+        pool.acquire()
+        with self.assertRaises(queue.Empty):
+            pool.acquire(timeout=0.05)
+
+    def test_discard_wakes_waiter(self):
+        """a discarded connection's slot goes to a waiting caller"""
+        pool = ConnectionPool(self.path, max_size=1, profile='default')
+        held = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(pool.acquire(timeout=5)))
+        waiter.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        pool.discard(held)
+        waiter.join()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(len(acquired), 1)
+        self.assertIsNot(acquired[0], held)
+        pool.close()
+
+    def test_release_rolls_back(self):
+        """a transaction left open is not seen by the next borrower"""
+        pool = ConnectionPool(self.path, max_size=1, profile='default')
+        conn = pool.acquire()
+        conn.execute("INSERT INTO users (name) VALUES ('ann')")
+        pool.release(conn)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(self.names(), [])
+        pool.close()
+
+    def test_discard_once(self):
+        """discarding a connection twice frees its slot once"""
+        pool = ConnectionPool(self.path, max_size=1, profile='default')
+        conn = pool.acquire()
+        pool.discard(conn)
+        pool.discard(conn)
+        self.assertEqual(pool._opened, 0)
+        pool.close()
+
+    def test_closed(self):
+        """a closed pool hands out nothing, released connections close"""
+        pool = ConnectionPool(self.path, max_size=1, profile='default')
+        conn = pool.acquire()
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+        pool.release(conn)
+        self.assertEqual(pool._opened, 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+class TestThreadMode(PoolTestCase):
+    """test 'thread' mode"""
+
+    def in_thread(self, func):
+        """Run `func` on a fresh thread, returning its result"""
+        results = []
+        thread = threading.Thread(target=lambda: results.append(func()))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def test_discarded_elsewhere(self):
+        """a connection discarded by another thread is not reused"""
+        pool = ConnectionPool(self.path, max_size=1, mode='thread',
+                              health_check=False, profile='default')
+        conn = pool.acquire()
+        self.in_thread(lambda: pool.discard(conn))
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, conn)
+        fresh.execute("SELECT 1")
+        self.assertEqual(pool._opened, 1)
+        pool.close()
+
+    def test_close(self):
+        """close frees every thread's slot once and ends acquiring"""
+        pool = ConnectionPool(self.path, max_size=2, mode='thread',
+                              profile='default')
+        pool.acquire()
+        self.in_thread(pool.acquire)
+        pool.close()
+        self.assertEqual(pool._opened, 0)
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+        self.assertEqual(pool._opened, 0)
+
+
+class TestWithDbConnection(PoolTestCase):
+    """test with_db_connection, flat and nested"""
+
+    def check_nested(self, mode):
+        pool = ConnectionPool(self.path, max_size=1, mode=mode,
+                              profile='default')
+        seen = []
+
+        @with_db_connection(pool=pool, timeout=1)
+        def add(conn, name):
+            conn.execute("INSERT INTO users (name) VALUES (?)", (name,))
+
+        @with_db_connection(pool=pool, timeout=1)
+        def add_two(conn, fail):
+            conn.execute("INSERT INTO users (name) VALUES ('outer')")
+            add('inner')
+            # The inner call must not have committed the outer insert
+            seen.append(self.names())
+            if fail:
+                conn.execute("INSERT INTO missing VALUES (1)")
+
+        with self.assertRaises(sqlite3.OperationalError):
+            add_two(True)
+        self.assertEqual(self.names(), [])
+        add_two(False)
+        self.assertEqual(self.names(), ['outer', 'inner'])
+        self.assertEqual(seen, [[], []])
+        pool.close()
+
+    def test_nested_checkout(self):
+        """nested calls share one connection, even from a full pool"""
+        self.check_nested('checkout')
+
+    def test_nested_thread(self):
+        """nested calls commit and roll back only at the outermost"""
+        self.check_nested('thread')
+
+    def test_commit_and_rollback(self):
+        """success commits, a database error rolls back"""
+        pool = ConnectionPool(self.path, max_size=2, profile='default')
+
+        @with_db_connection(pool=pool)
+        def add(conn, name, fail=False):
+            conn.execute("INSERT INTO users (name) VALUES (?)", (name,))
+            if fail:
+                conn.execute("INSERT INTO users (name) VALUES (NULL)")
+
+        add('ann')
+        with self.assertRaises(sqlite3.IntegrityError):
+            add('bob', fail=True)
+        self.assertEqual(self.names(), ['ann'])
+        pool.close()
+
+    def test_threads_share_pool(self):
+        """concurrent callers never exceed max_size connections"""
+        pool = ConnectionPool(self.path, max_size=2, profile='default',
+                              timeout=5)
+
+        @with_db_connection(pool=pool)
+        def add(conn, name):
+            conn.execute("INSERT INTO users (name) VALUES (?)", (name,))
+
+        threads = [threading.Thread(target=add, args=(f'u{i}',))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.names()), 8)
+        self.assertLessEqual(pool._opened, 2)
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
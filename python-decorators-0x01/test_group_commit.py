@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Tests for GroupCommitWriter"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from group_commit import GroupCommitWriter
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    """test GroupCommitWriter"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'users.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                     "email TEXT NOT NULL UNIQUE)")
+        conn.executemany("INSERT INTO users (email) VALUES (?)",
+                         [(f'user{i}@example.com',) for i in range(10)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def emails(self):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute("SELECT email FROM users ORDER BY id").fetchall()
+        conn.close()
+        return [email for email, in rows]
+
+    def test_writes_committed(self):
+        """writes from many threads are committed, in few batches"""
+        with GroupCommitWriter(self.path, profile='default') as writer:
+            def update(i):
+                writer.submit("UPDATE users SET email = ? WHERE id = ?",
+                              (f'new{i}@example.com', i + 1)).result()
+
+            threads = [threading.Thread(target=update, args=(i,))
+                       for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(self.emails(),
+                         [f'new{i}@example.com' for i in range(10)])
+        self.assertEqual(writer.writes, 10)
+        self.assertLessEqual(writer.batches, 10)
+
+    def test_failed_write_isolated(self):
+        """a failing write is rolled back alone"""
+        writer = GroupCommitWriter(self.path, profile='default',
+                                   max_delay_ms=50)
+        ok = writer.submit("UPDATE users SET email = 'a@b.c' WHERE id = 1")
+        bad = writer.submit("UPDATE users SET email = 'a@b.c' WHERE id = 2")
+        writer.close()
+        self.assertEqual(ok.result(), 1)
+        with self.assertRaises(sqlite3.IntegrityError):
+            bad.result()
+        self.assertEqual(self.emails()[:2], ['a@b.c', 'user1@example.com'])
+
+    def test_flush_from_writer_thread(self):
+        """flush on the writer thread raises instead of deadlocking"""
+        errors = []
+
+        def flush_in_callback(future):
+            try:
+                writer.flush()
+            except RuntimeError as e:
+                errors.append(e)
+
+        with GroupCommitWriter(self.path, profile='default') as writer:
+            with self.assertRaises(RuntimeError):
+                writer.submit_call(lambda conn: writer.flush()).result(5)
+            # Held up so the callback is added before the future is done
+            release = threading.Event()
+            future = writer.submit_call(lambda conn: release.wait(5))
+            future.add_done_callback(flush_in_callback)
+            release.set()
+            future.result(5)
+            writer.flush()
+        self.assertEqual(len(errors), 1)
+
+    def test_bad_database_fails_constructor(self):
+        """a connection that cannot open raises instead of hanging"""
+        with self.assertRaises(sqlite3.OperationalError):
+            GroupCommitWriter(os.path.join(self.directory, 'no', 'such.db'))
+
+    def test_submit_after_close(self):
+        """a closed writer refuses writes"""
+        writer = GroupCommitWriter(self.path, profile='default')
+        writer.close()
+        writer.close()
+        with self.assertRaises(RuntimeError):
+            writer.submit("UPDATE users SET email = 'x' WHERE id = 1")
+
+    def test_writer_thread_death_fails_futures(self):
+        """if the writer thread dies, no future is left pending"""
+        writer = GroupCommitWriter(self.path, profile='default')
+        gate = threading.Event()
+
+        def broken_commit(conn, batch):
+            gate.wait()
+            raise MemoryError("writer died")
+
+        with patch.object(writer, '_commit', broken_commit), \
+                patch('threading.excepthook'):
+            first = writer.submit("UPDATE users SET email = 'x' WHERE id = 1")
+            queued = writer.submit("UPDATE users SET email = 'y' "
+                                   "WHERE id = 2")
+            gate.set()
+            writer._thread.join(timeout=5)
+        for future in (first, queued):
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=2)
+        with self.assertRaises(RuntimeError):
+            writer.submit("UPDATE users SET email = 'z' WHERE id = 3")
+
+    def test_close_races_submit(self):
+        """writes racing close() either resolve or are refused"""
+        writer = GroupCommitWriter(self.path, profile='default')
+        futures = []
+
+        def submit():
+            for i in range(200):
+                try:
+                    futures.append(writer.submit(
+                        "UPDATE users SET email = ? WHERE id = 1",
+                        (f'r{i}@example.com',)))
+                except RuntimeError:
+                    return
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        writer.close()
+        thread.join()
+        for future in futures:
+            self.assertEqual(future.result(timeout=2), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Tests for the latency histograms and the slow-query log"""
+
+import logging
+import threading
+import unittest
+
+from query_metrics import LatencyHistogram, QueryMetrics
+
+log = logging.getLogger('test_slow_queries')
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """test LatencyHistogram"""
+
+    def test_small_values_exact(self):
+        """durations below 16 ns get a bucket each"""
+        for ns in range(16):
+            self.assertEqual(LatencyHistogram._index(ns), ns)
+            self.assertEqual(LatencyHistogram._midpoint(ns), ns)
+
+    def test_buckets(self):
+        """indexes grow with the duration and midpoints stay within 1/16"""
+        previous = 0
+        for ns in list(range(16, 5000)) + [10 ** k for k in range(4, 13)]:
+            index = LatencyHistogram._index(ns)
+            self.assertGreaterEqual(index, previous, ns)
+            previous = index
+            midpoint = LatencyHistogram._midpoint(index)
+            self.assertLessEqual(abs(midpoint - ns), ns / 16, ns)
+
+    def test_bucket_edges(self):
+        """each power of two is split into 8 buckets"""
+        self.assertEqual([LatencyHistogram._index(ns)
+                          for ns in (16, 17, 18, 30, 31, 32)],
+                         [16, 16, 17, 23, 23, 24])
+        self.assertEqual(LatencyHistogram._midpoint(16), 17)
+
+    def test_percentiles(self):
+        """percentiles of a uniform spread are close to exact"""
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), 0)
+        for us in range(1, 1001):
+            histogram.record(us * 1000)
+        for q in (50, 95, 99):
+            with self.subTest(q=q):
+                expected = q * 10 * 1000
+                self.assertLessEqual(
+                    abs(histogram.percentile(q) - expected), expected / 16)
+        self.assertEqual(histogram.percentile(100), 1000 * 1000)
+        self.assertEqual(histogram.count, 1000)
+
+    def test_capped_at_max(self):
+        """a percentile never exceeds the slowest call"""
+        histogram = LatencyHistogram()
+        # The bucket of 961 ns spans 960-1023, its midpoint is 992
+        histogram.record(961)
+        self.assertEqual(histogram.percentile(99), 961)
+
+
+class TestQueryMetrics(unittest.TestCase):
+    """test QueryMetrics.record"""
+
+    def test_slow_threshold(self):
+        """calls at or above slow_ms are logged and counted"""
+        metrics = QueryMetrics(slow_ms=1, log=log)
+        with self.assertLogs(log, 'WARNING') as logged:
+            metrics.record("SELECT * FROM users", 2 * 10 ** 6)
+            metrics.record("SELECT * FROM users", 10 ** 6)
+            metrics.record("SELECT * FROM users", 10 ** 6 - 1)
+        self.assertEqual(len(logged.records), 2)
+        self.assertEqual(metrics.slow_queries, 2)
+        summary = metrics.summary()["SELECT * FROM users"]
+        self.assertEqual(summary['samples'], 3)
+        self.assertEqual(summary['max_ms'], 2.0)
+
+    def test_unsampled_slow_counted(self):
+        """slow calls are counted even when not sampled"""
+        metrics = QueryMetrics(slow_ms=0, sample_rate=0, log=log)
+        with self.assertLogs(log, 'WARNING'):
+            metrics.record("SELECT 1", 5)
+        self.assertEqual((metrics.slow_queries, metrics.summary()), (1, {}))
+
+    def test_concurrent_slow_count(self):
+        """no slow call is lost when threads record at once"""
+        metrics = QueryMetrics(slow_ms=0, log=log)
+        log.disabled = True
+        try:
+            threads = [threading.Thread(
+                target=lambda: [metrics.record("SELECT 1", 1)
+                                for _ in range(500)]) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            log.disabled = False
+        self.assertEqual(metrics.slow_queries, 4000)
+        self.assertEqual(metrics.summary()["SELECT ?"]['samples'], 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Tests for query_registry's fingerprints and literal lifting"""
+
+import sqlite3
+import unittest
+
+from query_registry import QueryRegistry, fingerprint, prepare
+
+
+class TestFingerprint(unittest.TestCase):
+    """test fingerprint"""
+
+    def test_literals(self):
+        """every kind of literal becomes ?"""
+        cases = [
+            ("SELECT * FROM users WHERE id = 1",
+             "SELECT * FROM users WHERE id = ?"),
+            ("SELECT * FROM users WHERE name = 'O''Brien'",
+             "SELECT * FROM users WHERE name = ?"),
+            ("SELECT * FROM users WHERE id = 0x1F",
+             "SELECT * FROM users WHERE id = ?"),
+            ("SELECT * FROM users WHERE data = X'0aFF'",
+             "SELECT * FROM users WHERE data = ?"),
+            ("SELECT * FROM users WHERE score > 1.5e3",
+             "SELECT * FROM users WHERE score > ?"),
+        ]
+        for query, expected in cases:
+            with self.subTest(query=query):
+                self.assertEqual(fingerprint(query), expected)
+
+    def test_in_lists_and_whitespace(self):
+        """IN lists collapse, whitespace and comments normalize"""
+        self.assertEqual(
+            fingerprint("SELECT *\n  FROM users -- all\n"
+                        "WHERE id IN (1, 2,3)"),
+            "SELECT * FROM users WHERE id IN (?)")
+        self.assertEqual(fingerprint("SELECT * FROM users WHERE id IN (1)"),
+                         fingerprint("SELECT * FROM users WHERE id IN (1, 2)"))
+
+    def test_identifiers_kept(self):
+        """quoted identifiers are not literals"""
+        self.assertEqual(
+            fingerprint('SELECT "name" FROM [users] WHERE `id` = 7'),
+            'SELECT "name" FROM [users] WHERE `id` = ?')
+
+
+class TestPrepare(unittest.TestCase):
+    """test prepare"""
+
+    def test_lifted(self):
+        """literals in value positions become bound parameters"""
+        cases = [
+            ("SELECT * FROM users WHERE id = 1", (),
+             "SELECT * FROM users WHERE id = ?", (1,)),
+            ("SELECT * FROM users WHERE name = 'x' AND id = ?", (3,),
+             "SELECT * FROM users WHERE name = ? AND id = ?", ('x', 3)),
+            ("SELECT * FROM users WHERE id IN (1, 2) LIMIT 10", (),
+             "SELECT * FROM users WHERE id IN (?, ?) LIMIT ?", (1, 2, 10)),
+            ("SELECT * FROM users WHERE age BETWEEN 18 AND 30", (),
+             "SELECT * FROM users WHERE age BETWEEN ? AND ?", (18, 30)),
+            ("INSERT INTO users (name, age) VALUES ('a', 4)", (),
+             "INSERT INTO users (name, age) VALUES (?, ?)", ('a', 4)),
+            ("UPDATE users SET age = 5 WHERE name LIKE 'a%'", (),
+             "UPDATE users SET age = ? WHERE name LIKE ?", (5, 'a%')),
+            ("delete from users where id <> 2", (),
+             "delete from users where id <> ?", (2,)),
+            ("WITH u AS (SELECT * FROM users) SELECT * FROM u WHERE id = 1",
+             (), "WITH u AS (SELECT * FROM users) SELECT * FROM u "
+                 "WHERE id = ?", (1,)),
+        ]
+        for query, params, sql, values in cases:
+            with self.subTest(query=query):
+                self.assertEqual(prepare(query, params), (sql, values))
+
+    def test_kept_inline(self):
+        """literals outside value positions stay in the SQL"""
+        cases = [
+            "SELECT name, 1 FROM users ORDER BY 1",
+            "SELECT * FROM users WHERE id = -1",
+            "SELECT * FROM users WHERE id = 0x10",
+            "SELECT * FROM users WHERE data = X'0A'",
+            "SELECT * FROM users WHERE id = 9223372036854775808",
+            "SELECT substr(name, 1, 2) FROM users",
+        ]
+        for query in cases:
+            with self.subTest(query=query):
+                sql, params = prepare(query)
+                self.assertEqual(params, ())
+                self.assertEqual(sql, query)
+
+    def test_statements_left_alone(self):
+        """PRAGMA, DDL and other statements are returned unchanged"""
+        cases = [
+            "PRAGMA cache_size = 100",
+            "CREATE TABLE t (a INTEGER CHECK (a > 0) DEFAULT 1)",
+            "CREATE INDEX t_a ON t (a) WHERE a = 1",
+            "ALTER TABLE t ADD COLUMN b TEXT DEFAULT 'x'",
+            "EXPLAIN QUERY PLAN SELECT * FROM t WHERE a = 1",
+            "  -- comment\nPRAGMA user_version = 3",
+        ]
+        for query in cases:
+            with self.subTest(query=query):
+                self.assertEqual(prepare(query), (query, ()))
+
+    def test_named_and_mismatched_params(self):
+        """named parameters and wrong counts are left to sqlite3"""
+        query = "SELECT * FROM users WHERE id = :id AND age = 3"
+        self.assertEqual(prepare(query, {'id': 1}), (query, {'id': 1}))
+        query = "SELECT * FROM users WHERE id = ? AND age = 3"
+        self.assertEqual(prepare(query, (1, 2)), (query, (1, 2)))
+
+    def test_same_results(self):
+        """the prepared statement returns what the original does"""
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT,
+                            age INTEGER CHECK (age > 0), data BLOB);
+            INSERT INTO t (name, age, data) VALUES
+                ('ann', 20, X'01'), ('bob', 31, X'02'), ('o''n', 45, NULL);
+        """)
+        queries = [
+            "SELECT * FROM t WHERE id = 0x2",
+            "SELECT * FROM t WHERE data = X'01'",
+            "SELECT * FROM t WHERE name = 'o''n'",
+            "SELECT * FROM t WHERE age BETWEEN 18 AND 40 ORDER BY 1",
+            "SELECT * FROM t WHERE id IN (1, 3) LIMIT 5 OFFSET 1",
+            "SELECT name FROM t WHERE name LIKE 'b%'",
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(conn.execute(*prepare(query)).fetchall(),
+                                 conn.execute(query).fetchall())
+        for statement in ("PRAGMA cache_size = 100",
+                          "CREATE TABLE c (a INTEGER CHECK (a > 0))"):
+            conn.execute(*prepare(statement))
+        conn.close()
+
+    def test_partial_index_used(self):
+        """a lifted literal still matches a partial index"""
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE t (a INTEGER, b INTEGER);
+            CREATE INDEX t_a ON t (a) WHERE b = 1;
+        """)
+        sql, params = prepare("SELECT * FROM t WHERE b = 1 AND a = 2")
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        self.assertIn('USING INDEX t_a', plan[0][3])
+        conn.close()
+
+
+class TestQueryRegistry(unittest.TestCase):
+    """test QueryRegistry"""
+
+    def test_record_and_hot(self):
+        """calls are counted per fingerprint"""
+        registry = QueryRegistry(max_queries=2)
+        for i in range(3):
+            registry.record(f"SELECT * FROM users WHERE id = {i}")
+        registry.record("SELECT 1")
+        registry.record("SELECT * FROM other")
+        self.assertEqual(registry.hot(1),
+                         [("SELECT * FROM users WHERE id = ?", 3)])
+        self.assertEqual(registry.other, 1)
+
+    def test_statement_cache_size(self):
+        """the size covers the hot set, within the bounds"""
+        registry = QueryRegistry()
+        self.assertEqual(registry.statement_cache_size(), 128)
+        for i in range(200):
+            registry.record(f"SELECT * FROM t{i}")
+        self.assertEqual(registry.statement_cache_size(), 396)
+        self.assertEqual(registry.statement_cache_size(maximum=300), 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
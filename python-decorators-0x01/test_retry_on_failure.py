@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Tests for transient retries and the retry budget"""
+
+import asyncio
+import contextlib
+import importlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def import_retry():
+    """Import 3-retry_on_failure.py without touching the real users.db"""
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        conn = sqlite3.connect(os.path.join(directory, 'users.db'))
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+        conn.close()
+        os.chdir(directory)
+        # The module fetches and prints the users when imported
+        with contextlib.redirect_stdout(io.StringIO()):
+            return importlib.import_module('3-retry_on_failure')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+retry = import_retry()
+LOCKED = sqlite3.OperationalError("database is locked")
+
+
+def failing(*errors, result='ok'):
+    """A function raising `errors` one call at a time, then returning"""
+    errors = list(errors)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    func.calls = calls
+    return func
+
+
+class TestIsTransient(unittest.TestCase):
+    """test is_transient"""
+
+    def test_classification(self):
+        """locks, busy databases and dropped connections are transient"""
+        OperationalError = type('OperationalError', (Exception,), {})
+        transient = [LOCKED, sqlite3.OperationalError("database is busy"),
+                     ConnectionError(), TimeoutError(),
+                     OperationalError(2006, "MySQL server has gone away")]
+        permanent = [sqlite3.OperationalError("no such table: users"),
+                     sqlite3.IntegrityError("UNIQUE constraint failed"),
+                     OperationalError(1054, "Unknown column"),
+                     ValueError(2006)]
+        for error in transient:
+            with self.subTest(error=error):
+                self.assertTrue(retry.is_transient(error))
+        for error in permanent:
+            with self.subTest(error=error):
+                self.assertFalse(retry.is_transient(error))
+
+
+class TestRetryBudget(unittest.TestCase):
+    """test RetryBudget"""
+
+    def test_withdraw_until_exhausted(self):
+        """retries stop once the saved tokens are spent"""
+        budget = retry.RetryBudget(min_per_second=0, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        self.assertEqual(budget.exhausted, 1)
+
+    def test_deposit(self):
+        """successes earn a fraction of a retry, up to max_tokens"""
+        budget = retry.RetryBudget(ratio=0.5, min_per_second=0,
+                                   max_tokens=1)
+        budget.withdraw()
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 1)
+
+
+class TestBackoff(unittest.TestCase):
+    """test backoff"""
+
+    def test_bounds(self):
+        """delays are jittered below the capped exponential"""
+        for attempt, bound in ((1, 1), (2, 2), (3, 4), (10, 30)):
+            with self.subTest(attempt=attempt):
+                for _ in range(50):
+                    wait = retry.backoff(attempt, 1, 30)
+                    self.assertTrue(0 <= wait <= bound)
+
+
+@patch('builtins.print')
+@patch('time.sleep')
+class TestRetryOnFailure(unittest.TestCase):
+    """test the retry_on_failure decorator"""
+
+    def test_transient_retried(self, sleep, _):
+        """a transient error is retried until the call succeeds"""
+        func = failing(LOCKED, LOCKED)
+        wrapped = retry.retry_on_failure(retries=3, delay=0.1, budget=None)
+        self.assertEqual(wrapped(func)(), 'ok')
+        self.assertEqual((len(func.calls), sleep.call_count), (3, 2))
+
+    def test_attempts_limited(self, sleep, _):
+        """the last error is raised after `retries` attempts"""
+        func = failing(LOCKED, LOCKED, LOCKED)
+        with self.assertRaises(sqlite3.OperationalError):
+            retry.retry_on_failure(retries=2, delay=0, budget=None)(func)()
+        self.assertEqual(len(func.calls), 2)
+
+    def test_permanent_not_retried(self, sleep, _):
+        """an error that would fail again is raised at once"""
+        func = failing(sqlite3.IntegrityError("UNIQUE constraint failed"))
+        with self.assertRaises(sqlite3.IntegrityError):
+            retry.retry_on_failure(delay=0, budget=None)(func)()
+        self.assertEqual(len(func.calls), 1)
+        sleep.assert_not_called()
+
+    def test_budget(self, sleep, _):
+        """no retry is made once the shared budget is spent"""
+        budget = retry.RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+        wrapped = retry.retry_on_failure(retries=5, delay=0, budget=budget)
+        func = failing(LOCKED, LOCKED, LOCKED)
+        with self.assertRaises(sqlite3.OperationalError):
+            wrapped(func)()
+        self.assertEqual((len(func.calls), budget.exhausted), (2, 1))
+
+    def test_deadline(self, sleep, _):
+        """no retry is started that would wait past the deadline"""
+        func = failing(LOCKED)
+        wrapped = retry.retry_on_failure(delay=1, deadline=0.5, budget=None)
+        with patch.object(retry, 'backoff', return_value=1):
+            with self.assertRaises(sqlite3.OperationalError):
+                wrapped(func)()
+        self.assertEqual(len(func.calls), 1)
+        sleep.assert_not_called()
+
+    def test_async(self, sleep, _):
+        """coroutines are retried without blocking the thread"""
+        errors = [LOCKED, ConnectionError()]
+
+        @retry.retry_on_failure(retries=3, delay=0, budget=None)
+        async def fetch():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+
+        self.assertEqual(asyncio.run(fetch()), 'ok')
+        self.assertEqual(errors, [])
+        sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
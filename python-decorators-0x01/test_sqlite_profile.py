@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Tests for sqlite_profile"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlite_profile
+
+
+class TestConnect(unittest.TestCase):
+    """test sqlite_profile.connect"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pragma(self, conn, name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def test_profile_applied(self):
+        """the profile's PRAGMAs are set on the new connection"""
+        conn = sqlite_profile.connect(self.path, 'wal')
+        self.assertEqual(self.pragma(conn, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(conn, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(conn, 'busy_timeout'), 5000)
+        conn.close()
+
+    def test_explicit_timeout_wins(self):
+        """a timeout passed by the caller is not overridden"""
+        for profile in sqlite_profile.PROFILES:
+            with self.subTest(profile=profile):
+                conn = sqlite_profile.connect(self.path, profile,
+                                              timeout=0.1)
+                self.assertEqual(self.pragma(conn, 'busy_timeout'), 100)
+                conn.close()
+
+    def test_invalid_values(self):
+        """unknown profiles and unsafe PRAGMA values are rejected"""
+        with self.assertRaises(ValueError):
+            sqlite_profile.pragmas('fast')
+        with self.assertRaises(ValueError):
+            sqlite_profile.connect(self.path,
+                                   {'journal_mode': 'WAL; DROP TABLE x'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,9 +12,21 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def stream_users():
+def stream_users(unbuffered=False, chunk_size=1000):
     """generator function to fetch rows
-    one by one from the user_data table. """
+    one by one from the user_data table.
+
+    The default cursor buffers the whole result set client-side before
+    the first row is yielded. With `unbuffered=True` a server-side
+    `SSCursor` is used instead and rows are read off the socket
+    `chunk_size` at a time, so memory stays flat however large the
+    table is. Stopping early closes the connection rather than reading
+    the rest of the unbuffered result.
+
+    Args:
+        unbuffered (bool): Stream rows with an SSCursor.
+        chunk_size (int): Rows per `fetchmany` call in unbuffered mode.
+    """
     try:
         connection = pymysql.connect(
             host=os.getenv('DB_HOST'),
@@ -23,6 +35,29 @@ def stream_users():
             database=os.getenv('DB_DATABASE')
         )
 
+    except Error as e:
+        print(f"Error connecting to ALX_prodev database: {e}")
+        return None
+
+    try:
+        if unbuffered:
+            cursor = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute("SELECT * FROM user_data")
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield from rows
+
+                cursor.close()
+
+            except Error as e:
+                print(f"Error fetching data: {e}")
+
+            return None
+
         with connection.cursor() as cursor:
             try:
                 cursor.execute("SELECT * FROM user_data")
@@ -37,8 +72,5 @@ def stream_users():
             finally:
                 cursor.close()
 
-        return connection
-
-    except Error as e:
-        print(f"Error connecting to ALX_prodev database: {e}")
-        return None
+    finally:
+        connection.close()
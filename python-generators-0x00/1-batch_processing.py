@@ -3,41 +3,79 @@
 import pymysql
 from pymysql.err import Error
 import os
+from array import array
 from dotenv import load_dotenv
 
+import db
+import pagination
+import rows
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, 'array' columnar mode needs nothing
+    np = None
+
 load_dotenv()
 
 
-def stream_users_in_batches(batch_size):
+def stream_users_in_batches(batch_size, mode='offset', resume_token=None,
+                            key='user_id', compact=False):
     """
     Stream users in batches of a specified size from the database.
 
+    In 'keyset' mode each batch seeks past the last key of the previous
+    one (`WHERE user_id > %s`) instead of re-scanning `offset` rows.
+    A token from `pagination.resume_token(batch)` resumes the stream
+    right after that batch.
+
     Args:
         batch_size (int): The number of rows to fetch in each batch.
+        mode (str): 'offset' (default) or 'keyset'.
+        resume_token (str): Token to resume a keyset stream from.
+        key (str): The indexed column keyset mode orders and seeks on.
+        compact (bool): Return rows as `rows.UserRow` named tuples
+            instead of dictionaries, saving memory on large batches.
 
     Yields:
         list: A batch of user data rows as dictionaries.
     """
+    if mode not in ('offset', 'keyset'):
+        raise ValueError(f"Unknown pagination mode: {mode!r}")
+    if resume_token is not None and mode != 'keyset':
+        raise ValueError("resume_token is only supported in keyset mode")
+
+    after = None
+    if resume_token is not None:
+        after = pagination.decode_token(resume_token, key)
+
+    connection = None
     try:
         connection = pymysql.connect(
             host=os.getenv('DB_HOST'),
             user=os.getenv('DB_USER'),
             password=os.getenv('DB_PASSWORD'),
             database=os.getenv('DB_DATABASE'),
-            cursorclass=pymysql.cursors.DictCursor  # Ensure rows are returned as dictionaries
+            # Ensure rows are returned as dictionaries, or compact named tuples
+            cursorclass=rows.RecordCursor if compact else pymysql.cursors.DictCursor
         )
 
         with connection.cursor() as cursor:
 
             offset = 0
             while True:
-                cursor.execute("SELECT * FROM user_data ORDER BY user_id  LIMIT %s OFFSET %s", (batch_size, offset))
+                if mode == 'keyset':
+                    sql, params = pagination.keyset_query(key, after)
+                    cursor.execute(sql, params + (batch_size,))
+                else:
+                    cursor.execute("SELECT * FROM user_data ORDER BY user_id  LIMIT %s OFFSET %s", (batch_size, offset))
 
                 batch = cursor.fetchall()
               
                 if not batch:
                     break  # No more rows to fetch
 
+                if mode == 'keyset':
+                    after = pagination.last_key(batch, key)
                 offset += batch_size
                 yield batch
     
@@ -48,18 +86,152 @@ def stream_users_in_batches(batch_size):
             connection.close()
 
 
-def batch_processing(batch_size):
+# Comparison operators allowed in pushed-down predicates
+OPERATORS = ('=', '!=', '<>', '<', '<=', '>', '>=')
+
+
+def _build_query(columns, where, numeric_age):
+    """
+    Build a projected, filtered SELECT over user_data.
+
+    Args:
+        columns (tuple): Columns to fetch, all of them when None.
+        where (iterable): (column, operator, value) predicates ANDed together.
+        numeric_age (bool): Return age as a plain integer instead of DECIMAL.
+
+    Returns:
+        tuple: The SQL text, its parameters and the projected column names.
+    """
+    columns = tuple(columns or db.USER_COLUMNS)
+    select = []
+    for column in columns:
+        if column not in db.USER_COLUMNS:
+            raise ValueError(f"Unknown user_data column: {column!r}")
+        if column == 'age' and numeric_age:
+            # Ages are whole numbers, casting avoids a Decimal per row
+            select.append("CAST(age AS SIGNED) AS age")
+        else:
+            select.append(column)
+
+    clauses, params = [], []
+    for column, operator, value in where:
+        if column not in db.USER_COLUMNS:
+            raise ValueError(f"Unknown user_data column: {column!r}")
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {operator!r}")
+        clauses.append(f"{column} {operator} %s")
+        params.append(value)
+
+    sql = f"SELECT {', '.join(select)} FROM user_data"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY user_id"
+    return sql, tuple(params), columns
+
+
+def _to_columns(records, columns, columnar):
+    """
+    Transpose a batch of row tuples into one sequence per column.
+
+    Args:
+        records (list): Row tuples in `columns` order.
+        columns (tuple): The column names.
+        columnar (str): 'numpy' for NumPy arrays, 'array' for
+            `array.array` (numeric columns) and lists (text columns).
+
+    Returns:
+        dict: Column name to column values.
+    """
+    batch = {}
+    for name, values in zip(columns, zip(*records)):
+        if name == 'age':
+            batch[name] = (np.fromiter(values, dtype=np.int64,
+                                       count=len(records))
+                           if columnar == 'numpy' else array('q', values))
+        elif columnar == 'numpy':
+            batch[name] = np.array(values, dtype=object)
+        else:
+            batch[name] = list(values)
+    return batch
+
+
+def stream_filtered_batches(batch_size, columns=None, where=(), columnar=None):
+    """
+    Stream batches of users with projection and filtering done by MySQL.
+
+    Only the requested columns of the rows matching `where` cross the
+    wire. A single query is read through an unbuffered cursor
+    `batch_size` rows at a time.
+
+    Args:
+        batch_size (int): The number of rows in each batch.
+        columns (tuple): Columns to fetch, all of them when None.
+        where (iterable): (column, operator, value) predicates ANDed
+            together, e.g. [('age', '>', 25)].
+        columnar (str): None for lists of dictionaries, 'array' or
+            'numpy' for a dictionary of column arrays per batch.
+
+    Yields:
+        list or dict: A batch of rows, or of columns when `columnar` is set.
+    """
+    if columnar not in (None, 'array', 'numpy'):
+        raise ValueError(f"Unknown columnar format: {columnar!r}")
+    if columnar == 'numpy' and np is None:
+        raise ImportError("columnar='numpy' requires numpy to be installed")
+
+    sql, params, names = _build_query(columns, where, columnar is not None)
+    cursorclass = (pymysql.cursors.SSDictCursor if columnar is None
+                   else pymysql.cursors.SSCursor)
+
+    connection = db.connect()
+    try:
+        cursor = connection.cursor(cursorclass)
+        cursor.execute(sql, params)
+        while True:
+            records = cursor.fetchmany(batch_size)
+            if not records:
+                break
+            yield records if columnar is None else _to_columns(
+                records, names, columnar)
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def print_batch(batch):
+    """
+    Default sink: print every user of a batch in a single write.
+
+    A columnar batch is transposed back into one dictionary per user.
+    """
+    if isinstance(batch, dict):
+        names = list(batch)
+        # tolist() turns NumPy and array.array values into plain ones
+        columns = [column.tolist() if hasattr(column, 'tolist') else column
+                   for column in batch.values()]
+        batch = [dict(zip(names, row)) for row in zip(*columns)]
+    print("\n".join(map(str, batch)))
+
+
+def batch_processing(batch_size, sink=print_batch, columns=None,
+                     where=(('age', '>', 25),), columnar=None):
     """
     Process users in batches, filtering users over the age of 25.
 
+    The age filter is evaluated by MySQL rather than in Python, and each
+    batch is handed to `sink` in one call.
+
     Args:
         batch_size (int): The number of rows to fetch in each batch.
+        sink (callable): Called with every batch, prints it by default.
+        columns (tuple): Columns to fetch, all of them when None.
+        where (iterable): (column, operator, value) predicates to push
+            down, users over 25 by default.
+        columnar (str): Batch format, see `stream_filtered_batches`.
     """
     try:
-        for batch in stream_users_in_batches(batch_size):
-            # Filter users with age > 25
-            filtered_users = [user for user in batch if user['age'] > 25]
-            for user in filtered_users:
-                print(user)  # Replace with actual processing logic
+        for batch in stream_filtered_batches(batch_size, columns, where,
+                                             columnar):
+            sink(batch)
     except Exception as e:
         print(f"Error processing users: {e}")
@@ -5,26 +5,69 @@ import pymysql
 from pymysql.err import Error
 from dotenv import load_dotenv
 
+import db
+import pagination
+import rows
+
 # Load environment variables from a .env file
 load_dotenv()
 
-def lazy_paginate(page_size):
+def lazy_paginate(page_size, mode='offset', resume_token=None, key='user_id',
+                  pool=None, compact=False):
     """
     Lazily paginate user data in batches.
 
     This generator function retrieves user data in chunks of the specified size,
     starting from the first batch and continuing until there is no more data to fetch.
 
+    In 'keyset' mode each page seeks past the last key of the previous one
+    instead of skipping `offset` rows, so every page costs the same however
+    deep the walk goes. Pass a token from `pagination.resume_token(page)`
+    as `resume_token` to continue a walk after that page.
+
+    'stream' mode holds a single connection for the whole walk (see
+    `stream_pages`) and accepts the same resume tokens as 'keyset'.
+
     Args:
         page_size (int): The number of rows to fetch per batch.
+        mode (str): 'offset' (default), 'keyset' or 'stream'.
+        resume_token (str): Token to resume a keyset or stream walk from.
+        key (str): The indexed column keyset mode orders and seeks on.
+        pool (db.ConnectionPool): Pool to borrow the connection from
+            in 'stream' mode.
+        compact (bool): Return rows as `rows.UserRow` named tuples
+            instead of dictionaries.
 
     Yields:
         list: A list of user data rows as dictionaries for the current batch.
     """
+    if mode == 'stream':
+        yield from stream_pages(page_size, resume_token, key, pool, compact)
+        return
+
+    if mode == 'keyset':
+        after = None
+        if resume_token is not None:
+            after = pagination.decode_token(resume_token, key)
+        while True:
+            users = paginate_users_keyset(page_size, after, key, compact)
+
+            if not users:
+                break
+
+            after = pagination.last_key(users, key)
+            yield users
+        return
+
+    if mode != 'offset':
+        raise ValueError(f"Unknown pagination mode: {mode!r}")
+    if resume_token is not None:
+        raise ValueError("resume_token is only supported in keyset mode")
+
     offset = 0  # Start offset for the first batch
     while True:
         # Fetch a batch of user data using the current offset
-        users = paginate_users(page_size, offset)
+        users = paginate_users(page_size, offset, compact)
 
         if not users:
             break  # Stop iteration if no more data is available
@@ -33,7 +76,7 @@ def lazy_paginate(page_size):
         yield users
 
 
-def paginate_users(page_size, offset):
+def paginate_users(page_size, offset, compact=False):
     """
     Fetch a batch of user data from the database.
 
@@ -43,10 +86,12 @@ def paginate_users(page_size, offset):
     Args:
         page_size (int): The number of rows to fetch.
         offset (int): The starting position for fetching rows.
+        compact (bool): Return `rows.UserRow` named tuples instead of dictionaries.
 
     Returns:
         list: A list of user data rows as dictionaries, or None if an error occurs.
     """
+    connection = None
     try:
         # Establish a connection to the database
         connection = pymysql.connect(
@@ -54,7 +99,8 @@ def paginate_users(page_size, offset):
             user=os.getenv('DB_USER'),          # Database username
             password=os.getenv('DB_PASSWORD'),  # Database password
             database=os.getenv('DB_DATABASE'),  # Database name
-            cursorclass=pymysql.cursors.DictCursor  # Return rows as dictionaries
+            # Return rows as dictionaries, or compact named tuples
+            cursorclass=rows.RecordCursor if compact else pymysql.cursors.DictCursor
         )
 
         # Create a cursor object to execute queries
@@ -73,3 +119,91 @@ def paginate_users(page_size, offset):
         # Ensure the database connection is closed properly
         if connection:
             connection.close()
+
+
+def paginate_users_keyset(page_size, after=None, key='user_id', compact=False):
+    """
+    Fetch the page of user data that follows a given sort key.
+
+    Args:
+        page_size (int): The number of rows to fetch.
+        after (tuple): Sort key of the last row already seen, or None
+            for the first page.
+        key (str): The indexed column to order and seek on.
+        compact (bool): Return `rows.UserRow` named tuples instead of dictionaries.
+
+    Returns:
+        list: A list of user data rows as dictionaries, or None if an error occurs.
+    """
+    sql, params = pagination.keyset_query(key, after)
+    connection = None
+    try:
+        connection = db.connect(cursorclass=rows.RecordCursor if compact
+                                else pymysql.cursors.DictCursor)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + (page_size,))
+            return cursor.fetchall()
+
+    except Error as e:
+        print(f"Error connecting to the database: {e}")
+        return None
+    finally:
+        if connection:
+            connection.close()
+
+
+def stream_pages(page_size, resume_token=None, key='user_id', pool=None,
+                 compact=False):
+    """
+    Page through user data over one connection and one unbuffered query.
+
+    A single ordered query is sent and read through a server-side
+    `SSDictCursor`, so rows stream off the socket `page_size` at a time
+    instead of a fresh connection and result buffer per page. The server
+    keeps the result open until the walk ends, so a consumer that stalls
+    longer than MySQL's `net_write_timeout` between pages will see the
+    connection dropped.
+
+    If the caller stops early (break, exception or the generator being
+    garbage-collected) the rest of the result is not drained: the
+    connection is closed, or discarded from `pool`, since it is still
+    mid-result and cannot be reused.
+
+    Args:
+        page_size (int): The number of rows per page.
+        resume_token (str): Token from `pagination.resume_token` to
+            continue after.
+        key (str): The indexed column to order on.
+        pool (db.ConnectionPool): Pool to borrow the connection from,
+            a private connection is opened when None.
+        compact (bool): Return `rows.UserRow` named tuples instead of dictionaries.
+
+    Yields:
+        list: A list of user data rows as dictionaries for the current page.
+    """
+    after = None
+    if resume_token is not None:
+        after = pagination.decode_token(resume_token, key)
+    sql, params = pagination.keyset_query(key, after, limit=False)
+
+    connection = pool.acquire() if pool else db.connect()
+    finished = False
+    try:
+        cursor = connection.cursor(rows.SSRecordCursor if compact
+                                   else pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+        while True:
+            users = cursor.fetchmany(page_size)
+            if not users:
+                break
+            yield users
+        cursor.close()
+        finished = True
+    finally:
+        if pool is None:
+            connection.close()
+        elif finished:
+            pool.release(connection)
+        else:
+            pool.discard(connection)
@@ -5,33 +5,42 @@ from pymysql.err import Error
 import os
 from dotenv import load_dotenv
 
+import aggregates
+
 # Load environment variables from .env file
 load_dotenv()
 
 
-def calculate_average_age():
+def calculate_average_age(source='stream'):
     """
     Calculate the average age of users in the database using a generator.
 
-    This function fetches user ages one by one from the database and computes
-    the average age without loading all the data into memory at once. The
-    average is calculated by summing the ages and dividing by the total count.
+    By default the ages are streamed from the database one at a time, as
+    plain integers, and folded into a running mean (Welford's algorithm,
+    see `aggregates.streaming_aggregates`), so the data is never loaded
+    into memory at once and no Decimal is built per row.
 
     The result is printed with two decimal places.
-    """
-    total = 0  # Accumulator for the sum of ages
-    count = 0  # Counter for the number of users
 
-    # Loop through each age fetched from the generator
-    for age in stream_user_ages():
-        total += age  # Add the current age to the total
-        count += 1  # Increment the count of users
+    Args:
+        source (str): 'stream' (default) streams every age as described
+            above, 'server' lets MySQL compute AVG/COUNT, and 'persisted'
+            reads the running aggregate kept up to date by seed.py (see
+            its --aggregate-file option).
+    """
+    if source == 'stream':
+        summary = aggregates.streaming_aggregates()
+    elif source == 'server':
+        summary = aggregates.server_aggregates()
+    elif source == 'persisted':
+        summary = aggregates.RunningAggregate.load().summary()
+    else:
+        raise ValueError(f"Unknown aggregate source: {source!r}")
 
     # Check if there are any users to avoid division by zero
-    if count > 0:
-        av = total / count  # Calculate the average age
+    if summary['count']:
         # Print the average rounded to two decimal places
-        print(f"Average age of users: {av:.2f}")
+        print(f"Average age of users: {summary['mean']:.2f}")
     else:
         # Handle the case with no users
         print("No users found to calculate the average age.")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Age aggregates over user_data: server-side, streamed or persisted.
+
+`server_aggregates` lets MySQL do the work and returns a single row.
+`streaming_aggregates` walks the ages once with Welford's online
+algorithm, which stays numerically stable where sum-of-squares does
+not. `RunningAggregate` can be saved to disk and updated as
+`seed.insert_data` adds rows, so the figures never need a rescan.
+"""
+
+import json
+import math
+import os
+import tempfile
+
+import pymysql
+
+import db
+
+# Where seed.insert_data keeps the running age aggregate by default
+AGGREGATE_FILE = os.getenv('AGE_AGGREGATE_FILE', 'age_aggregate.json')
+
+
+class RunningAggregate:
+    """
+    Count, mean, min, max and variance maintained one value at a time.
+
+    Uses Welford's update for the mean and the sum of squared
+    deviations, and Chan et al.'s formula to merge two partial
+    aggregates, e.g. from parallel workers.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None,
+                 total=0):
+        self.count = count
+        # Exact sum, ages are integers so this never loses precision
+        self.total = total
+        self.mean = mean
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+
+    def add(self, value):
+        """Fold one value into the aggregate."""
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update(self, values):
+        """Fold every value of an iterable into the aggregate."""
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        """Combine another aggregate into this one."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.total = other.total
+            self.min, self.max = other.min, other.max
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def sum(self):
+        return self.total
+
+    @property
+    def variance(self):
+        """Population variance, matching MySQL's VAR_POP."""
+        return self.m2 / self.count if self.count else None
+
+    @property
+    def stddev(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean,
+                'm2': self.m2, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['mean'], data['m2'],
+                   data['min'], data['max'], data['total'])
+
+    @classmethod
+    def from_summary(cls, summary):
+        """Rebuild an aggregate from `server_aggregates` output."""
+        count = summary['count']
+        if not count:
+            return cls()
+        return cls(count, summary['mean'], summary['variance'] * count,
+                   summary['min'], summary['max'], int(summary['sum']))
+
+    def summary(self):
+        """Return the aggregate in the same shape as `server_aggregates`."""
+        return {'count': self.count,
+                'sum': self.sum if self.count else None,
+                'mean': self.mean if self.count else None,
+                'min': self.min, 'max': self.max,
+                'variance': self.variance}
+
+    @classmethod
+    def load(cls, path=AGGREGATE_FILE):
+        """Read a saved aggregate, or start an empty one if there is none."""
+        try:
+            with open(path) as file:
+                return cls.from_dict(json.load(file))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path=AGGREGATE_FILE):
+        """Write the aggregate atomically so a crash never leaves half a file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(self.to_dict(), file)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def server_aggregates(connection=None):
+    """
+    Compute the age aggregates inside MySQL.
+
+    Args:
+        connection: An open connection, a new one is used when None.
+
+    Returns:
+        dict: count, sum, mean, min, max and population variance.
+    """
+    own = connection is None
+    connection = connection or db.connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(age), SUM(age), AVG(age), MIN(age), "
+                           "MAX(age), VAR_POP(age) FROM user_data")
+            count, total, mean, minimum, maximum, variance = cursor.fetchone()
+    finally:
+        if own:
+            connection.close()
+
+    def number(value):
+        return float(value) if value is not None else None
+
+    return {'count': count, 'sum': number(total), 'mean': number(mean),
+            'min': number(minimum), 'max': number(maximum),
+            'variance': number(variance)}
+
+
+def stream_ages(chunk_size=1000):
+    """
+    Yield every age as a plain int, read through an unbuffered cursor.
+
+    DECIMAL columns normally come back as `decimal.Decimal`; ages are
+    whole numbers, so the server casts them and no Decimal is built.
+
+    Args:
+        chunk_size (int): Rows per `fetchmany` call.
+
+    Yields:
+        int: One age per user.
+    """
+    connection = db.connect()
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute("SELECT CAST(age AS SIGNED) FROM user_data")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for (age,) in rows:
+                yield age
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def streaming_aggregates(chunk_size=1000):
+    """
+    Compute the age aggregates client-side in a single streaming pass.
+
+    Returns:
+        dict: Same keys as `server_aggregates`.
+    """
+    return RunningAggregate().update(stream_ages(chunk_size)).summary()
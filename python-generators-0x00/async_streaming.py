@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+Async (aiomysql) versions of the user_data streaming generators.
+
+Each async generator here yields the same rows, batches and pages as
+its blocking counterpart and accepts the same pagination modes and
+resume tokens, but awaits the network instead of blocking the event
+loop. Batch and page generators take `read_ahead=n` to keep up to n
+pages fetched ahead while the consumer is still busy with the current
+one.
+"""
+
+import os
+
+import aiomysql
+from dotenv import load_dotenv
+
+import pagination
+from prefetch import aprefetch
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+async def connect(cursorclass=aiomysql.Cursor, **kwargs):
+    """
+    Open an aiomysql connection to the ALX_prodev database.
+
+    Connection details come from the environment, keyword arguments
+    are passed to `aiomysql.connect` and override them.
+    """
+    params = {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'db': os.getenv('DB_DATABASE'),
+        'cursorclass': cursorclass,
+    }
+    params.update(kwargs)
+    return await aiomysql.connect(**params)
+
+
+async def _unbuffered(sql, params, chunk_size, cursorclass):
+    """Stream a query's rows in `fetchmany` chunks over an SS cursor."""
+    connection = await connect(cursorclass)
+    try:
+        cursor = await connection.cursor()
+        await cursor.execute(sql, params)
+        while True:
+            rows = await cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        await cursor.close()
+    finally:
+        # Closing the socket rather than the cursor avoids draining an
+        # unbuffered result the consumer walked away from
+        connection.close()
+
+
+async def _pages(size, mode, resume_token, key):
+    """Page through user_data over a single connection."""
+    if mode not in ('offset', 'keyset'):
+        raise ValueError(f"Unknown pagination mode: {mode!r}")
+    if resume_token is not None and mode != 'keyset':
+        raise ValueError("resume_token is only supported in keyset mode")
+
+    after = None
+    if resume_token is not None:
+        after = pagination.decode_token(resume_token, key)
+
+    connection = await connect(aiomysql.DictCursor)
+    try:
+        async with connection.cursor() as cursor:
+            offset = 0
+            while True:
+                if mode == 'keyset':
+                    sql, params = pagination.keyset_query(key, after)
+                    await cursor.execute(sql, params + (size,))
+                else:
+                    await cursor.execute(pagination.offset_query(),
+                                         (size, offset))
+
+                page = await cursor.fetchall()
+                if not page:
+                    break
+
+                if mode == 'keyset':
+                    after = pagination.last_key(page, key)
+                offset += size
+                yield list(page)
+    finally:
+        connection.close()
+
+
+async def async_stream_users(unbuffered=False, chunk_size=1000):
+    """
+    Async version of `stream_users`: yield user_data rows one by one.
+
+    Args:
+        unbuffered (bool): Stream rows with an SSCursor instead of
+            buffering the whole result first.
+        chunk_size (int): Rows per `fetchmany` call in unbuffered mode.
+
+    Yields:
+        tuple: One user row.
+    """
+    if unbuffered:
+        async for rows in _unbuffered("SELECT * FROM user_data", (),
+                                      chunk_size, aiomysql.SSCursor):
+            for row in rows:
+                yield row
+        return
+
+    connection = await connect()
+    try:
+        async with connection.cursor() as cursor:
+            await cursor.execute("SELECT * FROM user_data")
+            for row in await cursor.fetchall():
+                yield row
+    finally:
+        connection.close()
+
+
+async def async_stream_users_in_batches(batch_size, mode='offset',
+                                        resume_token=None, key='user_id',
+                                        read_ahead=0):
+    """
+    Async version of `stream_users_in_batches`.
+
+    Args:
+        batch_size (int): The number of rows to fetch in each batch.
+        mode (str): 'offset' (default) or 'keyset'.
+        resume_token (str): Token from `pagination.resume_token`.
+        key (str): The indexed column keyset mode orders and seeks on.
+        read_ahead (int): Batches to fetch ahead of the consumer.
+
+    Yields:
+        list: A batch of user data rows as dictionaries.
+    """
+    async for batch in aprefetch(
+            _pages(batch_size, mode, resume_token, key), read_ahead):
+        yield batch
+
+
+async def async_lazy_paginate(page_size, mode='offset', resume_token=None,
+                              key='user_id', read_ahead=0):
+    """
+    Async version of `lazy_paginate`.
+
+    All pages are fetched over one connection. 'stream' mode reads a
+    single ordered query through an SSDictCursor like `stream_pages`.
+
+    Args:
+        page_size (int): The number of rows to fetch per page.
+        mode (str): 'offset' (default), 'keyset' or 'stream'.
+        resume_token (str): Token from `pagination.resume_token`.
+        key (str): The indexed column keyset mode orders and seeks on.
+        read_ahead (int): Pages to fetch ahead of the consumer.
+
+    Yields:
+        list: A list of user data rows as dictionaries for the current page.
+    """
+    if mode == 'stream':
+        after = None
+        if resume_token is not None:
+            after = pagination.decode_token(resume_token, key)
+        sql, params = pagination.keyset_query(key, after, limit=False)
+        pages = _unbuffered(sql, params, page_size, aiomysql.SSDictCursor)
+    else:
+        pages = _pages(page_size, mode, resume_token, key)
+
+    async for page in aprefetch(pages, read_ahead):
+        yield page
+
+
+async def async_stream_user_ages(chunk_size=1000):
+    """
+    Async version of `stream_user_ages`: yield user ages one by one.
+
+    Yields:
+        decimal.Decimal: The age of one user.
+    """
+    async for rows in _unbuffered("SELECT age FROM user_data", (),
+                                  chunk_size, aiomysql.SSCursor):
+        for (age,) in rows:
+            yield age
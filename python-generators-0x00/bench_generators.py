@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark harness for the user_data access patterns.
+
+Usage: python3 bench_generators.py [--sizes 10000,100000] [--batch-sizes 100,1000]
+           [--patterns all] [--output results.json] [--docker]
+
+For every table size the scratch database (see bench_utils) is seeded,
+then each access pattern is run once per batch/page size in a fresh
+process. Recorded for every run:
+
+- first_row_s:  latency until the first row (or batch) is yielded
+- total_s:      time to consume everything
+- rows_per_s:   rows consumed / total_s
+- peak_rss_kb:  peak resident memory of the process that ran it
+
+Results are written as JSON so runs can be kept and compared over time.
+With --docker a throwaway MySQL 8 container is started on port 3306
+(DB_HOST, DB_USER=root and DB_PASSWORD are set to match) and removed
+afterwards; otherwise the server from the usual .env settings is used.
+The patterns are MySQL specific (pymysql cursors, `%s` parameters,
+SSCursor streaming), so there is no SQLite stand-in.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+
+import bench_utils
+
+DOCKER_NAME = 'alx-prodev-bench'
+DOCKER_PASSWORD = 'bench'
+
+
+def _patterns():
+    """
+    Map pattern names to (factory, yields_batches, uses_batch_size).
+
+    `factory(size)` returns the iterator to consume.
+    """
+    stream_users = __import__('0-stream_users').stream_users
+    batches = __import__('1-batch_processing').stream_users_in_batches
+    lazy_paginate = __import__('2-lazy_paginate').lazy_paginate
+    stream_user_ages = __import__('4-stream_ages').stream_user_ages
+    return {
+        'stream_users': (lambda size: stream_users(), False, False),
+        'stream_users_unbuffered': (
+            lambda size: stream_users(unbuffered=True, chunk_size=size),
+            False, True),
+        'stream_users_in_batches_offset': (
+            lambda size: batches(size), True, True),
+        'stream_users_in_batches_keyset': (
+            lambda size: batches(size, mode='keyset'), True, True),
+        'lazy_paginate_offset': (lambda size: lazy_paginate(size), True, True),
+        'lazy_paginate_keyset': (
+            lambda size: lazy_paginate(size, mode='keyset'), True, True),
+        'lazy_paginate_stream': (
+            lambda size: lazy_paginate(size, mode='stream'), True, True),
+        'stream_user_ages': (lambda size: stream_user_ages(), False, False),
+    }
+
+
+def _run(pattern, size, results):
+    """Child process body: consume one pattern and report its metrics."""
+    factory, batched, sized = _patterns()[pattern]
+    result = {'pattern': pattern, 'batch_size': size if sized else None}
+    try:
+        start = time.perf_counter()
+        first = None
+        rows = 0
+        for item in factory(size):
+            if first is None:
+                first = time.perf_counter() - start
+            rows += len(item) if batched else 1
+        total = time.perf_counter() - start
+        result.update({
+            'rows': rows,
+            'first_row_s': first,
+            'total_s': total,
+            'rows_per_s': rows / total if total else None,
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+    except Exception as e:
+        result['error'] = repr(e)
+    results.put(result)
+
+
+def measure(pattern, size, poll_seconds=1.0):
+    """
+    Run one pattern in a fresh process so peak RSS is its own.
+
+    A child that dies without reporting (killed for memory, crashed)
+    is recorded as an error run instead of hanging the benchmark.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run, args=(pattern, size, results))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=poll_seconds)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+            # It may have reported just before exiting
+            try:
+                return results.get(timeout=poll_seconds)
+            except queue.Empty:
+                return {'pattern': pattern, 'batch_size': size,
+                        'error': f"benchmark process exited with code "
+                                 f"{process.exitcode} without a result"}
+    finally:
+        process.join()
+
+
+def start_docker():
+    """Start a MySQL container and point the environment at it."""
+    subprocess.run(['docker', 'run', '-d', '--rm', '--name', DOCKER_NAME,
+                    '-e', f'MYSQL_ROOT_PASSWORD={DOCKER_PASSWORD}',
+                    '-p', '3306:3306', 'mysql:8'],
+                   check=True, stdout=subprocess.DEVNULL)
+    os.environ.update({'DB_HOST': '127.0.0.1', 'DB_USER': 'root',
+                       'DB_PASSWORD': DOCKER_PASSWORD})
+    os.environ.setdefault('DB_DATABASE', 'ALX_prodev')
+
+    seed = __import__('seed')
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        connection = seed.connect_db()
+        if connection:
+            connection.close()
+            return
+        time.sleep(2)
+    raise RuntimeError("MySQL container did not become ready")
+
+
+def stop_docker():
+    subprocess.run(['docker', 'stop', DOCKER_NAME],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=bench_utils.parse_sizes,
+                        default=[10000, 100000])
+    parser.add_argument('--batch-sizes', type=bench_utils.parse_sizes,
+                        default=[100, 1000])
+    parser.add_argument('--patterns', default='all',
+                        help="comma separated names, or 'all'")
+    parser.add_argument('--output', help="JSON file, stdout when omitted")
+    parser.add_argument('--docker', action='store_true')
+    args = parser.parse_args()
+
+    names = list(_patterns())
+    if args.patterns != 'all':
+        names = [name for name in args.patterns.split(',') if name]
+        unknown = set(names) - set(_patterns())
+        if unknown:
+            parser.error(f"unknown patterns: {', '.join(sorted(unknown))}")
+
+    if args.docker:
+        start_docker()
+    try:
+        runs = []
+        with bench_utils.bench_database() as connection:
+            # Children inherit the scratch database through the environment
+            database = os.environ['DB_DATABASE']
+            for rows in args.sizes:
+                bench_utils.fill_user_data(connection, rows)
+                for name in names:
+                    sized = _patterns()[name][2]
+                    for size in args.batch_sizes if sized \
+                            else args.batch_sizes[:1]:
+                        result = measure(name, size)
+                        result['table_rows'] = rows
+                        runs.append(result)
+                        outcome = result.get('error') or \
+                            f"{result['total_s']:.3f}s"
+                        print(f"{rows:>10} {name:<32} "
+                              f"{str(result['batch_size']):>6} {outcome}",
+                              file=sys.stderr)
+    finally:
+        if args.docker:
+            stop_docker()
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': database,
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
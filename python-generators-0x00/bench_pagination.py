@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+Compare OFFSET and keyset pagination over growing user_data tables.
+
+Usage: python3 bench_pagination.py [--sizes 10000,100000,1000000] [--page-size 1000]
+
+Each size is seeded into a scratch database (see bench_utils) and walked
+end to end by lazy_paginate and stream_users_in_batches in both modes.
+"""
+
+import argparse
+
+import bench_utils
+
+lazy_paginate = __import__('2-lazy_paginate').lazy_paginate
+stream_users_in_batches = __import__(
+    '1-batch_processing').stream_users_in_batches
+
+
+def walk(pages):
+    """Consume a page generator and return the number of rows seen."""
+    return sum(len(page) for page in pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=bench_utils.parse_sizes,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'function':<24} {'offset s':>10} "
+          f"{'keyset s':>10} {'speedup':>8}")
+    with bench_utils.bench_database() as connection:
+        for size in args.sizes:
+            bench_utils.fill_user_data(connection, size)
+            for name, func in (('lazy_paginate', lazy_paginate),
+                               ('stream_users_in_batches',
+                                stream_users_in_batches)):
+                seen_offset, offset_s = bench_utils.timed(
+                    walk, func(args.page_size, mode='offset'))
+                seen_keyset, keyset_s = bench_utils.timed(
+                    walk, func(args.page_size, mode='keyset'))
+                assert seen_offset == seen_keyset == size
+                print(f"{size:>10} {name:<24} {offset_s:>10.3f} "
+                      f"{keyset_s:>10.3f} {offset_s / keyset_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
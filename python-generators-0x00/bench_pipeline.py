@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Throughput of batch_processing with and without predicate pushdown.
+
+Usage: python3 bench_pipeline.py [--rows 1000000] [--batch-size 1000]
+
+The baseline is the original approach: SELECT * in OFFSET batches with
+the age > 25 filter applied in Python. Sinks discard their input so the
+numbers measure fetching and shaping only, reported in rows/sec.
+"""
+
+import argparse
+
+import bench_utils
+
+processing = __import__('1-batch_processing')
+
+
+def baseline(batch_size, sink):
+    """The pre-pushdown pipeline: fetch everything, filter client-side."""
+    for batch in processing.stream_users_in_batches(batch_size):
+        sink([user for user in batch if user['age'] > 25])
+
+
+def counting_sink():
+    """Return a sink that only counts rows, and a way to read the count."""
+    seen = [0]
+
+    def sink(batch):
+        seen[0] += len(batch['age']) if isinstance(batch, dict) else len(batch)
+    return sink, lambda: seen[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    variants = [
+        ('baseline (SELECT *, Python filter)',
+         lambda sink: baseline(args.batch_size, sink)),
+        ('pushdown, dict rows',
+         lambda sink: processing.batch_processing(args.batch_size, sink)),
+        ('pushdown, projected, array',
+         lambda sink: processing.batch_processing(
+             args.batch_size, sink, columns=('user_id', 'age'),
+             columnar='array')),
+    ]
+    if processing.np is not None:
+        variants.append(('pushdown, projected, numpy',
+                         lambda sink: processing.batch_processing(
+                             args.batch_size, sink,
+                             columns=('user_id', 'age'), columnar='numpy')))
+
+    with bench_utils.bench_database() as connection:
+        bench_utils.fill_user_data(connection, args.rows)
+        print(f"{'variant':<36} {'rows out':>10} {'rows/sec':>12}")
+        for name, run in variants:
+            sink, seen = counting_sink()
+            _, elapsed = bench_utils.timed(run, sink)
+            # Throughput is measured against the table size scanned
+            print(f"{name:<36} {seen():>10} {args.rows / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Show how much prefetching overlaps fetching with processing.
+
+Usage: python3 bench_prefetch.py [--batches 50] [--rtt-ms 20] [--work-ms 20]
+       python3 bench_prefetch.py --db [--rows 100000] [--page-size 1000]
+
+By default the source is simulated: each batch costs `--rtt-ms` to fetch
+and `--work-ms` to process, as when network round trips dominate. With
+--db the source is lazy_paginate over a scratch database instead.
+Sequential time is roughly batches * (rtt + work); with prefetching it
+approaches batches * max(rtt, work).
+"""
+
+import argparse
+import time
+
+from prefetch import prefetch
+
+
+def simulated_batches(batches, rtt):
+    """Yield `batches` empty batches, each taking `rtt` seconds to fetch."""
+    for _ in range(batches):
+        time.sleep(rtt)
+        yield []
+
+
+def consume(source, work):
+    """Spend `work` seconds on every batch of `source`."""
+    for _ in source:
+        time.sleep(work)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--rtt-ms', type=float, default=20)
+    parser.add_argument('--work-ms', type=float, default=20)
+    parser.add_argument('--depths', default='0,1,2,4')
+    parser.add_argument('--db', action='store_true')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    work = args.work_ms / 1000
+    depths = [int(depth) for depth in args.depths.split(',')]
+
+    if args.db:
+        import bench_utils
+        lazy_paginate = __import__('2-lazy_paginate').lazy_paginate
+        with bench_utils.bench_database() as connection:
+            bench_utils.fill_user_data(connection, args.rows)
+            for depth in depths:
+                start = time.perf_counter()
+                consume(prefetch(lazy_paginate(args.page_size,
+                                               mode='keyset'), depth), work)
+                print(f"depth {depth}: {time.perf_counter() - start:.3f}s")
+        return
+
+    rtt = args.rtt_ms / 1000
+    print(f"expected sequential {args.batches * (rtt + work):.3f}s, "
+          f"ideal overlap {args.batches * max(rtt, work):.3f}s")
+    for depth in depths:
+        start = time.perf_counter()
+        consume(prefetch(simulated_batches(args.batches, rtt), depth), work)
+        print(f"depth {depth}: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+Memory held by a batch of rows: DictCursor dicts vs rows.UserRow.
+
+Usage: python3 bench_row_memory.py [--rows 100000]
+
+Runs without a database: synthetic rows are converted the way each
+cursor class converts them, and the batch is measured with tracemalloc.
+"""
+
+import argparse
+import tracemalloc
+from decimal import Decimal
+
+import db
+import rows
+from bench_utils import synthetic_users
+
+
+def measure(build, raw):
+    """Return the bytes allocated by `build(raw)` and still held."""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    batch = build(raw)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del batch
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    # Values are built up front so only the row containers are measured
+    raw = [(user_id, name, email, Decimal(age))
+           for user_id, name, email, age in synthetic_users(args.rows)]
+
+    as_dicts = measure(
+        lambda batch: [dict(zip(db.USER_COLUMNS, row)) for row in batch], raw)
+    as_records = measure(
+        lambda batch: [rows.UserRow._make(row) for row in batch], raw)
+
+    print(f"{'row type':<10} {'MiB':>8} {'bytes/row':>10}")
+    for name, size in (('dict', as_dicts), ('UserRow', as_records)):
+        print(f"{name:<10} {size / 2 ** 20:>8.2f} {size / args.rows:>10.0f}")
+    print(f"saved {(as_dicts - as_records) / 2 ** 20:.2f} MiB "
+          f"per {args.rows} rows")
+
+
+if __name__ == "__main__":
+    main()
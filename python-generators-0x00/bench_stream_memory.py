@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+Measure peak client memory of stream_users, buffered vs unbuffered.
+
+Usage: python3 bench_stream_memory.py [--sizes 10000,100000,1000000] [--chunk-size 1000]
+
+Each size is seeded into a scratch database (see bench_utils) and fully
+consumed under tracemalloc. The unbuffered peak should stay flat as the
+table grows while the buffered peak grows with the row count.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import bench_utils
+
+stream_users = __import__('0-stream_users').stream_users
+
+
+def measure(rows):
+    """Consume `rows` under tracemalloc, return (count, peak bytes, seconds)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = sum(1 for _ in rows)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=bench_utils.parse_sizes,
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'mode':<11} {'peak MiB':>10} {'seconds':>9}")
+    with bench_utils.bench_database() as connection:
+        for size in args.sizes:
+            bench_utils.fill_user_data(connection, size)
+            for mode, unbuffered in (('buffered', False),
+                                     ('unbuffered', True)):
+                count, peak, elapsed = measure(stream_users(
+                    unbuffered=unbuffered, chunk_size=args.chunk_size))
+                assert count == size
+                print(f"{size:>10} {mode:<11} {peak / 2 ** 20:>10.2f} "
+                      f"{elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Helpers shared by the bench_*.py scripts"""
+
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+import db
+seed = __import__('seed')
+
+# Rows inserted per executemany call while seeding
+SEED_CHUNK = 5000
+
+
+def parse_sizes(text):
+    """Parse a comma separated list of integers such as '1000,10000'."""
+    return [int(size) for size in text.split(',') if size.strip()]
+
+
+def synthetic_users(count, start=0, rng=None):
+    """
+    Generate fake user_data rows.
+
+    Args:
+        count (int): The number of rows to generate.
+        start (int): Index of the first row, used to keep emails unique.
+        rng (random.Random): Source of ages, seeded for repeatability.
+
+    Yields:
+        tuple: (user_id, name, email, age) ready for INSERT.
+    """
+    rng = rng or random.Random(start)
+    for i in range(start, start + count):
+        yield (str(uuid.uuid4()), f"User {i}", f"user{i}@example.com",
+               rng.randint(18, 99))
+
+
+def fill_user_data(connection, rows):
+    """
+    Make the user_data table hold exactly `rows` synthetic rows.
+
+    The table is topped up when it is smaller, so walking through
+    increasing sizes only ever inserts the difference.
+
+    Args:
+        connection: An open connection to the benchmark database.
+        rows (int): The number of rows wanted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM user_data")
+        current = cursor.fetchone()[0]
+        if current > rows:
+            cursor.execute("TRUNCATE TABLE user_data")
+            current = 0
+
+        generator = synthetic_users(rows - current, start=current)
+        while True:
+            chunk = [row for _, row in zip(range(SEED_CHUNK), generator)]
+            if not chunk:
+                break
+            cursor.executemany(
+                "INSERT INTO user_data (user_id, name, email, age) "
+                "VALUES (%s, %s, %s, %s)", chunk)
+            connection.commit()
+
+
+@contextmanager
+def bench_database(suffix='_bench'):
+    """
+    Point the generators at a scratch copy of ALX_prodev.
+
+    The database `<DB_DATABASE><suffix>` is created with the user_data
+    table and `DB_DATABASE` is switched to it for the duration of the
+    block, so the real functions can be benchmarked unchanged.
+
+    Yields:
+        pymysql.connections.Connection: A connection to the scratch database.
+    """
+    original = os.getenv('DB_DATABASE') or 'ALX_prodev'
+    name = db.check_identifier(original + suffix)
+
+    server = seed.connect_db()
+    with server.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {name}")
+    server.close()
+
+    os.environ['DB_DATABASE'] = name
+    connection = db.connect()
+    try:
+        seed.create_table(connection)
+        yield connection
+    finally:
+        connection.close()
+        os.environ['DB_DATABASE'] = original
+
+
+def timed(func, *args, **kwargs):
+    """Call `func` and return (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
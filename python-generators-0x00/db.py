@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""Shared connection helpers for the user_data generators"""
+
+import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+
+import pymysql
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Columns of the user_data table, in table order
+USER_COLUMNS = ('user_id', 'name', 'email', 'age')
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def connect(cursorclass=pymysql.cursors.Cursor, **kwargs):
+    """
+    Open a connection to the ALX_prodev database.
+
+    Connection details are read from the environment, any keyword
+    argument is passed straight to `pymysql.connect` and overrides them.
+
+    Args:
+        cursorclass (type): The pymysql cursor class to use by default.
+
+    Returns:
+        pymysql.connections.Connection: An open database connection.
+    """
+    params = {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'database': os.getenv('DB_DATABASE'),
+        'cursorclass': cursorclass,
+    }
+    params.update(kwargs)
+    return pymysql.connect(**params)
+
+
+def check_identifier(name):
+    """
+    Validate a column or table name before it is put into SQL text.
+
+    Identifiers cannot be bound as query parameters, so anything that is
+    interpolated into a statement must go through this check first.
+
+    Args:
+        name (str): The identifier to validate.
+
+    Returns:
+        str: The identifier, unchanged.
+
+    Raises:
+        ValueError: If the name is not a plain SQL identifier.
+    """
+    if not isinstance(name, str) or not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return name
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of database connections.
+
+    Connections are opened lazily up to `size`, handed out with
+    `acquire` and given back with `release`. A connection that is no
+    longer usable, or whose state is unknown, should be handed to
+    `discard` instead so it is closed rather than reused.
+    """
+
+    def __init__(self, size=5, **connect_kwargs):
+        """
+        Create an empty pool.
+
+        Args:
+            size (int): Maximum number of open connections.
+            **connect_kwargs: Passed to `connect` for every new connection.
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.size = size
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def acquire(self, timeout=None):
+        """
+        Borrow a connection, opening one if the pool is not full.
+
+        Args:
+            timeout (float): Seconds to wait for a free connection,
+                None to wait forever.
+
+        Returns:
+            pymysql.connections.Connection: A live connection.
+
+        Raises:
+            queue.Empty: If no connection became free within `timeout`.
+        """
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return connect(**self.connect_kwargs)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        conn = self._idle.get(timeout=timeout)
+        try:
+            conn.ping(reconnect=True)
+        except Exception:
+            self.discard(conn)
+            raise
+        return conn
+
+    def release(self, conn):
+        """Give a connection back to the pool for reuse."""
+        if conn.open:
+            self._idle.put(conn)
+        else:
+            self.discard(conn)
+
+    def discard(self, conn):
+        """Close a connection and free its slot in the pool."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+Export user_data to a columnar on-disk format, one batch at a time.
+
+Usage: python3 export_user_data.py {arrow,parquet,npy} OUTPUT
+           [--batch-size 65536] [--columns user_id,name,email,age]
+
+The table is read with a single unbuffered query (a consistent snapshot
+under InnoDB) and every batch is appended to the output as it arrives,
+so memory use is bounded by the batch size, not the table size.
+
+- arrow:   an Arrow IPC file, one record batch per fetched batch.
+- parquet: a Parquet file, one row group per fetched batch.
+- npy:     a directory of .npy files that `np.load(mmap_mode='r')`
+           maps straight from disk. user_id is stored as fixed-width
+           'S36' and age as int64; name and email are variable length
+           and stored as <column>.data.npy (UTF-8 bytes) plus
+           <column>.offsets.npy (n + 1 int64 offsets), Arrow style.
+           `read_npy_export` opens such a directory.
+
+pyarrow is needed for arrow and parquet, npy files are written
+without any third-party package.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+from array import array
+
+import db
+
+stream_filtered_batches = __import__(
+    '1-batch_processing').stream_filtered_batches
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # only the arrow and parquet formats need it
+    pa = None
+
+# Fixed size of the .npy headers written here, so they can be rewritten
+# in place with the final row count once the export is done
+NPY_HEADER_SIZE = 128
+ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
+
+class NpyWriter:
+    """Append-only writer for a one-dimensional .npy file."""
+
+    def __init__(self, path, descr):
+        self.path = path
+        self.descr = descr
+        self.length = 0
+        self.file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        header = (f"{{'descr': '{self.descr}', 'fortran_order': False, "
+                  f"'shape': ({self.length},), }}")
+        # magic (6) + version (2) + header length (2) + padded header
+        header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+        self.file.write(b'\x93NUMPY\x01\x00')
+        self.file.write(struct.pack('<H', len(header)))
+        self.file.write(header.encode('latin1'))
+
+    def write(self, data, count):
+        """Append `count` items whose raw bytes are `data`."""
+        self.file.write(data)
+        self.length += count
+
+    def close(self):
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+
+class NpyStringWriter:
+    """Variable-length strings as a byte array plus an offsets array."""
+
+    def __init__(self, directory, name):
+        self.data = NpyWriter(os.path.join(directory, f'{name}.data.npy'),
+                              '|u1')
+        self.offsets = NpyWriter(
+            os.path.join(directory, f'{name}.offsets.npy'), f'{ENDIAN}i8')
+        self.offsets.write(array('q', [0]).tobytes(), 1)
+        self.end = 0
+
+    def write(self, values):
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = array('q')
+        for value in encoded:
+            self.end += len(value)
+            offsets.append(self.end)
+        self.data.write(b''.join(encoded), self.end - self.data.length)
+        self.offsets.write(offsets.tobytes(), len(offsets))
+
+    def close(self):
+        self.data.close()
+        self.offsets.close()
+
+
+def _export_npy(batches, output, columns):
+    os.makedirs(output, exist_ok=True)
+    writers = {}
+    for name in columns:
+        if name == 'age':
+            writers[name] = NpyWriter(os.path.join(output, 'age.npy'),
+                                      f'{ENDIAN}i8')
+        elif name == 'user_id':
+            writers[name] = NpyWriter(os.path.join(output, 'user_id.npy'),
+                                      '|S36')
+        else:
+            writers[name] = NpyStringWriter(output, name)
+
+    rows = 0
+    try:
+        for batch in batches:
+            count = len(batch[columns[0]])
+            for name, values in batch.items():
+                if name == 'age':
+                    writers[name].write(values.tobytes(), count)
+                elif name == 'user_id':
+                    writers[name].write(''.join(values).encode('ascii'),
+                                        count)
+                else:
+                    writers[name].write(values)
+            rows += count
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Written last, its presence marks a complete export
+    with open(os.path.join(output, '_meta.json'), 'w') as file:
+        json.dump({'rows': rows, 'columns': list(columns)}, file)
+    return rows
+
+
+def _arrow_batch(batch, schema):
+    arrays = [pa.array(list(batch[field.name]), type=field.type)
+              for field in schema]
+    return pa.record_batch(arrays, schema=schema)
+
+
+def _arrow_schema(columns):
+    types = {'user_id': pa.string(), 'name': pa.string(),
+             'email': pa.string(), 'age': pa.int64()}
+    return pa.schema([(name, types[name]) for name in columns])
+
+
+def _export_arrow(batches, output, columns):
+    schema = _arrow_schema(columns)
+    rows = 0
+    with pa.OSFile(output, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                record_batch = _arrow_batch(batch, schema)
+                writer.write_batch(record_batch)
+                rows += record_batch.num_rows
+    return rows
+
+
+def _export_parquet(batches, output, columns):
+    schema = _arrow_schema(columns)
+    rows = 0
+    with pa.parquet.ParquetWriter(output, schema) as writer:
+        for batch in batches:
+            record_batch = _arrow_batch(batch, schema)
+            writer.write_batch(record_batch)
+            rows += record_batch.num_rows
+    return rows
+
+
+EXPORTERS = {'arrow': _export_arrow, 'parquet': _export_parquet,
+             'npy': _export_npy}
+
+
+def export(fmt, output, batch_size=65536, columns=db.USER_COLUMNS,
+           batches=None):
+    """
+    Stream user_data into a columnar file or directory.
+
+    Args:
+        fmt (str): 'arrow', 'parquet' or 'npy'.
+        output (str): File to write, or directory for 'npy'.
+        batch_size (int): Rows fetched and written per batch.
+        columns (tuple): The columns to export.
+        batches (iterable): Column batches to write instead of reading
+            the database, in the shape `stream_filtered_batches` yields
+            with columnar='array'.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {fmt!r}")
+    if fmt != 'npy' and pa is None:
+        raise ImportError(f"Exporting to {fmt} requires pyarrow")
+
+    columns = tuple(columns)
+    if batches is None:
+        batches = stream_filtered_batches(batch_size, columns,
+                                          columnar='array')
+    return EXPORTERS[fmt](batches, output, columns)
+
+
+class StringColumn:
+    """Read-only view of a variable-length string column of an npy export."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+
+def read_npy_export(directory):
+    """
+    Memory-map an npy export.
+
+    Returns:
+        dict: Column name to a read-only memmap for fixed-width columns,
+        or a `StringColumn` for variable-length ones.
+    """
+    import numpy as np
+
+    with open(os.path.join(directory, '_meta.json')) as file:
+        meta = json.load(file)
+
+    columns = {}
+    for name in meta['columns']:
+        path = os.path.join(directory, f'{name}.npy')
+        if os.path.exists(path):
+            columns[name] = np.load(path, mmap_mode='r')
+        else:
+            columns[name] = StringColumn(
+                np.load(os.path.join(directory, f'{name}.data.npy'),
+                        mmap_mode='r'),
+                np.load(os.path.join(directory, f'{name}.offsets.npy'),
+                        mmap_mode='r'))
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export user_data to a columnar format")
+    parser.add_argument('format', choices=sorted(EXPORTERS))
+    parser.add_argument('output')
+    parser.add_argument('--batch-size', type=int, default=65536)
+    parser.add_argument('--columns', default=','.join(db.USER_COLUMNS))
+    args = parser.parse_args()
+
+    rows = export(args.format, args.output, args.batch_size,
+                  [column for column in args.columns.split(',') if column])
+    print(f"Exported {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Keyset (seek) pagination helpers for the user_data table.
+
+OFFSET pagination makes the server walk past every earlier row on each
+page, so a full walk costs O(n^2). Keyset pagination remembers the last
+key seen and asks for `WHERE key > last ORDER BY key LIMIT n`, which an
+index answers directly no matter how deep into the table the page is.
+"""
+
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from db import check_identifier
+
+# Tie-breaker appended to non-unique keys so the ordering is total
+UNIQUE_KEY = 'user_id'
+
+
+def offset_query(table='user_data'):
+    """
+    Build the classic `LIMIT %s OFFSET %s` page query.
+
+    Args:
+        table (str): The table to page through.
+
+    Returns:
+        str: SQL taking (page_size, offset) as parameters.
+    """
+    return (f"SELECT * FROM {check_identifier(table)} "
+            f"ORDER BY {UNIQUE_KEY} LIMIT %s OFFSET %s")
+
+
+def keyset_query(key=UNIQUE_KEY, after=None, table='user_data', limit=True):
+    """
+    Build a seek query returning the page that follows `after`.
+
+    Args:
+        key (str): The indexed column to order and seek on.
+        after (tuple): The sort key of the last row already seen,
+            or None to start from the beginning.
+        table (str): The table to page through.
+        limit (bool): End the query with `LIMIT %s`. Without it the
+            query returns everything after `after`.
+
+    Returns:
+        tuple: The SQL text and its parameters, minus the trailing
+        page size which the caller appends when `limit` is set.
+    """
+    table = check_identifier(table)
+    key = check_identifier(key)
+
+    if key == UNIQUE_KEY:
+        order = key
+        where, params = f"{key} > %s", tuple(after or ())
+    else:
+        # Row comparison on (key, user_id) keeps duplicate keys in order
+        order = f"{key}, {UNIQUE_KEY}"
+        where, params = f"({key}, {UNIQUE_KEY}) > (%s, %s)", tuple(after or ())
+
+    sql = f"SELECT * FROM {table}"
+    if after is not None:
+        sql += f" WHERE {where}"
+    sql += f" ORDER BY {order}"
+    if limit:
+        sql += " LIMIT %s"
+    return sql, params
+
+
+def last_key(page, key=UNIQUE_KEY):
+    """
+    Extract the sort key of the last row of a page.
+
+    Args:
+        page (list): A non-empty page of rows, as dictionaries or as
+            named tuples (see rows.py).
+        key (str): The column the page was ordered on.
+
+    Returns:
+        tuple: The values to pass as `after` for the next page.
+    """
+    row = page[-1]
+    if not isinstance(row, dict):
+        row = row._asdict()
+    if key == UNIQUE_KEY:
+        return (row[key],)
+    return (row[key], row[UNIQUE_KEY])
+
+
+def encode_token(after, key=UNIQUE_KEY):
+    """
+    Turn a sort key into an opaque, URL-safe resume token.
+
+    Args:
+        after (tuple): The sort key of the last row processed.
+        key (str): The column the walk is ordered on.
+
+    Returns:
+        str: A token that `decode_token` turns back into `after`.
+    """
+    values = [str(v) if isinstance(v, Decimal) else v for v in after]
+    payload = json.dumps({'key': key, 'after': values},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_token(token, key=UNIQUE_KEY):
+    """
+    Decode a resume token produced by `encode_token`.
+
+    Args:
+        token (str): The token handed out earlier.
+        key (str): The column the resumed walk is ordered on.
+
+    Returns:
+        tuple: The sort key to resume after.
+
+    Raises:
+        ValueError: If the token is malformed or was issued for a
+        different key.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        token_key, after = payload['key'], tuple(payload['after'])
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid resume token: {e}") from None
+
+    if token_key != key:
+        raise ValueError(
+            f"Resume token was issued for key {token_key!r}, not {key!r}")
+    return after
+
+
+def resume_token(page, key=UNIQUE_KEY):
+    """
+    Return the token that resumes a walk right after `page`.
+
+    Args:
+        page (list): The last page the consumer finished processing.
+        key (str): The column the walk is ordered on.
+
+    Returns:
+        str: An opaque resume token.
+    """
+    return encode_token(last_key(page, key), key)
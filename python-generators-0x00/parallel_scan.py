@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Partitioned parallel scan of user_data across worker processes.
+
+The table is split into disjoint user_id ranges. Each range is streamed
+over its own connection in a process pool, every row goes through a
+mapper, and each worker folds its rows into a partial result with a
+reducer. The partial results are then folded together in the parent.
+CPU-heavy per-row work scales with the number of cores, and MySQL
+serves the ranges concurrently through the primary key.
+
+    def older(row):
+        return 1 if row[3] > 25 else 0
+
+    total = parallel_scan(older, operator.add, 0)
+
+`mapper` and `reducer` are sent to the workers by pickling, so they
+must be module-level functions (or other picklable callables).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+import pymysql
+
+import db
+
+
+def prefix_bounds(partitions):
+    """
+    Split the user_id space evenly by leading hex digits.
+
+    UUIDv4 and UUIDv5 ids are uniformly distributed, so equal slices
+    of the key space hold about the same number of rows.
+
+    Args:
+        partitions (int): The number of ranges wanted, up to 4096.
+
+    Returns:
+        list: Inner boundaries, `partitions - 1` sorted user_id prefixes.
+    """
+    digits = 1
+    while 16 ** digits < partitions and digits < 3:
+        digits += 1
+    prefixes = [format(i, f'0{digits}x') for i in range(16 ** digits)]
+    step = len(prefixes) / partitions
+    return sorted({prefixes[int(i * step)] for i in range(1, partitions)})
+
+
+def quantile_bounds(partitions, sample_size=10000, connection=None):
+    """
+    Split user_id at quantiles of a random sample of the table.
+
+    Useful when the ids are not uniform, e.g. imported from elsewhere.
+
+    Args:
+        partitions (int): The number of ranges wanted.
+        sample_size (int): How many user_id values to sample.
+        connection: An open connection, a new one is used when None.
+
+    Returns:
+        list: Inner boundaries, at most `partitions - 1` sorted user_ids.
+    """
+    own = connection is None
+    connection = connection or db.connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM user_data")
+            (count,) = cursor.fetchone()
+            if count == 0:
+                return []
+            # Bernoulli sample, so MySQL never sorts the whole table
+            cursor.execute("SELECT user_id FROM user_data WHERE RAND() < %s",
+                           (min(1.0, sample_size / count),))
+            sample = sorted(row[0] for row in cursor.fetchall())
+    finally:
+        if own:
+            connection.close()
+
+    if not sample:
+        return []
+    return sorted({sample[len(sample) * i // partitions]
+                   for i in range(1, partitions)})
+
+
+def ranges(bounds):
+    """Turn inner boundaries into (low, high) ranges, None meaning open."""
+    edges = [None] + list(bounds) + [None]
+    return list(zip(edges, edges[1:]))
+
+
+def _range_query(low, high, columns):
+    select = ', '.join(db.check_identifier(column) for column in columns)
+    clauses, params = [], []
+    if low is not None:
+        clauses.append("user_id >= %s")
+        params.append(low)
+    if high is not None:
+        clauses.append("user_id < %s")
+        params.append(high)
+    sql = f"SELECT {select} FROM user_data"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, tuple(params)
+
+
+def scan_range(low, high, mapper, reducer, initial, columns=db.USER_COLUMNS,
+               chunk_size=1000):
+    """
+    Stream one user_id range and fold it into a partial result.
+
+    Runs in a worker process with a connection of its own.
+
+    Args:
+        low (str): Inclusive lower bound, None for the start of the table.
+        high (str): Exclusive upper bound, None for the end of the table.
+        mapper (callable): Called with every row tuple.
+        reducer (callable): reducer(accumulated, mapped) -> accumulated.
+        initial: The starting value of the partial result.
+        columns (tuple): The columns each row tuple holds.
+        chunk_size (int): Rows per `fetchmany` call.
+
+    Returns:
+        The partial result for the range.
+    """
+    sql, params = _range_query(low, high, columns)
+    result = initial
+    connection = db.connect()
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for row in chunk:
+                result = reducer(result, mapper(row))
+        cursor.close()
+    finally:
+        connection.close()
+    return result
+
+
+def parallel_scan(mapper, reducer, initial, workers=None, partitions=None,
+                  strategy='prefix', columns=db.USER_COLUMNS,
+                  chunk_size=1000):
+    """
+    Map and reduce every row of user_data using a pool of processes.
+
+    `initial` seeds every partition and the final merge, so it must be
+    the identity of `reducer` (0 for addition, an empty list for list
+    concatenation, ...). The reducer must also be able to combine two
+    partial results, which holds whenever mapped values and results
+    have the same type.
+
+    Args:
+        mapper (callable): Called with every row tuple, in the workers.
+        reducer (callable): reducer(accumulated, value) -> accumulated.
+        initial: Identity value of the reducer.
+        workers (int): Number of processes, one per CPU when None.
+        partitions (int): Number of user_id ranges, 4 per worker when
+            None so a slow range does not hold up the whole scan.
+        strategy (str): 'prefix' to split on hex digits of user_id, or
+            'quantile' to split at quantiles of a sample.
+        columns (tuple): The columns passed to the mapper.
+        chunk_size (int): Rows per `fetchmany` call in each worker.
+
+    Returns:
+        The reduction over the whole table.
+    """
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 4
+    if strategy == 'prefix':
+        bounds = prefix_bounds(partitions)
+    elif strategy == 'quantile':
+        bounds = quantile_bounds(partitions)
+    else:
+        raise ValueError(f"Unknown partitioning strategy: {strategy!r}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_range, low, high, mapper, reducer,
+                               initial, tuple(columns), chunk_size)
+                   for low, high in ranges(bounds)]
+        return reduce(reducer, (future.result() for future in futures),
+                      initial)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""
+Double-buffered prefetching for batch and page generators.
+
+Fetching batch N+1 and processing batch N normally happen one after
+the other. `prefetch` runs the source generator in a background thread
+and `aprefetch` runs an async source in a task, each feeding a bounded
+queue, so the next fetch overlaps the consumer's work. The queue bound
+is the backpressure: once `depth` items are waiting, the producer stops
+fetching until the consumer catches up.
+
+    for page in prefetch(lazy_paginate(100), depth=2):
+        handle(page)
+"""
+
+import asyncio
+import queue
+import threading
+
+# How often a blocked producer checks whether the consumer went away
+_POLL_SECONDS = 0.1
+
+
+def prefetch(iterable, depth=1):
+    """
+    Iterate `iterable` in a background thread, up to `depth` items ahead.
+
+    The source runs entirely in the producer thread, so a generator
+    holding a database connection keeps using it from a single thread.
+    When the consumer stops early the producer is told to stop, the
+    source is closed in its own thread and the thread is joined.
+
+    Args:
+        iterable: The batches or pages to fetch ahead of time.
+        depth (int): Maximum number of items waiting in the queue,
+            0 to iterate in the caller's thread without prefetching.
+
+    Yields:
+        The items of `iterable`, in order.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        source = None
+        last = (end, None)
+        try:
+            source = iter(iterable)
+            for item in source:
+                if not put((item, None)):
+                    last = None
+                    break
+        except BaseException as e:
+            # Even KeyboardInterrupt or GeneratorExit is handed over,
+            # the consumer would otherwise wait for the end forever
+            last = (end, e)
+        finally:
+            try:
+                if last is not None:
+                    put(last)
+            finally:
+                close = getattr(source, 'close', None)
+                if close is not None:
+                    close()
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+async def aprefetch(aiterable, depth=1):
+    """
+    Iterate an async iterable in a task, up to `depth` items ahead.
+
+    The source is cancelled and closed as soon as the consumer stops,
+    whether it finished, broke out early or raised.
+
+    Args:
+        aiterable: The async batches or pages to fetch ahead of time.
+        depth (int): Maximum number of items waiting in the queue,
+            0 to iterate without prefetching.
+
+    Yields:
+        The items of `aiterable`, in order.
+    """
+    aclose = getattr(aiterable, 'aclose', None)
+    if depth <= 0:
+        try:
+            async for item in aiterable:
+                yield item
+        finally:
+            if aclose is not None:
+                await aclose()
+        return
+
+    items = asyncio.Queue(maxsize=depth)
+    end = object()
+
+    async def produce():
+        try:
+            async for item in aiterable:
+                await items.put((item, None))
+            await items.put((end, None))
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await items.put((end, e))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                break
+            yield item
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Compact row type for streamed user_data rows.
+
+`DictCursor` builds a fresh dict per row, each carrying its own hash
+table of column names. The cursors here return named tuples instead:
+values are stored in a plain tuple and the column names live once, on
+the class, while rows still read as `row.email` or `row[2]`.
+
+    connection.cursor(rows.RecordCursor)
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import pymysql
+
+import db
+
+
+@lru_cache(maxsize=64)
+def record_type(fields):
+    """
+    Return the named tuple class for a result with the given columns.
+
+    Classes are cached, so every result with the same columns shares one.
+
+    Args:
+        fields (tuple): The column names, in result order.
+    """
+    return namedtuple('Record', fields, rename=True)
+
+
+# Row type of SELECT * FROM user_data
+UserRow = record_type(db.USER_COLUMNS)
+
+
+class RecordCursorMixin:
+    """Cursor mixin returning rows as named tuples, like DictCursorMixin."""
+
+    def _do_get_result(self):
+        super()._do_get_result()
+        if self.description:
+            self._record = record_type(
+                tuple(field[0] for field in self.description))
+            if self._rows:
+                self._rows = [self._record._make(r) for r in self._rows]
+
+    def _conv_row(self, row):
+        if row is None:
+            return None
+        return self._record._make(row)
+
+
+class RecordCursor(RecordCursorMixin, pymysql.cursors.Cursor):
+    """A buffered cursor which returns rows as named tuples"""
+
+
+class SSRecordCursor(RecordCursorMixin, pymysql.cursors.SSCursor):
+    """An unbuffered cursor which returns rows as named tuples"""
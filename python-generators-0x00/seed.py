@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import uuid
 from dotenv import load_dotenv
 import csv
+import json
 import pymysql
 from pymysql import Error
 
+from aggregates import AGGREGATE_FILE, RunningAggregate, server_aggregates
+
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,14 +46,18 @@ def create_database(connection):
         print(f"Error creating database: {e}")
 
 
-def connect_to_prodev():
-    """Function to connect to the MySQL database"""
+def connect_to_prodev(local_infile=False):
+    """Function to connect to the MySQL database
+
+    Pass `local_infile=True` to allow `load_data_infile` on the connection.
+    """
     try:
         connection = pymysql.connect(
             host=os.getenv('DB_HOST'),
             user=os.getenv('DB_USER'),
             password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_DATABASE')
+            database=os.getenv('DB_DATABASE'),
+            local_infile=local_infile
         )
         return connection
 
@@ -74,31 +83,552 @@ def create_table(connection):
         print(f"Error creating user_data table: {e}")
 
 
-def insert_data(connection, user_data_file):
-    """Function to insert data into the table"""
+INSERT_USER = ("INSERT INTO user_data (user_id, name, email, age) "
+               "VALUES (%s, %s, %s, %s)")
+
+# How each on_duplicate mode turns INSERT_USER into an idempotent statement
+ON_DUPLICATE = {
+    None: INSERT_USER,
+    'ignore': INSERT_USER.replace("INSERT", "INSERT IGNORE", 1),
+    'update': INSERT_USER + (" ON DUPLICATE KEY UPDATE name = VALUES(name), "
+                             "email = VALUES(email), age = VALUES(age)"),
+}
+
+# Namespace of the deterministic user_id values, never change it
+USER_ID_NAMESPACE = uuid.UUID('6f1c4f3e-8a55-4d3b-9a3e-2b7d0c9e5a41')
+
+
+def user_id_for(email):
+    """Derive a stable user_id (UUIDv5) from an email address."""
+    return str(uuid.uuid5(USER_ID_NAMESPACE, email.strip().lower()))
+
+
+def _load_checkpoint(checkpoint_file, user_data_file):
+    """Return the byte offset a previous load of this file committed up to."""
     try:
-        cursor = connection.cursor()
-        with open(user_data_file, 'r') as file:
-            csv_reader = csv.reader(file)  # read csv file
-            next(csv_reader)  # Skip header row
-            for line in csv_reader:
-                if line:
+        with open(checkpoint_file) as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return None
+    if checkpoint['file'] != os.path.abspath(user_data_file):
+        raise ValueError(f"Checkpoint {checkpoint_file} belongs to "
+                         f"{checkpoint['file']}, not {user_data_file}")
+    return checkpoint['offset']
+
+
+def _write_json(path, data):
+    """Write a JSON file atomically, aside and renamed into place."""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp, path)
+
+
+def _save_checkpoint(checkpoint_file, user_data_file, offset):
+    """Atomically record that everything before `offset` is committed."""
+    _write_json(checkpoint_file, {'file': os.path.abspath(user_data_file),
+                                  'offset': offset})
+
+
+def _range_checkpoint(checkpoint_file, index):
+    """Checkpoint file of one range of a parallel load."""
+    return f'{checkpoint_file}.{index}'
+
+
+def _parallel_ranges(user_data_file, workers, checkpoint_file=None):
+    """
+    Return the byte ranges a parallel load still has to insert.
+
+    Without a checkpoint the file is split into `workers` ranges. With
+    one, the split is recorded in `checkpoint_file` on the first run and
+    reused on the next, whatever the number of workers, and each range
+    resumes from the offset its worker committed up to (recorded in
+    `_range_checkpoint(checkpoint_file, index)`).
+
+    Returns:
+        tuple: The (index, start, end) ranges left to load, and the
+        number of ranges the file was split into.
+    """
+    if not checkpoint_file:
+        ranges = _csv_ranges(user_data_file, workers)
+        return ([(index, start, end)
+                 for index, (start, end) in enumerate(ranges)], len(ranges))
+
+    path = os.path.abspath(user_data_file)
+    try:
+        with open(checkpoint_file) as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        checkpoint = {'file': path,
+                      'ranges': _csv_ranges(user_data_file, workers)}
+        _write_json(checkpoint_file, checkpoint)
+    if checkpoint['file'] != path or 'ranges' not in checkpoint:
+        raise ValueError(f"Checkpoint {checkpoint_file} is not one of a "
+                         f"parallel load of {user_data_file}")
+
+    left = []
+    for index, (start, end) in enumerate(checkpoint['ranges']):
+        offset = _load_checkpoint(_range_checkpoint(checkpoint_file, index),
+                                  user_data_file)
+        start = start if offset is None else offset
+        if start < end:
+            left.append((index, start, end))
+    return left, len(checkpoint['ranges'])
+
+
+def print_progress(rows, elapsed):
+    """Default progress report: rows loaded so far and the overall rate."""
+    rate = rows / elapsed if elapsed else 0.0
+    print(f"Inserted {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
 
-                    # Extract values from the line
-                    name, email, age = line
 
-                    # Generate a unique UUID for user_id
-                    user_id = str(uuid.uuid4())
+def _csv_ranges(user_data_file, parts):
+    """
+    Split a CSV file into byte ranges that start and end on line breaks.
 
-                    # Convert age to integer
-                    age = int(age)
+    The header line is left out of every range. Quoted fields spanning
+    several lines are not supported, which user_data.csv never has.
 
-                    cursor.execute(
-                        "INSERT INTO user_data (user_id, name, email, age) VALUES (%s, %s, %s, %s)",
-                        (user_id, name, email, age)
-                    )
+    Args:
+        user_data_file (str): Path of the CSV file.
+        parts (int): The number of ranges wanted.
 
+    Returns:
+        list: (start, end) byte offsets, possibly fewer than `parts`.
+    """
+    size = os.path.getsize(user_data_file)
+    with open(user_data_file, 'rb') as file:
+        file.readline()  # Skip header row
+        first = file.tell()
+        bounds = [first]
+        for i in range(1, parts):
+            target = first + (size - first) * i // parts
+            if target <= bounds[-1]:
+                continue
+            file.seek(target - 1)
+            file.readline()  # Move to the start of the next line
+            if file.tell() >= size:
+                break
+            if file.tell() > bounds[-1]:
+                bounds.append(file.tell())
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def _read_csv_range(user_data_file, start=None, end=None):
+    """
+    Parse the CSV rows found between two byte offsets.
+
+    Args:
+        user_data_file (str): Path of the CSV file.
+        start (int): Offset of the first line, just past the header when None.
+        end (int): Offset to stop at, the end of the file when None.
+
+    Yields:
+        tuple: The fields of each non-empty row, and the byte offset
+        just past that row.
+    """
+    with open(user_data_file, 'rb') as file:
+        if start is None:
+            file.readline()  # Skip header row
+        else:
+            file.seek(start)
+        end = os.path.getsize(user_data_file) if end is None else end
+
+        def lines():
+            while file.tell() < end:
+                line = file.readline()
+                if not line:
+                    break
+                yield line.decode('utf-8')
+
+        # csv.reader pulls exactly one line per row, so tell() is the
+        # offset right after the row just parsed
+        for line in csv.reader(lines()):
+            if line:
+                yield line, file.tell()
+
+
+def _insert_rows(connection, rows, batch_size, commit_every, on_commit,
+                 on_duplicate=None, deterministic_ids=False):
+    """
+    Insert parsed CSV rows in `executemany` batches.
+
+    Args:
+        connection: An open connection to ALX_prodev.
+        rows (iterable): ((name, email, age), offset) pairs as produced
+            by `_read_csv_range`.
+        batch_size (int): Rows per `executemany` call.
+        commit_every (int): Rows per transaction, None for a single one.
+        on_commit (callable): Called as on_commit(inserted, added, offset)
+            after every commit, with the total row count, a
+            RunningAggregate of the ages committed since the previous
+            call and the CSV offset everything before is committed up to.
+        on_duplicate (str): None, 'ignore' or 'update', see `ON_DUPLICATE`.
+        deterministic_ids (bool): Derive user_id from the email instead
+            of generating a random one.
+
+    Returns:
+        int: The number of rows inserted.
+    """
+    statement = ON_DUPLICATE[on_duplicate]
+    added = RunningAggregate()
+    inserted = uncommitted = 0
+    offset = None
+
+    def commit():
+        nonlocal added, uncommitted
         connection.commit()
-        cursor.close()
+        uncommitted = 0
+        on_commit(inserted, added, offset)
+        added = RunningAggregate()
+
+    cursor = connection.cursor()
+    batch = []
+    for line, end in rows:
+
+        # Extract values from the line
+        name, email, age = line
+
+        # Generate a unique UUID for user_id, or a stable one per email
+        user_id = user_id_for(email) if deterministic_ids else str(uuid.uuid4())
+
+        # Convert age to integer
+        age = int(age)
+
+        batch.append((user_id, name, email, age))
+        added.add(age)
+
+        if len(batch) >= batch_size:
+            cursor.executemany(statement, batch)
+            inserted += len(batch)
+            uncommitted += len(batch)
+            offset = end
+            batch = []
+            if commit_every and uncommitted >= commit_every:
+                commit()
+
+    if batch:
+        cursor.executemany(statement, batch)
+        inserted += len(batch)
+        offset = end
+
+    commit()
+    cursor.close()
+    return inserted
+
+
+def insert_data(connection, user_data_file, aggregate_file=None,
+                batch_size=1000, commit_every=None, progress=None,
+                on_duplicate=None, deterministic_ids=False,
+                checkpoint_file=None):
+    """Function to insert data into the table
+
+    Rows are sent `batch_size` at a time with `executemany`, which pymysql
+    turns into a single multi-row INSERT. By default everything is
+    committed once at the end; `commit_every` commits after that many rows
+    instead, so a large load does not build one giant transaction.
+
+    When `aggregate_file` is given, the running age aggregate saved there
+    (see aggregates.RunningAggregate) is updated with the inserted ages
+    once they are committed, so it never needs a full rescan.
+
+    For a load that can be safely re-run, use `deterministic_ids=True`
+    with `on_duplicate='ignore'` (or 'update'): a row loaded twice maps to
+    the same user_id and is skipped or refreshed instead of duplicated.
+    With `checkpoint_file` the CSV offset of every commit is recorded, and
+    a later call with the same checkpoint resumes from there; it needs
+    `commit_every`, since a single transaction leaves nothing to resume
+    from. The file is removed once the load completes. A crash between a
+    commit and its checkpoint replays one batch, which the idempotent
+    options absorb.
+
+    The ages of skipped, overwritten or replayed rows cannot be told
+    apart from new ones, so with `on_duplicate` or `checkpoint_file` the
+    `aggregate_file` is not updated per commit but rebuilt from the table
+    (`aggregates.server_aggregates`) once the load completes.
+
+    Args:
+        connection: An open connection to ALX_prodev.
+        user_data_file (str): Path of the CSV file to load.
+        aggregate_file (str): Running age aggregate to keep up to date.
+        batch_size (int): Rows per `executemany` call.
+        commit_every (int): Rows per transaction, None for a single one.
+        progress (callable): Called as progress(rows, elapsed_seconds)
+            after every commit, e.g. `print_progress`.
+        on_duplicate (str): None to fail on duplicate keys, 'ignore' to
+            skip them or 'update' to overwrite them.
+        deterministic_ids (bool): Use a UUIDv5 of the email as user_id.
+        checkpoint_file (str): Where to record the committed CSV offset.
+
+    Returns:
+        int: The number of rows inserted, or None on error.
+    """
+    if on_duplicate not in ON_DUPLICATE:
+        raise ValueError(f"Unknown on_duplicate mode: {on_duplicate!r}")
+    if checkpoint_file and not commit_every:
+        raise ValueError("checkpoint_file requires commit_every")
+
+    start = time.perf_counter()
+    resume = None
+    if checkpoint_file:
+        resume = _load_checkpoint(checkpoint_file, user_data_file)
+    rebuild_aggregate = bool(on_duplicate or checkpoint_file)
+
+    def on_commit(inserted, added, offset):
+        if aggregate_file and not rebuild_aggregate:
+            RunningAggregate.load(aggregate_file).merge(added).save(
+                aggregate_file)
+        if checkpoint_file and offset is not None:
+            _save_checkpoint(checkpoint_file, user_data_file, offset)
+        if progress:
+            progress(inserted, time.perf_counter() - start)
+
+    try:
+        inserted = _insert_rows(
+            connection, _read_csv_range(user_data_file, resume),
+            batch_size, commit_every, on_commit, on_duplicate,
+            deterministic_ids)
+        if aggregate_file and rebuild_aggregate:
+            RunningAggregate.from_summary(
+                server_aggregates(connection)).save(aggregate_file)
     except Error as e:
         print(f"Error inserting data: {e}")
+        return None
+
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return inserted
+
+
+def _insert_range(user_data_file, start, end, batch_size, commit_every,
+                  on_duplicate=None, deterministic_ids=False,
+                  checkpoint_file=None):
+    """
+    Worker for `parallel_insert_data`: load one byte range of the CSV.
+
+    Runs in a child process with a connection of its own, recording the
+    offset of every commit in `checkpoint_file` when given.
+
+    Returns:
+        dict: Range bounds, rows inserted, seconds taken and the age
+        aggregate of the rows, as a plain dict.
+    """
+    began = time.perf_counter()
+    added = RunningAggregate()
+
+    def on_commit(inserted, chunk, offset):
+        added.merge(chunk)
+        if checkpoint_file and offset is not None:
+            _save_checkpoint(checkpoint_file, user_data_file, offset)
+
+    connection = connect_to_prodev()
+    if connection is None:
+        raise RuntimeError("Worker could not connect to ALX_prodev")
+    try:
+        rows = _insert_rows(connection,
+                            _read_csv_range(user_data_file, start, end),
+                            batch_size, commit_every, on_commit,
+                            on_duplicate, deterministic_ids)
+    finally:
+        connection.close()
+    return {'start': start, 'end': end, 'rows': rows,
+            'seconds': time.perf_counter() - began,
+            'aggregate': added.to_dict()}
+
+
+def print_worker_stats(stats):
+    """Default per-worker report for `parallel_insert_data`."""
+    for i, worker in enumerate(stats):
+        rate = worker['rows'] / worker['seconds'] if worker['seconds'] else 0
+        print(f"Worker {i}: bytes {worker['start']}-{worker['end']}, "
+              f"{worker['rows']} rows in {worker['seconds']:.1f}s "
+              f"({rate:,.0f} rows/s)")
+
+
+def parallel_insert_data(user_data_file, workers=None, aggregate_file=None,
+                         batch_size=1000, commit_every=100000,
+                         report=print_worker_stats, on_duplicate=None,
+                         deterministic_ids=False, checkpoint_file=None):
+    """Load a CSV with several processes, each on its own connection
+
+    The database and table are created once, up front, in this process.
+    The file is then cut into byte ranges on line boundaries and each
+    range is parsed and inserted by a worker of a process pool, so CSV
+    parsing and UUID generation use every core.
+
+    With `checkpoint_file` the split and every worker's committed
+    offset are recorded, and a later call with the same checkpoint
+    resumes each range where it stopped, as `insert_data` does for a
+    single one. The files are removed once the load completes.
+
+    Args:
+        user_data_file (str): Path of the CSV file to load.
+        workers (int): Number of worker processes, one per CPU when None.
+        aggregate_file (str): Running age aggregate to keep up to date,
+            rebuilt from the table when `on_duplicate` is set.
+        batch_size (int): Rows per `executemany` call.
+        commit_every (int): Rows per transaction within each worker.
+        report (callable): Called with the list of per-worker stats.
+        on_duplicate (str): See `insert_data`.
+        deterministic_ids (bool): Use a UUIDv5 of the email as user_id.
+        checkpoint_file (str): Where to record the split and the
+            committed CSV offsets.
+
+    Returns:
+        int: The number of rows inserted, or None if setup failed.
+    """
+    if checkpoint_file and not commit_every:
+        raise ValueError("checkpoint_file requires commit_every")
+    workers = workers or os.cpu_count() or 1
+
+    connection = connect_db()
+    if connection is None:
+        return None
+    create_database(connection)
+    connection.close()
+
+    connection = connect_to_prodev()
+    if connection is None:
+        return None
+    create_table(connection)
+    connection.close()
+
+    ranges, count = _parallel_ranges(user_data_file, workers,
+                                     checkpoint_file)
+    with ProcessPoolExecutor(
+            max_workers=min(workers, len(ranges)) or 1) as pool:
+        futures = [pool.submit(
+            _insert_range, user_data_file, start, end, batch_size,
+            commit_every, on_duplicate, deterministic_ids,
+            checkpoint_file and _range_checkpoint(checkpoint_file, index))
+            for index, start, end in ranges]
+        stats = [future.result() for future in futures]
+
+    if aggregate_file and (on_duplicate or checkpoint_file):
+        # Workers count skipped, overwritten and replayed rows too, and a
+        # resumed load misses the ages of earlier runs, see insert_data
+        connection = connect_to_prodev()
+        if connection is None:
+            return None
+        try:
+            RunningAggregate.from_summary(
+                server_aggregates(connection)).save(aggregate_file)
+        finally:
+            connection.close()
+    elif aggregate_file:
+        total = RunningAggregate.load(aggregate_file)
+        for worker in stats:
+            total.merge(RunningAggregate.from_dict(worker['aggregate']))
+        total.save(aggregate_file)
+    if checkpoint_file:
+        for index in range(count):
+            path = _range_checkpoint(checkpoint_file, index)
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(checkpoint_file)
+    if report:
+        report(stats)
+    return sum(worker['rows'] for worker in stats)
+
+
+def load_data_infile(connection, user_data_file, aggregate_file=None,
+                     progress=None):
+    """Bulk load the CSV with LOAD DATA LOCAL INFILE
+
+    The fastest path: the server parses the file itself and generates
+    each user_id with UUID(). The connection must have been opened with
+    `local_infile=True` (see `connect_to_prodev`) and the server must
+    allow `local_infile`.
+
+    Args:
+        connection: A connection to ALX_prodev opened with local_infile.
+        user_data_file (str): Path of the CSV file to load.
+        aggregate_file (str): Running age aggregate to rebuild from the
+            table afterwards, since the rows never pass through Python.
+        progress (callable): Called as progress(rows, elapsed_seconds)
+            once the load has been committed.
+
+    Returns:
+        int: The number of rows loaded, or None on error.
+    """
+    start = time.perf_counter()
+    try:
+        cursor = connection.cursor()
+        loaded = cursor.execute(
+            "LOAD DATA LOCAL INFILE %s INTO TABLE user_data "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n' IGNORE 1 LINES "
+            "(name, email, @age) SET user_id = UUID(), age = @age",
+            (os.path.abspath(user_data_file),)
+        )
+        connection.commit()
+
+        if aggregate_file:
+            RunningAggregate.from_summary(
+                server_aggregates(connection)).save(aggregate_file)
+        cursor.close()
+        if progress:
+            progress(loaded, time.perf_counter() - start)
+        return loaded
+    except Error as e:
+        print(f"Error loading data: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Create ALX_prodev.user_data and load a CSV into it")
+    parser.add_argument('csv', nargs='?', default=user_data_file or
+                        'user_data.csv')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--commit-every', type=int, default=100000)
+    parser.add_argument('--load-data', action='store_true',
+                        help="use LOAD DATA LOCAL INFILE")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="load with this many processes in parallel")
+    parser.add_argument('--idempotent', action='store_true',
+                        help="derive user_id from the email and skip rows "
+                             "that are already loaded")
+    parser.add_argument('--checkpoint',
+                        help="resume from and record progress in this file")
+    parser.add_argument('--aggregate-file', default=AGGREGATE_FILE,
+                        help="running age aggregate to keep up to date "
+                             "(default: %(default)s, '' to skip it)")
+    args = parser.parse_args()
+    if args.checkpoint and args.load_data:
+        parser.error("--checkpoint cannot be used with --load-data")
+
+    idempotent = {'deterministic_ids': args.idempotent,
+                  'on_duplicate': 'ignore' if args.idempotent else None}
+
+    if args.workers and not args.load_data:
+        parallel_insert_data(args.csv, args.workers,
+                             aggregate_file=args.aggregate_file,
+                             batch_size=args.batch_size,
+                             commit_every=args.commit_every,
+                             checkpoint_file=args.checkpoint, **idempotent)
+        raise SystemExit(0)
+
+    connection = connect_db()
+    if connection:
+        create_database(connection)
+        connection.close()
+
+        connection = connect_to_prodev(local_infile=args.load_data)
+        if connection:
+            create_table(connection)
+            if args.load_data:
+                load_data_infile(connection, args.csv,
+                                 aggregate_file=args.aggregate_file,
+                                 progress=print_progress)
+            else:
+                insert_data(connection, args.csv,
+                            aggregate_file=args.aggregate_file,
+                            batch_size=args.batch_size,
+                            commit_every=args.commit_every,
+                            progress=print_progress,
+                            checkpoint_file=args.checkpoint, **idempotent)
+            connection.close()